@@ -5,6 +5,9 @@
 
 set -e  # Arrêter le script en cas d'erreur
 
+# Chemin pour les scripts
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Vérification de la présence des fichiers requis
 echo "Vérification des fichiers d'entrée..."
 for file in votu_analysis/vOTUs.faa full_results.tab; do
@@ -16,7 +19,7 @@ done
 
 # Vérification de la présence des scripts requis
 echo "Vérification des scripts requis..."
-for script in f2s seqlengths joincol mcl; do
+for script in joincol mcl; do
     if ! command -v "$script" &> /dev/null; then
         echo "Erreur: Le script/commande $script n'est pas disponible dans le PATH"
         exit 1
@@ -28,7 +31,7 @@ echo
 
 # Étape 1: Génération des longueurs de séquences
 echo "Étape 1: Génération du fichier de longueurs de séquences..."
-cat otu_analysis/vOTUs.faa | f2s | seqlengths > vOTUs.faa.lengths
+python3 "$SCRIPT_DIR/fasta_index.py" lengths otu_analysis/vOTUs.faa > vOTUs.faa.lengths
 
 if [[ ! -s vOTUs.faa.lengths ]]; then
     echo "Erreur: Le fichier vOTUs.faa.lengths n'a pas été créé ou est vide"
@@ -39,7 +42,9 @@ echo "Fichier vOTUs.faa.lengths créé avec succès ($(wc -l < vOTUs.faa.lengths
 
 # Étape 2: Traitement principal avec pipeline
 echo "Étape 2: Traitement principal avec pipeline de filtrage..."
-cat full_results.tab | \
+# full_results.tab est lu depuis son stockage colonnes (full_results.tab.aln, converti une fois) ;
+# les groupes de lignes dont toutes les e-values dépassent 0.05 ne sont pas décompressés
+python3 "$SCRIPT_DIR/alignment_store.py" export full_results.tab --max-evalue 0.05 | \
 joincol vOTUs.faa.lengths | \
 joincol vOTUs.faa.lengths 2 | \
 awk '{
@@ -1,5 +1,7 @@
 #!/bin/bash
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # === PARAMÈTRES ===
 INPUT="vOTUs.faa"
 DB="diamond_db"
@@ -18,9 +20,6 @@ diamond blastp -d "$DB" -q "$INPUT" -o "$OUTPUT" \
   --threads 8
 
 # === 3. Filtrage & construction d’une pseudo-matrice ===
+# Les identifiants sont ramenés aux contigs (suffixe _N retiré) par generate_bray_matrix.py
 awk -v threshold="$EVALUE_THRESHOLD" '$3 <= threshold { print $1 "\t" $2 "\t" $4 }' "$OUTPUT" \
-| rev | sed 's/\t[[:digit:]]\+_/\t/' | rev \
-| sed 's/_[[:digit:]]\+\t/\t/' \
-| sort \
-| ./hashsums \
-| ./tree_bray > "$MATRIX"
+| python3 "$SCRIPT_DIR/generate_bray_matrix.py" --contigs - "$MATRIX"
@@ -1,34 +1,31 @@
-!/bin/bash
+#!/bin/bash
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
 # === PARAMÈTRES ===
 INPUT="viral_analysis_results/prodigal_proteins.faa"
-DB="mmseqs_db"
-RESULT="mmseqs_result"
-TMP="tmp_mmseqs"
+WORK_DIR="mmseqs_chunks"
 OUTPUT="mmseqs_all_vs_all.m8"
 EVALUE_THRESHOLD="0.05"
 MATRIX="similarity_matrix_mm.tsv"
+CHUNKS=16    # chunks de requêtes, chacun reprenable
+JOBS=2       # chunks lancés en parallèle
+THREADS=8    # budget total de cœurs, partagé entre les chunks
 
-# === 1. Création base MMseqs ===
-mmseqs createdb "$INPUT" "$DB"
-
-# === 2. Alignement all-vs-all très sensible ===
-mmseqs search "$DB" "$DB" "$RESULT" "$TMP" \
-  --threads 8 \
+# === 1-3. Alignement all-vs-all très sensible, par chunks reprenables ===
+# Chaque chunk de requêtes est cherché contre la base complète et marqué terminé
+# dans $WORK_DIR ; relancer le script après une interruption ne refait que les
+# chunks manquants, puis les tabulaires (format BLAST 6) sont fusionnés dans $OUTPUT.
+python3 "$SCRIPT_DIR/mmseqs_chunked.py" "$INPUT" -o "$OUTPUT" --work-dir "$WORK_DIR" \
+  --chunks "$CHUNKS" --jobs "$JOBS" --threads "$THREADS" \
   -e "$EVALUE_THRESHOLD" \
+  --max-seqs 100000 \
+  --format-output "query,target,evalue,bits" \
   -c 0.5 \
   --start-sens 7.5 \
-  --min-seq-id 0.0 \
-  --max-seqs 100000
-
-# === 3. Export en format tabulaire style BLAST (format 6) ===
-mmseqs convertalis "$DB" "$DB" "$RESULT" "$OUTPUT" \
-  --format-output "query,target,evalue,bits"
+  --min-seq-id 0.0 || exit 1
 
 # === 4. Filtrage & génération de la matrice de similarité ===
+# Les identifiants sont ramenés aux contigs (suffixe _N retiré) par generate_bray_matrix.py
 awk -v threshold="$EVALUE_THRESHOLD" '$3 <= threshold { print $1 "\t" $2 "\t" $4 }' "$OUTPUT" \
-| rev | sed 's/\t[[:digit:]]\+_/\t/' | rev \
-| sed 's/_[[:digit:]]\+\t/\t/' \
-| sort \
-| ./hashsums \
-| ./tree_bray > "$MATRIX"
\ No newline at end of file
+| python3 "$SCRIPT_DIR/generate_bray_matrix.py" --contigs - "$MATRIX"
\ No newline at end of file
@@ -1,95 +1,322 @@
 import os
 import sys
+import json
+import argparse
+from itertools import combinations
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from upsetplot import UpSet
 import matplotlib
+from alignment_store import (ALIGNMENT_COLUMNS, open_store, source_signature,
+                             store_path_for, is_store_current)
 
 # Empêche les problèmes d'affichage en environnement sans GUI
 matplotlib.use('Agg')
 
+# Outils comparés par défaut : nom -> fichier d'alignements
+DEFAULT_TOOLS = {
+    "mmseqs2(7.5)": "mmseqs_sensitive_result.m8",
+    "fasta36": "full_results.tab",
+}
 
-def load_pairs(filepath, name):
-    """Charge toutes les paires query||target du premier fichier"""
-    if not os.path.exists(filepath):
-        print(f"❌ Fichier non trouvé : {filepath}", file=sys.stderr)
-        return set()
-    
-    print(f"📥 Lecture de {name} depuis {filepath}")
-    pairs = set()
-    chunk_size = 10**6
+# Nombre de tranches de l'espace des paires pour le comptage des combinaisons
+MERGE_PARTS = 64
 
-    for chunk in pd.read_csv(filepath, sep="\t", header=None, usecols=[0, 1], dtype=str, chunksize=chunk_size):
-        pairs.update(chunk[0] + "||" + chunk[1])
+# Mode esquisse : nombre de plus petites valeurs de hachage conservées (bottom-k MinHash)
+SKETCH_SIZE = 65536
+SKETCH_VERSION = 1
+SKETCH_CHUNK_ROWS = 2_000_000
+
+
+def open_stores(tools):
+    """Ouvre le stockage colonnes de chaque outil (les fichiers absents sont ignorés)"""
+    stores = {}
+    for name, filepath in tools.items():
+        if not os.path.exists(filepath):
+            print(f"❌ Fichier non trouvé : {filepath}", file=sys.stderr)
+            continue
+        stores[name] = open_store(filepath)
+    return stores
+
+
+def shared_vocabulary(stores):
+    """Identifiants protéiques de tous les outils, triés : leur rang est l'identifiant entier"""
+    return np.unique(np.concatenate([store.proteins.astype(str) for store in stores.values()]))
 
-    print(f"✅ {name} : {len(pairs):,} paires extraites")
-    return pairs
 
+def vocabulary_codes(store, vocabulary):
+    """Codes du fichier -> codes communs à tous les outils"""
+    return np.searchsorted(vocabulary, store.proteins.astype(str)).astype(np.uint64)
 
-def count_overlap(set1, filepath, name2):
-    """Compare le fichier donné à set1 et compte sans stocker"""
-    common = 0
-    only_in_2 = 0
-    total = 0
 
-    print(f"📥 Streaming de {name2} et comptage...")
+def pack_pairs(codes, query, target):
+    """Paires codées en un uint64 : code commun de query << 32 | code commun de target"""
+    return (codes[query] << np.uint64(32)) | codes[target]
 
-    for chunk in pd.read_csv(filepath, sep="\t", header=None, usecols=[0, 1], dtype=str, chunksize=10**6):
-        for pair in chunk[0] + "||" + chunk[1]:
-            total += 1
-            if pair in set1:
-                common += 1
-            else:
-                only_in_2 += 1
 
-    return total, common, only_in_2
+def load_pairs(store, vocabulary, name):
+    """Paires (query, target) d'un outil, codées query << 32 | target, triées et dédoublonnées"""
+    print(f"📥 Lecture de {name} depuis {store.store_dir}")
+    codes = vocabulary_codes(store, vocabulary)
+    parts = []
+
+    # Seules les colonnes query et target sont décompressées, groupe de lignes par groupe
+    for arrays in store.iter_columns(["query", "target"]):
+        parts.append(np.unique(pack_pairs(codes, arrays["query"], arrays["target"])))
+
+    pairs = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+    print(f"✅ {name} : {len(pairs):,} paires extraites")
+    return pairs
+
 
+def combination_counts(pair_sets, parts=MERGE_PARTS):
+    """Nombre de paires par combinaison exacte d'outils (tableau de 2^N, indexé par masque)
 
-def plot_upset(common, only1, only2):
-    """Génère un UpSet plot à partir des comptes"""
+    Les tableaux triés sont découpés aux mêmes bornes de l'espace des paires ;
+    dans chaque tranche, les paires sont fusionnées (tri stable des segments
+    déjà triés) et le masque des outils contenant chaque paire est obtenu par
+    OU binaire sur ses occurrences.
+    """
+    n_tools = len(pair_sets)
+    counts = np.zeros(2 ** n_tools, dtype=np.int64)
+    mask_dtype = np.uint8 if n_tools <= 8 else np.uint32
+    sample = np.sort(np.concatenate([pairs[::max(1, len(pairs) // parts)] for pairs in pair_sets]))
+    bounds = np.unique(sample[np.arange(1, parts) * len(sample) // parts]) if len(sample) else []
+    starts = [0] * n_tools
+    for bound in list(bounds) + [None]:
+        keys, masks = [], []
+        for k, pairs in enumerate(pair_sets):
+            stop = len(pairs) if bound is None else int(np.searchsorted(pairs, bound, side='right'))
+            keys.append(pairs[starts[k]:stop])
+            masks.append(np.full(stop - starts[k], 1 << k, dtype=mask_dtype))
+            starts[k] = stop
+        keys = np.concatenate(keys)
+        if len(keys) == 0:
+            continue
+        order = np.argsort(keys, kind='stable')
+        keys, masks = keys[order], np.concatenate(masks)[order]
+        first = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        counts += np.bincount(np.bitwise_or.reduceat(masks, first), minlength=len(counts))
+    return counts
+
+
+def plot_upset(names, counts, output="plots/upset_plot.png"):
+    """Génère un UpSet plot à N outils à partir des comptes par combinaison"""
     from upsetplot import UpSet
-    import pandas as pd
     import matplotlib.pyplot as plt
 
     print("📊 Génération du UpSet plot...")
 
+    masks = [mask for mask in range(1, len(counts)) if counts[mask] > 0]
     data = pd.Series(
-        [common, only1, only2],
+        [counts[mask] for mask in masks],
         index=pd.MultiIndex.from_tuples(
-            [
-                (True, True),
-                (True, False),
-                (False, True)
-            ],
-            names=["mmseqs2", "fasta36"]
+            [tuple(bool(mask >> k & 1) for k in range(len(names))) for mask in masks],
+            names=names
         )
     )
 
-    os.makedirs("plots", exist_ok=True)
-    upset = UpSet(data, subset_size='count', show_counts=True)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    upset = UpSet(data, subset_size='sum', show_counts=True)
     upset.plot()
     plt.suptitle("UpSet Plot - Recouvrement des paires alignées")
-    plt.savefig("plots/upset_plot.png", dpi=300, bbox_inches="tight")
+    plt.savefig(output, dpi=300, bbox_inches="tight")
     plt.close()
-    print("✅ UpSet plot enregistré dans plots/upset_plot.png")
+    print(f"✅ UpSet plot enregistré dans {output}")
+
+
+def sketch_path_for(source):
+    return f"{source}.sketch.npz"
+
+
+def hash_ids(values):
+    """Hachage 64 bits stable des identifiants (indépendant de tout dictionnaire de codes)"""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def mix64(x):
+    """Finaliseur splitmix64, vectorisé"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def pair_hashes(query_hashes, target_hashes):
+    # Asymétrique : (a, b) et (b, a) sont deux paires distinctes
+    return mix64(query_hashes ^ mix64(target_hashes + np.uint64(0x9e3779b97f4a7c15)))
+
+
+def iter_pair_hashes(filepath):
+    """Hachages des paires d'un fichier, bloc par bloc
+
+    Le stockage colonnes est lu s'il est à jour ; sinon le texte est lu
+    directement par morceaux, sans conversion.
+    """
+    store_dir = store_path_for(filepath)
+    if is_store_current(store_dir, filepath):
+        store = open_store(filepath)
+        protein_hashes = hash_ids(store.proteins)
+        for arrays in store.iter_columns(["query", "target"]):
+            yield pair_hashes(protein_hashes[arrays["query"]], protein_hashes[arrays["target"]])
+        return
+    reader = pd.read_csv(filepath, sep="\t", header=None, usecols=[0, 1],
+                         names=ALIGNMENT_COLUMNS[:2], dtype=str,
+                         chunksize=SKETCH_CHUNK_ROWS)
+    for chunk in reader:
+        chunk = chunk[~chunk["query"].str.startswith('#', na=True)].dropna()
+        yield pair_hashes(hash_ids(chunk["query"]), hash_ids(chunk["target"]))
+
+
+def build_sketch(filepath, name, size=SKETCH_SIZE):
+    """Esquisse bottom-k des paires d'un fichier en une passe, mémoire bornée par size
+
+    L'esquisse est enregistrée dans <fichier>.sketch.npz et réutilisée tant
+    que le fichier ne change pas. Un fichier .sketch.npz peut être donné
+    directement (comparaison à une esquisse d'un run précédent).
+    """
+    if filepath.endswith(".sketch.npz"):
+        return load_sketch(filepath)
+    sketch_file = sketch_path_for(filepath)
+    signature = json.dumps(source_signature(filepath), sort_keys=True)
+    if os.path.exists(sketch_file):
+        sketch = load_sketch(sketch_file)
+        if sketch['signature'] == signature and sketch['size'] == size:
+            print(f"♻️  {name} : esquisse relue depuis {sketch_file}")
+            return sketch
+
+    print(f"📥 Esquisse de {name} depuis {filepath}")
+    hashes = np.empty(0, dtype=np.uint64)
+    rows = 0
+    for block in iter_pair_hashes(filepath):
+        rows += len(block)
+        # np.unique trie : les size premières valeurs sont les plus petites
+        hashes = np.unique(np.concatenate((hashes, np.unique(block)[:size])))[:size]
+
+    tmp_file = f"{sketch_file}.tmp.npz"
+    np.savez(tmp_file, hashes=hashes, size=size, rows=rows, signature=signature,
+             version=SKETCH_VERSION)
+    os.replace(tmp_file, sketch_file)
+    print(f"✅ {name} : {rows:,} lignes, esquisse de {len(hashes):,} valeurs -> {sketch_file}")
+    return {'hashes': hashes, 'size': size, 'rows': rows, 'signature': signature}
+
+
+def load_sketch(sketch_file):
+    with np.load(sketch_file) as data:
+        if int(data['version']) != SKETCH_VERSION:
+            raise ValueError(f"Version d'esquisse non reconnue: {sketch_file}")
+        return {'hashes': data['hashes'], 'size': int(data['size']), 'rows': int(data['rows']),
+                'signature': str(data['signature'])}
+
+
+def estimate_cardinality(hashes, size):
+    """(estimation, écart-type) du nombre de paires distinctes ; exact sous size valeurs"""
+    if len(hashes) < size:
+        return float(len(hashes)), 0.0
+    # k-ième plus petite valeur ramenée dans [0, 1]
+    kth = (float(hashes[size - 1]) + 1.0) / 2.0 ** 64
+    estimate = (size - 1) / kth
+    return estimate, estimate / np.sqrt(size - 2)
+
+
+def compare_sketches(sketch_a, sketch_b):
+    """Estimations des paires, de l'intersection et de Jaccard entre deux esquisses"""
+    size = min(sketch_a['size'], sketch_b['size'])
+    a, b = sketch_a['hashes'][:size], sketch_b['hashes'][:size]
+    union = np.union1d(a, b)[:size]
+    # Toute valeur de union présente dans un fichier est dans son esquisse (elle est
+    # sous le k-ième minimum de ce fichier)
+    both = np.isin(union, a, assume_unique=True) & np.isin(union, b, assume_unique=True)
+    k = len(union)
+    jaccard = both.sum() / k if k else 0.0
+    exact = len(a) < size and len(b) < size
+    jaccard_sd = 0.0 if exact else np.sqrt(jaccard * (1 - jaccard) / k)
+    union_count, union_sd = estimate_cardinality(union, size)
+    intersection = jaccard * union_count
+    if jaccard > 0:
+        intersection_sd = intersection * np.hypot(jaccard_sd / jaccard,
+                                                  union_sd / union_count if union_count else 0.0)
+    else:
+        intersection_sd = union_count * jaccard_sd
+    count_a, sd_a = estimate_cardinality(a, size)
+    count_b, sd_b = estimate_cardinality(b, size)
+    return {
+        'pairs_a': count_a, 'pairs_a_sd': sd_a, 'pairs_b': count_b, 'pairs_b_sd': sd_b,
+        'union': union_count, 'union_sd': union_sd,
+        'intersection': intersection, 'intersection_sd': intersection_sd,
+        'jaccard': jaccard, 'jaccard_sd': jaccard_sd,
+    }
+
+
+def report_sketches(tools, size, output):
+    """Mode esquisse : estimations deux à deux, affichées et écrites en TSV (IC à 95 %)"""
+    sketches = {}
+    for name, filepath in tools.items():
+        if not os.path.exists(filepath):
+            print(f"❌ Fichier non trouvé : {filepath}", file=sys.stderr)
+            continue
+        sketches[name] = build_sketch(filepath, name, size)
+    if len(sketches) < 2:
+        print("❌ Au moins deux fichiers d'alignements sont nécessaires", file=sys.stderr)
+        sys.exit(1)
+
+    rows = []
+    print("\n📊 Estimations (± IC 95 %) :")
+    for name_a, name_b in combinations(sketches, 2):
+        stats = compare_sketches(sketches[name_a], sketches[name_b])
+        print(f"🔹 {name_a} : {stats['pairs_a']:,.0f} ± {1.96 * stats['pairs_a_sd']:,.0f} paires")
+        print(f"🔹 {name_b} : {stats['pairs_b']:,.0f} ± {1.96 * stats['pairs_b_sd']:,.0f} paires")
+        print(f"✅ En commun : {stats['intersection']:,.0f} ± {1.96 * stats['intersection_sd']:,.0f}")
+        print(f"📐 Jaccard {name_a} / {name_b} : {stats['jaccard']:.4f} ± {1.96 * stats['jaccard_sd']:.4f}")
+        rows.append({'tool_a': name_a, 'tool_b': name_b, **stats})
+
+    sketch_file = os.path.splitext(output)[0] + "_sketch.tsv"
+    os.makedirs(os.path.dirname(sketch_file) or ".", exist_ok=True)
+    pd.DataFrame(rows).to_csv(sketch_file, sep="\t", index=False, float_format="%.6g")
+    print(f"✅ Estimations enregistrées dans {sketch_file}")
 
 
 def main():
-    name1, file1 = "mmseqs2(7.5)", "mmseqs_sensitive_result.m8"
-    name2, file2 = "fasta36", "full_results.tab"
+    parser = argparse.ArgumentParser(description="Recouvrement des paires alignées entre N outils")
+    parser.add_argument("--tool", action="append", default=None, metavar="NOM=FICHIER",
+                        help="Outil à comparer (répétable ; défaut: mmseqs2(7.5) et fasta36)")
+    parser.add_argument("-o", "--output", default="plots/upset_plot.png")
+    parser.add_argument("--sketch", action="store_true",
+                        help="Estimation rapide par esquisses MinHash (FICHIER peut être un .sketch.npz)")
+    parser.add_argument("--sketch-size", type=int, default=SKETCH_SIZE)
+    args = parser.parse_args()
 
-    set1 = load_pairs(file1, name1)
-    total2, common, only2 = count_overlap(set1, file2, name2)
-    only1 = len(set1) - common
+    tools = DEFAULT_TOOLS
+    if args.tool:
+        tools = dict(tool.split("=", 1) for tool in args.tool)
+    if args.sketch:
+        report_sketches(tools, args.sketch_size, args.output)
+        return
+    stores = open_stores(tools)
+    if len(stores) < 2:
+        print("❌ Au moins deux fichiers d'alignements sont nécessaires", file=sys.stderr)
+        sys.exit(1)
+
+    names = list(stores)
+    vocabulary = shared_vocabulary(stores)
+    pair_sets = [load_pairs(stores[name], vocabulary, name) for name in names]
+    counts = combination_counts(pair_sets)
 
     print("\n📊 Résumé :")
-    print(f"🔹 {name1} : {len(set1):,} paires")
-    print(f"🔹 {name2} : {total2:,} paires (streamé)")
-    print(f"✅ En commun : {common:,}")
-    print(f"➖ Uniques {name1} : {only1:,}")
-    print(f"➖ Uniques {name2} : {only2:,}")
+    for name, pairs in zip(names, pair_sets):
+        print(f"🔹 {name} : {len(pairs):,} paires")
+    for mask in range(1, len(counts)):
+        members = [name for k, name in enumerate(names) if mask >> k & 1]
+        label = "En commun" if len(members) == len(names) else (
+            f"Uniques {members[0]}" if len(members) == 1 else f"Seulement {' + '.join(members)}")
+        print(f"{'✅' if len(members) > 1 else '➖'} {label} : {counts[mask]:,}")
+
+    counts_file = os.path.splitext(args.output)[0] + "_counts.tsv"
+    os.makedirs(os.path.dirname(counts_file) or ".", exist_ok=True)
+    pd.DataFrame([{**{name: bool(mask >> k & 1) for k, name in enumerate(names)}, "pairs": counts[mask]}
+                  for mask in range(1, len(counts))]).to_csv(counts_file, sep="\t", index=False)
 
-    plot_upset(common, only1, only2)
+    plot_upset(names, counts, args.output)
 
 
 if __name__ == "__main__":
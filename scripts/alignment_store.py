@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Stockage binaire en colonnes des alignements au format tabulaire 12 colonnes
+
+Les sorties MMseqs2 (vOTUs_alignment.tsv), DIAMOND (diamond_all_vs_all_12cols.tsv)
+et FASTA36 (full_results.tab) sont converties une seule fois dans un dossier
+<fichier>.aln/ :
+    manifest.json     colonnes, types, groupes de lignes et min/max d'e-value
+    proteins.txt      dictionnaire des identifiants (code = numéro de ligne)
+    contigs.txt       dictionnaire des contigs (identifiant sans le suffixe _N du gène)
+    protein_contig.npy  code contig de chaque protéine
+    rg_<n>.npz        un groupe de lignes, une entrée compressée par colonne
+
+query et target sont stockés en codes uint32, les autres colonnes avec leur type
+numérique. Une lecture ne décompresse que les colonnes demandées, et un filtre
+sur l'e-value saute les groupes dont l'e-value minimale dépasse le seuil. Le
+dossier est reconstruit si le fichier source change (taille ou date).
+
+Usage:
+    python alignment_store.py convert vOTUs_alignment.tsv
+    python alignment_store.py pairs vOTUs_alignment.tsv -e 0.05 --contigs
+    python alignment_store.py export full_results.tab --max-evalue 0.05
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT_COLUMNS = ["query", "target", "pident", "alnlen", "mismatch", "gapopen",
+                     "qstart", "qend", "tstart", "tend", "evalue", "bits"]
+COLUMN_DTYPES = {
+    "query": "uint32",
+    "target": "uint32",
+    "pident": "float32",
+    "alnlen": "int32",
+    "mismatch": "int32",
+    "gapopen": "int32",
+    "qstart": "int32",
+    "qend": "int32",
+    "tstart": "int32",
+    "tend": "int32",
+    "evalue": "float64",
+    "bits": "float32",
+}
+ID_COLUMNS = ("query", "target")
+MANIFEST_NAME = "manifest.json"
+STORE_VERSION = 2
+
+# Même nettoyage que sed 's/_[0-9]\+\t/\t/' dans pipeline4.sh : on retire le numéro de gène
+GENE_SUFFIX = re.compile(r'_[0-9]+$')
+
+
+def store_path_for(source):
+    return f"{source}.aln"
+
+
+def contig_of(protein_id):
+    return GENE_SUFFIX.sub('', protein_id)
+
+
+def source_signature(source):
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def is_store_current(store_dir, source):
+    manifest_file = os.path.join(store_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_file):
+        return False
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    return (manifest.get('version') == STORE_VERSION
+            and manifest.get('source') == source_signature(source))
+
+
+def encode_ids(values, codes):
+    """Codes entiers des identifiants ; les nouveaux sont ajoutés au dictionnaire"""
+    for value in pd.unique(values):
+        if value not in codes:
+            codes[value] = len(codes)
+    return values.map(codes).to_numpy(dtype=np.uint32)
+
+
+def convert(source, store_dir=None, row_group_size=1_000_000):
+    """Convertit un fichier d'alignements 12 colonnes en dossier colonnes"""
+    store_dir = store_dir or store_path_for(source)
+    tmp_dir = store_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    signature = source_signature(source)
+    codes = {}
+    row_groups = []
+    total = 0
+    reader = pd.read_csv(source, sep="\t", header=None, names=ALIGNMENT_COLUMNS,
+                         usecols=range(len(ALIGNMENT_COLUMNS)),
+                         dtype={"query": str, "target": str}, float_precision="round_trip",
+                         chunksize=row_group_size)
+    for chunk in reader:
+        # Lignes de commentaires FASTA36 (#...) et lignes incomplètes
+        chunk = chunk[~chunk["query"].str.startswith('#', na=True)]
+        for col in ALIGNMENT_COLUMNS[2:]:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+        chunk = chunk.dropna()
+        if chunk.empty:
+            continue
+
+        arrays = {}
+        for col in ALIGNMENT_COLUMNS:
+            if col in ID_COLUMNS:
+                arrays[col] = encode_ids(chunk[col], codes)
+            else:
+                arrays[col] = chunk[col].to_numpy(dtype=COLUMN_DTYPES[col])
+        name = f"rg_{len(row_groups):05d}.npz"
+        np.savez_compressed(os.path.join(tmp_dir, name), **arrays)
+        row_groups.append({
+            'file': name,
+            'rows': len(chunk),
+            'evalue_min': float(arrays["evalue"].min()),
+            'evalue_max': float(arrays["evalue"].max()),
+        })
+        total += len(chunk)
+
+    proteins = list(codes)
+    contig_codes = {}
+    protein_contig = np.empty(len(proteins), dtype=np.uint32)
+    for i, protein in enumerate(proteins):
+        contig = contig_of(protein)
+        if contig not in contig_codes:
+            contig_codes[contig] = len(contig_codes)
+        protein_contig[i] = contig_codes[contig]
+
+    with open(os.path.join(tmp_dir, "proteins.txt"), 'w') as f:
+        f.writelines(f"{protein}\n" for protein in proteins)
+    with open(os.path.join(tmp_dir, "contigs.txt"), 'w') as f:
+        f.writelines(f"{contig}\n" for contig in contig_codes)
+    np.save(os.path.join(tmp_dir, "protein_contig.npy"), protein_contig)
+
+    manifest = {
+        'version': STORE_VERSION,
+        'source': signature,
+        'columns': COLUMN_DTYPES,
+        'rows': total,
+        'row_groups': row_groups,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    logger.info(f"Alignements convertis: {source} -> {store_dir} "
+                f"({total} lignes, {len(proteins)} protéines, {len(row_groups)} groupes)")
+    return store_dir
+
+
+class AlignmentStore:
+    """Lecture par colonnes d'un dossier d'alignements converti"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, MANIFEST_NAME), 'r') as f:
+            self.manifest = json.load(f)
+        self._proteins = None
+        self._contigs = None
+        self._protein_contig = None
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    @property
+    def proteins(self):
+        if self._proteins is None:
+            with open(os.path.join(self.store_dir, "proteins.txt"), 'r') as f:
+                self._proteins = np.array([line.rstrip('\n') for line in f], dtype=object)
+        return self._proteins
+
+    @property
+    def contigs(self):
+        if self._contigs is None:
+            with open(os.path.join(self.store_dir, "contigs.txt"), 'r') as f:
+                self._contigs = np.array([line.rstrip('\n') for line in f], dtype=object)
+        return self._contigs
+
+    @property
+    def protein_contig(self):
+        if self._protein_contig is None:
+            self._protein_contig = np.load(os.path.join(self.store_dir, "protein_contig.npy"))
+        return self._protein_contig
+
+    def row_groups(self, max_evalue=None):
+        """Groupes de lignes pouvant contenir des e-values <= max_evalue"""
+        for group in self.manifest['row_groups']:
+            if max_evalue is not None and group['evalue_min'] > max_evalue:
+                continue
+            yield group
+
+    def iter_columns(self, columns, max_evalue=None, contigs=False):
+        """Renvoie, groupe par groupe, {colonne: tableau} des seules colonnes demandées
+
+        Avec contigs=True, query et target sont donnés en codes de contigs.
+        """
+        for group in self.row_groups(max_evalue):
+            with np.load(os.path.join(self.store_dir, group['file'])) as data:
+                arrays = {col: data[col] for col in columns}
+                if max_evalue is not None and group['evalue_max'] > max_evalue:
+                    evalue = arrays["evalue"] if "evalue" in arrays else data["evalue"]
+                    mask = evalue <= max_evalue
+                    arrays = {col: values[mask] for col, values in arrays.items()}
+            if contigs:
+                for col in ID_COLUMNS:
+                    if col in arrays:
+                        arrays[col] = self.protein_contig[arrays[col]]
+            yield arrays
+
+    def read(self, columns, max_evalue=None, contigs=False):
+        """Toutes les lignes (filtrées) des colonnes demandées, concaténées"""
+        parts = {col: [] for col in columns}
+        for arrays in self.iter_columns(columns, max_evalue, contigs):
+            for col in columns:
+                parts[col].append(arrays[col])
+        return {col: (np.concatenate(values) if values
+                      else np.empty(0, dtype=COLUMN_DTYPES[col]))
+                for col, values in parts.items()}
+
+    def decode(self, codes, contigs=False):
+        return (self.contigs if contigs else self.proteins)[codes]
+
+    def read_frame(self, columns, max_evalue=None, contigs=False):
+        """DataFrame des colonnes demandées, identifiants décodés en texte"""
+        arrays = self.read(columns, max_evalue, contigs)
+        for col in ID_COLUMNS:
+            if col in arrays:
+                arrays[col] = self.decode(arrays[col], contigs)
+        return pd.DataFrame(arrays, columns=columns)
+
+
+def open_store(source, store_dir=None, row_group_size=1_000_000):
+    """Ouvre le stockage colonnes d'un fichier d'alignements, converti au besoin
+
+    source peut aussi être directement un dossier .aln déjà converti.
+    """
+    if os.path.isdir(source) and os.path.exists(os.path.join(source, MANIFEST_NAME)):
+        return AlignmentStore(source)
+    store_dir = store_dir or store_path_for(source)
+    if not is_store_current(store_dir, source):
+        convert(source, store_dir, row_group_size)
+    return AlignmentStore(store_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockage en colonnes des alignements 12 colonnes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Convertit (ou met à jour) le stockage")
+    convert_parser.add_argument("alignments")
+    convert_parser.add_argument("-o", "--store", default=None, help="Dossier de sortie (défaut: <fichier>.aln)")
+    convert_parser.add_argument("--row-group-size", type=int, default=1_000_000)
+
+    pairs_parser = subparsers.add_parser("pairs", help="Écrit query, target, bits pour evalue <= seuil")
+    pairs_parser.add_argument("alignments")
+    pairs_parser.add_argument("-e", "--evalue", type=float, default=0.05)
+    pairs_parser.add_argument("--contigs", action="store_true",
+                              help="Identifiants de contigs (suffixe _N du gène retiré)")
+    pairs_parser.add_argument("--no-self", action="store_true",
+                              help="Exclure les auto-alignements (query == target)")
+
+    export_parser = subparsers.add_parser("export", help="Réécrit les colonnes demandées en TSV")
+    export_parser.add_argument("alignments")
+    export_parser.add_argument("--max-evalue", type=float, default=None)
+    export_parser.add_argument("--columns", nargs="+", default=ALIGNMENT_COLUMNS,
+                               choices=ALIGNMENT_COLUMNS)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
+                        stream=sys.stderr)
+
+    if args.command == "convert":
+        convert(args.alignments, args.store, args.row_group_size)
+        return
+
+    store = open_store(args.alignments)
+    out = sys.stdout
+    # Sans float_format, pandas écrit la plus courte écriture qui redonne la valeur stockée
+    # (float32 ou float64) : bitscores et e-values ressortent comme dans le fichier source
+    if args.command == "pairs":
+        for arrays in store.iter_columns(["query", "target", "bits"], args.evalue):
+            query, target, bits = arrays["query"], arrays["target"], arrays["bits"]
+            if args.no_self:
+                keep = query != target
+                query, target, bits = query[keep], target[keep], bits[keep]
+            if args.contigs:
+                query, target = store.protein_contig[query], store.protein_contig[target]
+            frame = pd.DataFrame({
+                "query": store.decode(query, args.contigs),
+                "target": store.decode(target, args.contigs),
+                "bits": bits,
+            })
+            frame.to_csv(out, sep="\t", header=False, index=False)
+    elif args.command == "export":
+        for arrays in store.iter_columns(args.columns, args.max_evalue):
+            for col in ID_COLUMNS:
+                if col in arrays:
+                    arrays[col] = store.decode(arrays[col])
+            frame = pd.DataFrame(arrays, columns=args.columns)
+            frame.to_csv(out, sep="\t", header=False, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 import os
+import json
+import argparse
 import pandas as pd
 import logging
 from collections import defaultdict
-import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
+from benchmark_index import stream_ids
+from output_pack import PackReader, PACKED_TOOLS
 
 # Configuration du logging
 logging.basicConfig(
@@ -17,169 +21,292 @@ logger = logging.getLogger()
 tsv_path = "benchmark.tsv"
 output_dir = "output_analysis"
 status_file = os.path.join(output_dir, "processing_status.tsv")
+pack_dir = os.path.join(output_dir, "packs")  # Sorties empaquetées par script_genomad_checkv.py
+metrics_file = os.path.join(output_dir, "tool_metrics.tsv")  # Métriques écrites par script_genomad_checkv.py
 
 def load_expected_sequences():
     """Charge les séquences qui devraient être traitées"""
     try:
         logger.info(f"Lecture du fichier {tsv_path}")
-        df = pd.read_csv(tsv_path, sep='\t', header=None, low_memory=False)
-        seq_ids = df[0].tolist()  # Première colonne = IDs
+        # Seule la première colonne (IDs) est lue, les séquences ne sont pas chargées
+        seq_ids = list(stream_ids(tsv_path))
         logger.info(f"Nombre de séquences attendues: {len(seq_ids)}")
         return seq_ids
     except Exception as e:
         logger.error(f"Erreur lors de la lecture du fichier TSV: {e}")
         return []
 
-def analyze_genomad_on_disk(seq_id):
-    """Analyse les résultats geNomad directement sur disque"""
-    # Format du dossier: seq{id}_genomad
-    genomad_output = os.path.join(output_dir, f"seq{seq_id}_genomad")
-    
-    if not os.path.exists(genomad_output):
-        return "not_started"
-    
-    # Chercher tous les fichiers de sortie possibles
-    all_files = glob.glob(os.path.join(genomad_output, "*"))
-    
-    if not all_files:
-        return "directory_empty"
-    
-    # Fichiers de résultats geNomad typiques
-    plasmid_summary = os.path.join(genomad_output, f"seq{seq_id}_plasmid_summary.tsv")
-    virus_summary = os.path.join(genomad_output, f"seq{seq_id}_virus_summary.tsv")
-    
-    # Autres fichiers possibles (geNomad peut utiliser différents noms)
-    possible_files = [
-        os.path.join(genomad_output, f"seq{seq_id}_summary", f"seq{seq_id}_plasmid_summary.tsv"),
-        os.path.join(genomad_output, f"seq{seq_id}_summary", f"seq{seq_id}_virus_summary.tsv"),
-        os.path.join(genomad_output, "plasmid_summary.tsv"),
-        os.path.join(genomad_output, "virus_summary.tsv")
-    ]
-    
-    # Chercher aussi dans les sous-dossiers
-    for root, dirs, files in os.walk(genomad_output):
-        for file in files:
-            if "plasmid_summary" in file or "virus_summary" in file:
-                possible_files.append(os.path.join(root, file))
-    
-    # Vérifier la présence des fichiers summary
-    found_summaries = []
-    for file_path in [plasmid_summary, virus_summary] + possible_files:
-        if os.path.exists(file_path):
-            found_summaries.append(file_path)
-    
-    if not found_summaries:
-        # Peut-être en cours de traitement - chercher d'autres indices
-        log_files = [f for f in all_files if f.endswith('.log')]
-        tmp_files = [f for f in all_files if 'tmp' in f.lower() or f.endswith('.tmp')]
-        
-        if log_files or tmp_files:
-            return "in_progress_maybe"
-        else:
-            return "incomplete_no_summary"
-    
-    # Analyser le contenu des fichiers summary trouvés
-    results_found = False
+# --- Index du disque ---
+# Un seul parcours os.scandir de output_dir recense, pour chaque dossier
+# seq{id}_genomad / seq{id}_checkv, les fichiers summary/quality, logs et tmp.
+# Les dossiers sont parcourus en parallèle (threads) car sur un système de
+# fichiers réseau le coût est dominé par la latence des stat.
+scan_workers = 16
+TOOL_DIR_PATTERN = re.compile(r"seq(.+)_(genomad|checkv)$")
+
+# Cache du scan : statut dérivé et mtimes des dossiers, réutilisés tant que
+# rien n'a changé. Les statuts terminaux ne sont jamais réexaminés.
+scan_cache_file = os.path.join(output_dir, "disk_scan_cache.json")
+TERMINAL_DISK_STATUSES = {'completed_with_hits', 'completed_no_hits', 'completed_with_results'}
+
+def has_rows(file_path):
+    """Vrai si le fichier contient plus qu'une ligne d'en-tête (sans lire tout le fichier)"""
+    with open(file_path, 'rb') as f:
+        header_seen = False
+        while True:
+            chunk = f.read(65536)
+            if not chunk:
+                return False
+            if header_seen:
+                return True
+            newline = chunk.find(b'\n')
+            if newline != -1:
+                if newline + 1 < len(chunk):
+                    return True
+                header_seen = True
+
+def scan_tool_directory(dir_path, tool):
+    """Parcourt récursivement un dossier geNomad/CheckV et résume son contenu"""
+    marker = ("plasmid_summary", "virus_summary") if tool == "genomad" else ("quality_summary",)
+    info = {'top_files': [], 'results': [], 'mtimes': {}}
+
+    stack = [(dir_path, True)]
+    while stack:
+        path, is_top = stack.pop()
+        # mtime relevé avant le parcours : une modification pendant le scan
+        # sera détectée au prochain lancement
+        info['mtimes'][os.path.relpath(path, dir_path)] = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            for entry in it:
+                if is_top and not entry.name.startswith('.'):
+                    info['top_files'].append(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                elif any(m in entry.name for m in marker):
+                    result = {'path': entry.path, 'name': entry.name, 'top': is_top}
+                    try:
+                        result['size'] = entry.stat().st_size
+                        result['has_rows'] = result['size'] > 0 and has_rows(entry.path)
+                    except Exception as e:
+                        result['error'] = str(e)
+                    info['results'].append(result)
+    return info
+
+def packed_tool_info(reader, members, tool_dir_name, tool):
+    """Construit, à partir des fichiers empaquetés, la même description qu'un scan de dossier"""
+    marker = ("plasmid_summary", "virus_summary") if tool == "genomad" else ("quality_summary",)
+    info = {'top_files': [], 'results': [], 'mtimes': {}}
+    for member in members:
+        parts = member[0].split(os.sep)
+        if parts[0] != tool_dir_name:
+            continue
+        name = parts[-1]
+        is_top = len(parts) == 2
+        # Comme os.scandir, le premier niveau liste aussi les sous-dossiers
+        if parts[1] not in info['top_files']:
+            info['top_files'].append(parts[1])
+        if any(m in name for m in marker):
+            result = {'path': member[0], 'name': name, 'top': is_top}
+            try:
+                data = reader.read_member(member)
+                newline = data.find(b'\n')
+                result['size'] = len(data)
+                result['has_rows'] = newline != -1 and newline + 1 < len(data)
+            except Exception as e:
+                result['error'] = str(e)
+            info['results'].append(result)
+    return info
+
+def index_packed_sequences(disk_index):
+    """Ajoute à l'index les séquences dont les sorties ont été empaquetées"""
+    if not os.path.exists(pack_dir):
+        return 0
+    reader = PackReader(pack_dir)
+    count = 0
     try:
-        for file_path in found_summaries:
-            if os.path.getsize(file_path) > 0:  # Fichier non vide
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-                    if len(lines) > 1:  # Plus qu'un header
-                        results_found = True
-                        break
-        
-        if results_found:
-            return "completed_with_hits"
-        else:
-            return "completed_no_hits"
-            
+        for packed_id, members in reader.index.items():
+            for tool in PACKED_TOOLS:
+                tool_dir_name = f"{packed_id}_{tool}"
+                match = TOOL_DIR_PATTERN.match(tool_dir_name)
+                # Un dossier encore présent sur disque est plus récent que le paquet
+                if match is None or tool in disk_index.get(match.group(1), {}):
+                    continue
+                info = packed_tool_info(reader, members, tool_dir_name, tool)
+                if not info['top_files']:
+                    continue
+                seq_id = match.group(1)
+                if tool == 'genomad':
+                    disk_index[seq_id][tool] = analyze_genomad_on_disk(info)
+                else:
+                    disk_index[seq_id][tool] = analyze_checkv_on_disk(info, seq_id)
+                count += 1
+    finally:
+        reader.close()
+    return count
+
+def load_scan_cache(rescan=False):
+    if rescan or not os.path.exists(scan_cache_file):
+        return {}
+    try:
+        with open(scan_cache_file, 'r') as f:
+            return json.load(f)
     except Exception as e:
-        return f"error_reading: {str(e)[:50]}"
+        logger.warning(f"Cache de scan illisible, scan complet: {e}")
+        return {}
 
-def analyze_checkv_on_disk(seq_id):
-    """Analyse les résultats CheckV directement sur disque"""
-    # Format du dossier: seq{id}_checkv
-    checkv_output = os.path.join(output_dir, f"seq{seq_id}_checkv")
-    
-    if not os.path.exists(checkv_output):
-        return "not_started"
-    
-    # Chercher tous les fichiers
-    all_files = glob.glob(os.path.join(checkv_output, "*"))
-    
-    if not all_files:
-        return "directory_empty"
-    
-    # Fichier de qualité CheckV
-    quality_file = os.path.join(checkv_output, "quality_summary.tsv")
-    
-    # Autres emplacements possibles
-    possible_quality_files = [
-        os.path.join(checkv_output, f"seq{seq_id}_quality_summary.tsv"),
-        os.path.join(checkv_output, "checkv_quality_summary.tsv"),
-    ]
-    
-    # Chercher aussi dans les sous-dossiers
-    for root, dirs, files in os.walk(checkv_output):
-        for file in files:
-            if "quality_summary" in file:
-                possible_quality_files.append(os.path.join(root, file))
-    
-    # Trouver le fichier de qualité
-    quality_file_found = None
-    for qf in [quality_file] + possible_quality_files:
-        if os.path.exists(qf):
-            quality_file_found = qf
-            break
-    
-    if not quality_file_found:
-        # Peut-être en cours - chercher d'autres indices
-        log_files = [f for f in all_files if f.endswith('.log')]
-        tmp_files = [f for f in all_files if 'tmp' in f.lower() or f.endswith('.tmp')]
-        
-        if log_files or tmp_files:
-            return "in_progress_maybe"
-        else:
-            return "incomplete_no_quality"
-    
+def save_scan_cache(cache):
+    tmp_path = scan_cache_file + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, scan_cache_file)
+
+def is_cache_entry_valid(entry, dir_path):
+    """Une entrée reste valide si son statut est terminal ou si aucun dossier n'a changé de mtime
+
+    Une entrée issue d'un scan en erreur (NFS indisponible...) n'est jamais valide.
+    """
+    if 'error' in entry:
+        return False
+    if entry['status'] in TERMINAL_DISK_STATUSES:
+        return True
     try:
-        if os.path.getsize(quality_file_found) == 0:
-            return "quality_file_empty"
-        
-        # Vérifier le contenu
-        with open(quality_file_found, 'r') as f:
-            lines = f.readlines()
-            if len(lines) <= 1:  # Seulement header ou vide
-                return "completed_no_results"
-            else:
-                return "completed_with_results"
-                
+        for rel_path, mtime in entry['mtimes'].items():
+            if os.stat(os.path.join(dir_path, rel_path)).st_mtime_ns != mtime:
+                return False
+    except OSError:
+        return False
+    return True
+
+def inspect_tool_directory(seq_id, tool, dir_path, cached):
+    """Renvoie l'entrée de cache {'status', 'mtimes'} d'un dossier, rescanné si nécessaire"""
+    if cached is not None and is_cache_entry_valid(cached, dir_path):
+        return cached, False
+    try:
+        info = scan_tool_directory(dir_path, tool)
     except Exception as e:
-        return f"error_reading: {str(e)[:50]}"
+        info = {'error': str(e), 'mtimes': {}}
+    if tool == 'genomad':
+        status = analyze_genomad_on_disk(info)
+    else:
+        status = analyze_checkv_on_disk(info, seq_id)
+    entry = {'status': status, 'mtimes': info['mtimes']}
+    # Erreur du dossier ou d'un fichier de résultats (stat, lecture) : l'entrée
+    # n'est ni mise en cache ni réutilisée, les mtimes ne changeant pas
+    errors = [info['error']] if 'error' in info else []
+    errors += [result['error'] for result in info.get('results', []) if 'error' in result]
+    if errors:
+        entry['error'] = errors[0]
+    return entry, True
 
-def scan_existing_directories():
-    """Scanne les dossiers existants pour identifier les séquences déjà traitées"""
-    logger.info("Scan des dossiers existants...")
-    
-    existing_sequences = set()
-    
+def build_disk_index(rescan=False):
+    """Construit {seq_id: {'genomad': statut, 'checkv': statut}} en un passage sur output_dir.
+
+    Seuls les dossiers absents du cache ou modifiés depuis le dernier lancement
+    sont réexaminés ; rescan=True ignore le cache.
+    """
+    disk_index = defaultdict(dict)
     if not os.path.exists(output_dir):
         logger.warning(f"Le dossier {output_dir} n'existe pas")
-        return existing_sequences
+        return disk_index
 
-    for item in os.listdir(output_dir):
-        item_path = os.path.join(output_dir, item)
-        if os.path.isdir(item_path):
-            match = re.match(r"seq(\d+)_(genomad|checkv)", item)
-            if match:
-                seq_id = match.group(1)
-                existing_sequences.add(seq_id)
-    
+    tool_dirs = []
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            match = TOOL_DIR_PATTERN.match(entry.name)
+            if match and entry.is_dir():
+                tool_dirs.append((match.group(1), match.group(2), entry.name, entry.path))
+
+    cache = load_scan_cache(rescan)
+    new_cache = {}
+    rescanned = 0
+    logger.info(f"Scan de {len(tool_dirs)} dossiers ({scan_workers} threads, "
+                f"{len(cache)} entrées en cache)...")
+    with ThreadPoolExecutor(max_workers=scan_workers) as executor:
+        futures = {
+            executor.submit(inspect_tool_directory, seq_id, tool, path, cache.get(name)):
+                (seq_id, tool, name)
+            for seq_id, tool, name, path in tool_dirs
+        }
+        for future in as_completed(futures):
+            seq_id, tool, name = futures[future]
+            entry, was_scanned = future.result()
+            # Un scan en erreur n'est pas mis en cache : il sera refait au prochain lancement
+            if 'error' not in entry:
+                new_cache[name] = entry
+            disk_index[seq_id][tool] = entry['status']
+            rescanned += was_scanned
+
+    logger.info(f"Dossiers réexaminés: {rescanned}/{len(tool_dirs)}")
+    packed = index_packed_sequences(disk_index)
+    if packed:
+        logger.info(f"Sorties lues depuis les paquets de {pack_dir}: {packed}")
+    try:
+        save_scan_cache(new_cache)
+    except Exception as e:
+        logger.warning(f"Impossible d'écrire le cache de scan {scan_cache_file}: {e}")
+    return disk_index
+
+def in_progress_or(info, status):
+    """Fichiers .log ou tmp au premier niveau : traitement probablement en cours"""
+    for name in info['top_files']:
+        if name.endswith('.log') or 'tmp' in name.lower():
+            return "in_progress_maybe"
+    return status
+
+def analyze_genomad_on_disk(info):
+    """Classe un dossier geNomad à partir de son entrée dans l'index du disque"""
+    if info is None:
+        return "not_started"
+    if 'error' in info:
+        return f"error_reading: {info['error'][:50]}"
+    if not info['top_files']:
+        return "directory_empty"
+
+    found_summaries = info['results']
+    if not found_summaries:
+        return in_progress_or(info, "incomplete_no_summary")
+
+    for summary in found_summaries:
+        if 'error' in summary:
+            return f"error_reading: {summary['error'][:50]}"
+        if summary['has_rows']:
+            return "completed_with_hits"
+    return "completed_no_hits"
+
+def analyze_checkv_on_disk(info, seq_id):
+    """Classe un dossier CheckV à partir de son entrée dans l'index du disque"""
+    if info is None:
+        return "not_started"
+    if 'error' in info:
+        return f"error_reading: {info['error'][:50]}"
+    if not info['top_files']:
+        return "directory_empty"
+
+    # Même ordre de priorité que les emplacements connus de quality_summary
+    preferred = ["quality_summary.tsv", f"seq{seq_id}_quality_summary.tsv", "checkv_quality_summary.tsv"]
+    candidates = sorted(
+        info['results'],
+        key=lambda r: preferred.index(r['name']) if r['top'] and r['name'] in preferred else len(preferred)
+    )
+    if not candidates:
+        return in_progress_or(info, "incomplete_no_quality")
+
+    quality = candidates[0]
+    if 'error' in quality:
+        return f"error_reading: {quality['error'][:50]}"
+    if quality['size'] == 0:
+        return "quality_file_empty"
+    if not quality['has_rows']:
+        return "completed_no_results"
+    return "completed_with_results"
+
+def scan_existing_directories(disk_index):
+    """Identifie les séquences déjà traitées à partir de l'index du disque"""
+    existing_sequences = {seq_id for seq_id in disk_index if seq_id.isdigit()}
     logger.info(f"Trouvé {len(existing_sequences)} séquences avec des dossiers de traitement")
     return existing_sequences
 
-def create_status_from_disk():
+def create_status_from_disk(rescan=False):
     """Crée le fichier de statut basé sur l'analyse du disque"""
     logger.info("=== CRÉATION DU FICHIER DE STATUT DEPUIS LE DISQUE ===")
     
@@ -188,44 +315,34 @@ def create_status_from_disk():
         logger.error("Impossible de charger les séquences attendues")
         return
     
-    # Scanner aussi les dossiers existants
-    existing_sequences = scan_existing_directories()
+    # Un seul parcours du disque pour toutes les séquences
+    disk_index = build_disk_index(rescan)
+    existing_sequences = scan_existing_directories(disk_index)
     
     # Combiner les séquences attendues et existantes
-    all_sequences = set(map(str, expected_sequences)) | existing_sequences
-    all_sequences = sorted(list(all_sequences))  # Trier pour un traitement ordonné
+    expected_set = set(map(str, expected_sequences))
+    all_sequences = sorted(expected_set | existing_sequences)  # Trier pour un traitement ordonné
     
     logger.info(f"Total de séquences à analyser: {len(all_sequences)}")
     logger.info(f"  - Séquences attendues: {len(expected_sequences)}")
     logger.info(f"  - Séquences avec dossiers existants: {len(existing_sequences)}")
     
-    # Analyser chaque séquence
-    results = []
-    
-    for i, seq_id in enumerate(all_sequences):
-        if i % 100 == 0:
-            logger.info(f"Progression: {i}/{len(all_sequences)} ({i/len(all_sequences)*100:.1f}%)")
-        
-        genomad_status = analyze_genomad_on_disk(seq_id)
-        checkv_status = analyze_checkv_on_disk(seq_id)
-        
-        # Mapper vers les statuts standards
-        genomad_mapped = map_genomad_status(genomad_status)
-        checkv_mapped = map_checkv_status(checkv_status)
-        
-        results.append({
-            'sequence_id': seq_id,
-            'geNomad_status': genomad_mapped,
-            'checkV_status': checkv_mapped,
-            'genomad_disk_detail': genomad_status,
-            'checkv_disk_detail': checkv_status,
-            'in_expected': str(seq_id) in map(str, expected_sequences),
-            'has_genomad_dir': os.path.exists(os.path.join(output_dir, f"seq{seq_id}_genomad")),
-            'has_checkv_dir': os.path.exists(os.path.join(output_dir, f"seq{seq_id}_checkv"))
-        })
-    
-    # Créer le DataFrame et sauvegarder
-    df = pd.DataFrame(results)
+    # Classement par simple consultation de l'index (None = dossier absent)
+    genomad_details = [disk_index.get(seq_id, {}).get('genomad') for seq_id in all_sequences]
+    checkv_details = [disk_index.get(seq_id, {}).get('checkv') for seq_id in all_sequences]
+
+    df = pd.DataFrame({'sequence_id': all_sequences})
+    df['genomad_disk_detail'] = [d or "not_started" for d in genomad_details]
+    df['checkv_disk_detail'] = [d or "not_started" for d in checkv_details]
+
+    # Mapper vers les statuts standards
+    df['geNomad_status'] = map_genomad_status(df['genomad_disk_detail'])
+    df['checkV_status'] = map_checkv_status(df['checkv_disk_detail'])
+    df['in_expected'] = df['sequence_id'].isin(expected_set)
+    df['has_genomad_dir'] = [d is not None for d in genomad_details]
+    df['has_checkv_dir'] = [d is not None for d in checkv_details]
+    df = df[['sequence_id', 'geNomad_status', 'checkV_status', 'genomad_disk_detail',
+             'checkv_disk_detail', 'in_expected', 'has_genomad_dir', 'has_checkv_dir']]
     
     # Sauvegarder le fichier de statut standard
     standard_df = df[['sequence_id', 'geNomad_status', 'checkV_status']]
@@ -239,45 +356,94 @@ def create_status_from_disk():
     
     return df
 
+GENOMAD_STATUS_MAP = {
+    'not_started': 'pending',
+    'directory_empty': 'pending',
+    'in_progress_maybe': 'running',
+    'incomplete_no_summary': 'incomplete',
+    'completed_with_hits': 'completed',
+    'completed_no_hits': 'completed_no_hits'
+}
+
+CHECKV_STATUS_MAP = {
+    'not_started': 'pending',
+    'directory_empty': 'pending',
+    'in_progress_maybe': 'running',
+    'incomplete_no_quality': 'incomplete',
+    'quality_file_empty': 'incomplete',
+    'completed_no_results': 'completed',
+    'completed_with_results': 'completed'
+}
+
 def map_genomad_status(disk_status):
-    """Mappe les statuts disque vers les statuts standards geNomad"""
-    mapping = {
-        'not_started': 'pending',
-        'directory_empty': 'pending',
-        'in_progress_maybe': 'running',
-        'incomplete_no_summary': 'incomplete',
-        'completed_with_hits': 'completed',
-        'completed_no_hits': 'completed_no_hits'
-    }
-    
-    if disk_status.startswith('error_reading'):
-        return 'error'
-    
-    return mapping.get(disk_status, 'error')
+    """Mappe une série de statuts disque vers les statuts standards geNomad"""
+    # Les statuts 'error_reading: ...' et inconnus deviennent 'error'
+    return disk_status.map(GENOMAD_STATUS_MAP).fillna('error')
 
 def map_checkv_status(disk_status):
-    """Mappe les statuts disque vers les statuts standards CheckV"""
-    mapping = {
-        'not_started': 'pending',
-        'directory_empty': 'pending',
-        'in_progress_maybe': 'running',
-        'incomplete_no_quality': 'incomplete',
-        'quality_file_empty': 'incomplete',
-        'completed_no_results': 'completed',
-        'completed_with_results': 'completed'
-    }
-    
-    if disk_status.startswith('error_reading'):
-        return 'error'
-    
-    return mapping.get(disk_status, 'error')
+    """Mappe une série de statuts disque vers les statuts standards CheckV"""
+    return disk_status.map(CHECKV_STATUS_MAP).fillna('error')
+
+def report_tool_metrics(n_slowest=10):
+    """Distribution des temps et de la mémoire par outil à partir de tool_metrics.tsv"""
+    if not os.path.exists(metrics_file):
+        return None
+
+    metrics = pd.read_csv(metrics_file, sep='\t')
+    # En-têtes répétés au milieu du fichier (écrits par d'anciennes versions) et
+    # lignes tronquées : exclus avant les calculs
+    metrics = metrics[metrics['tool'] != 'tool']
+    numeric_columns = ['n_sequences', 'input_bp', 'returncode', 'wall_s', 'cpu_user_s',
+                       'cpu_sys_s', 'max_rss_kb']
+    for column in numeric_columns:
+        metrics[column] = pd.to_numeric(metrics[column], errors='coerce')
+    metrics = metrics.dropna(subset=numeric_columns)
+    if metrics.empty:
+        return None
+    metrics['cpu_s'] = metrics['cpu_user_s'] + metrics['cpu_sys_s']
+    # Durée normalisée par séquence et par kb pour comparer des lots de tailles différentes
+    metrics['wall_s_per_seq'] = metrics['wall_s'] / metrics['n_sequences'].clip(lower=1)
+    metrics['wall_s_per_kbp'] = metrics['wall_s'] / (metrics['input_bp'] / 1000).clip(lower=1e-3)
+
+    quantiles = [0.5, 0.9, 0.99]
+    rows = []
+    for tool, group in metrics.groupby('tool'):
+        row = {'tool': tool, 'runs': len(group), 'failed': int((group['returncode'] != 0).sum()),
+               'wall_s_mean': group['wall_s'].mean(), 'wall_s_max': group['wall_s'].max(),
+               'cpu_s_mean': group['cpu_s'].mean(), 'max_rss_kb_max': group['max_rss_kb'].max(),
+               'wall_s_per_seq_median': group['wall_s_per_seq'].median(),
+               'cpu_efficiency': group['cpu_s'].sum() / max(group['wall_s'].sum(), 1e-9)}
+        for q in quantiles:
+            row[f'wall_s_p{int(q * 100)}'] = group['wall_s'].quantile(q)
+            row[f'max_rss_kb_p{int(q * 100)}'] = group['max_rss_kb'].quantile(q)
+        rows.append(row)
+    summary = pd.DataFrame(rows)
 
-def analyze_and_report():
+    logger.info(f"\n=== MÉTRIQUES DES OUTILS ===")
+    for row in rows:
+        logger.info(f"{row['tool']}: {row['runs']} lancements ({row['failed']} en échec), "
+                    f"durée p50/p90/p99/max = {row['wall_s_p50']:.0f}/{row['wall_s_p90']:.0f}/"
+                    f"{row['wall_s_p99']:.0f}/{row['wall_s_max']:.0f} s, "
+                    f"RSS max = {row['max_rss_kb_max'] / 1024 / 1024:.1f} Go, "
+                    f"cœurs utilisés en moyenne = {row['cpu_efficiency']:.1f}")
+
+    # Lots pathologiques : les plus lents rapportés à leur taille
+    logger.info(f"Lots les plus lents (s/kb):")
+    for _, run in metrics.nlargest(n_slowest, 'wall_s_per_kbp').iterrows():
+        logger.info(f"  {run['tool']} {run['batch']}: {run['wall_s']:.0f} s pour "
+                    f"{run['n_sequences']} séquences / {run['input_bp']} pb")
+
+    summary_file = os.path.join(output_dir, "tool_metrics_summary.tsv")
+    summary.to_csv(summary_file, sep='\t', index=False)
+    logger.info(f"Résumé des métriques sauvegardé: {summary_file}")
+    return summary
+
+def analyze_and_report(rescan=False):
     """Analyse complète et génération de rapport"""
     logger.info("=== ANALYSE COMPLÈTE DES RÉSULTATS SUR DISQUE ===")
     
     # Créer le fichier de statut depuis le disque
-    df = create_status_from_disk()
+    df = create_status_from_disk(rescan)
     if df is None:
         return
     
@@ -387,6 +553,8 @@ def analyze_and_report():
             f.write(f"STATUT: 🔄 {expected_total - expected_completed} séquences attendues restantes\n")
     
     logger.info(f"Rapport sauvegardé: {report_file}")
+
+    report_tool_metrics()
     
     return {
         'total': total,
@@ -397,8 +565,13 @@ def analyze_and_report():
     }
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse des résultats geNomad/CheckV sur disque")
+    parser.add_argument("--rescan", action="store_true",
+                        help="Ignorer le cache de scan et réexaminer tous les dossiers")
+    args = parser.parse_args()
+
     try:
-        stats = analyze_and_report()
+        stats = analyze_and_report(rescan=args.rescan)
         
         if stats:
             completion_rate = stats['fully_completed'] / stats['total'] * 100
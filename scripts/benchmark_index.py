@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Index par offsets d'octets du fichier benchmark.tsv
+
+La dernière colonne de benchmark.tsv contient la séquence complète : plutôt que de
+charger tout le fichier avec pandas, on construit une fois un index
+<sequence_id> -> (offset, longueur) de cette colonne, puis les séquences sont lues
+à la demande via un mmap. Les identifiants seuls sont lus en streaming sur la
+colonne 0, sans conserver les séquences en mémoire.
+"""
+
+import os
+import mmap
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def index_path_for(tsv_path):
+    return f"{tsv_path}.idx"
+
+
+def stream_ids(tsv_path):
+    """Renvoie les identifiants (colonne 0) ligne par ligne, sans garder les séquences"""
+    with open(tsv_path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            yield line.split(b'\t', 1)[0].decode()
+
+
+def build_index(tsv_path, index_path=None):
+    """Parcourt benchmark.tsv une fois et écrit l'index <id>\\t<offset>\\t<longueur>"""
+    index_path = index_path or index_path_for(tsv_path)
+    tmp_path = index_path + ".tmp"
+    count = 0
+    offset = 0
+    with open(tsv_path, 'rb') as f, open(tmp_path, 'w') as out:
+        for line in f:
+            line_start = offset
+            offset += len(line)
+            content = line.rstrip(b'\r\n')
+            if not content.strip():
+                continue
+            seq_id = content.split(b'\t', 1)[0].decode()
+            seq_start = content.rfind(b'\t') + 1
+            out.write(f"{seq_id}\t{line_start + seq_start}\t{len(content) - seq_start}\n")
+            count += 1
+    os.replace(tmp_path, index_path)
+    logger.info(f"Index créé: {index_path} ({count} séquences)")
+    return index_path
+
+
+def load_index(tsv_path, index_path=None):
+    """Charge l'index (reconstruit s'il est absent ou plus ancien que le TSV)"""
+    index_path = index_path or index_path_for(tsv_path)
+    if (not os.path.exists(index_path)
+            or os.path.getmtime(index_path) < os.path.getmtime(tsv_path)):
+        build_index(tsv_path, index_path)
+
+    offsets = {}
+    with open(index_path, 'r') as f:
+        for line in f:
+            seq_id, offset, length = line.rstrip('\n').split('\t')
+            offsets[seq_id] = (int(offset), int(length))
+    return offsets
+
+
+class BenchmarkIndex:
+    """Accès aléatoire aux séquences de benchmark.tsv par identifiant, via mmap"""
+
+    def __init__(self, tsv_path, index_path=None):
+        self.tsv_path = tsv_path
+        self.offsets = load_index(tsv_path, index_path)
+        self._file = None
+        self._mmap = None
+
+    def ids(self):
+        return list(self.offsets)
+
+    def length(self, seq_id):
+        return self.offsets[str(seq_id)][1]
+
+    def sequence(self, seq_id):
+        # Le mmap est ouvert à la première lecture : chaque worker ouvre le sien
+        if self._mmap is None:
+            self._file = open(self.tsv_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, length = self.offsets[str(seq_id)]
+        return self._mmap[offset:offset + length].decode()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def __getstate__(self):
+        # Un mmap ne se sérialise pas : les workers rouvrent le fichier
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_mmap'] = None
+        return state
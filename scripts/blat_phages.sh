@@ -48,7 +48,7 @@ BASENAME=$(basename "$INPUT" .fa)
 echo "Calcul des longueurs des séquences..."
 
 # Première étape : extraire les longueurs des séquences du fichier FASTA
-cat "$INPUT" | "$SCRIPT_DIR/f2s" | "$SCRIPT_DIR/seqlengths" > blat_output/${BASENAME}.seq_lengths_full.tmp
+python3 "$SCRIPT_DIR/fasta_index.py" lengths "$INPUT" > blat_output/${BASENAME}.seq_lengths_full.tmp
 
 # DIAGNOSTIC : Comparer les noms de séquences
 echo "Diagnostic des noms de séquences..."
@@ -150,7 +150,7 @@ cut -f1,2,12 blat_output/${BASENAME}.blat | "$SCRIPT_DIR/hashsums" | tail -n +2
 
 # 9. Extraction des séquences représentatives (OTUs)
 echo "Extraction des séquences représentatives..."
-cat "$INPUT" | "$SCRIPT_DIR/f2s" | "$SCRIPT_DIR/joincol" <(cut -f2 blat_output/OTUs.tsv) | awk '$NF == 1 {print $1 "\t" $2}' | "$SCRIPT_DIR/s2f" > blat_output/OTUs.fna
+python3 "$SCRIPT_DIR/fasta_index.py" fetch "$INPUT" --ids-file <(cut -f2 blat_output/OTUs.tsv) > blat_output/OTUs.fna
 
 echo "Clustering terminé. Résultats disponibles dans le dossier blat_output/"
 
@@ -158,6 +158,6 @@ echo "Clustering terminé. Résultats disponibles dans le dossier blat_output/"
 rm -rf tmp_chunks tmp_chunks_grouped
 
 echo "Statistiques finales :"
-echo "- Nombre de séquences d'entrée : $(grep -c '^>' "$INPUT")"
+echo "- Nombre de séquences d'entrée : $(python3 "$SCRIPT_DIR/fasta_index.py" count "$INPUT")"
 echo "- Nombre de chimères détectées : $(wc -l < blat_output/${BASENAME}.chimeras.list)"
 echo "- Nombre d'OTUs finaux : $(wc -l < blat_output/OTUs.tsv)"
\ No newline at end of file
@@ -1,8 +1,23 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib_venn import venn2, venn3
+import os
+import tempfile
 from itertools import combinations
+from multiprocessing import Pool
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from alignment_store import open_store
+from alignment_comparisons import (shared_vocabulary, vocabulary_codes, pack_pairs,
+                                   combination_counts)
+
+# Une seule passe par fichier, groupe de lignes par groupe de lignes : chaque
+# worker convertit son fichier en stockage colonnes si besoin, tient des
+# histogrammes à bornes fixes (log10 pour l'e-value et le bitscore), un
+# échantillon de quantiles fusionnable, sommes et comptes, et écrit les paires
+# codées en uint64 (triées, dédoublonnées) avec les codes de son fichier. Les
+# paires sont ensuite recodées dans le vocabulaire commun pour le Venn. Les
+# graphiques sont tracés à partir de ces résumés.
+
+matplotlib.use('Agg')
 
 # === 1. Définir les fichiers d’alignement ===
 
@@ -11,66 +26,207 @@ alignment_files = {
     "mmseqs2": "vOTUs_alignment.tsv"
 }
 
-# === 2. Charger les données d’alignement ===
-
-def load_alignments(path):
-    df = pd.read_csv(path, sep="\t", header=None)
-    df.columns = [
-        "query", "target", "identity", "length",
-        "mismatch", "gapopen", "qstart", "qend",
-        "sstart", "send", "evalue", "bitscore"
-    ]
-    df["pair"] = df["query"] + "||" + df["target"]
-    return df
-
-alignments = {name: load_alignments(path) for name, path in alignment_files.items()}
-
-# === 3. Statistiques de base ===
-
-print("\n--- Statistiques de base ---")
-for name, df in alignments.items():
-    print(f"{name}: {len(df)} alignments, "
-          f"mean identity = {df['identity'].mean():.2f}, "
-          f"mean e-value = {df['evalue'].mean():.2e}")
-
-# === 4. Overlap des paires alignées ===
-
-def compute_overlap(df1, df2):
-    set1, set2 = set(df1["pair"]), set(df2["pair"])
-    inter = set1 & set2
-    jaccard = len(inter) / len(set1 | set2)
-    return len(inter), jaccard
-
-print("\n--- Overlap entre outils (alignements partagés) ---")
-names = list(alignments.keys())
-for i, j in combinations(names, 2):
-    n_common, jaccard = compute_overlap(alignments[i], alignments[j])
-    print(f"{i} vs {j}: {n_common} alignments communs, Jaccard = {jaccard:.3f}")
-
-# === 5. Venn diagram (2 ou 3 outils max) ===
-
-plt.figure(figsize=(6,6))
-sets = [set(df["pair"]) for df in alignments.values()]
-labels = list(alignments.keys())
-
-if len(sets) == 2:
-    venn2(sets, set_labels=labels)
-elif len(sets) == 3:
-    venn3(sets, set_labels=labels)
-plt.title("Overlap des alignements")
-plt.savefig("venn_alignments.png")
-plt.close()
-
-# === 6. Visualisation distributions ===
-
-for metric in ["identity", "evalue", "bitscore"]:
-    plt.figure(figsize=(8, 5))
-    for name, df in alignments.items():
-        sns.kdeplot(df[metric], label=name, fill=True, common_norm=False)
-    plt.xlabel(metric)
-    plt.ylabel("Densité")
-    plt.title(f"Distribution de {metric}")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(f"distribution_{metric}.png")
+# Bornes fixes des histogrammes : (colonne du stockage, bornes) ; bornes en log10
+# pour LOG_METRICS. Les valeurs hors bornes sont comptées à part.
+METRICS = {
+    "identity": ("pident", np.linspace(0.0, 100.0, 201)),
+    "evalue": ("evalue", np.linspace(-300.0, 5.0, 611)),
+    "bitscore": ("bits", np.linspace(0.0, 5.0, 251)),
+}
+LOG_METRICS = {"evalue", "bitscore"}
+# Taille de l'échantillon de quantiles (bottom-k sur des priorités aléatoires)
+QUANTILE_SAMPLE = 100_000
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+# === 2. Résumés des alignements en une passe ===
+
+def empty_summary():
+    return {metric: {'hist': np.zeros(len(edges) - 1, dtype=np.int64), 'count': 0, 'sum': 0.0,
+                     'min': np.inf, 'max': -np.inf, 'zeros': 0, 'under': 0, 'over': 0,
+                     'priority': np.empty(0), 'sample': np.empty(0)}
+            for metric, (_, edges) in METRICS.items()}
+
+
+def merge_sample(priority_a, sample_a, priority_b, sample_b):
+    """Garde les QUANTILE_SAMPLE plus petites priorités : échantillon uniforme de l'union"""
+    priority = np.concatenate((priority_a, priority_b))
+    sample = np.concatenate((sample_a, sample_b))
+    if len(priority) > QUANTILE_SAMPLE:
+        keep = np.argpartition(priority, QUANTILE_SAMPLE)[:QUANTILE_SAMPLE]
+        priority, sample = priority[keep], sample[keep]
+    return priority, sample
+
+
+def merge_summaries(a, b):
+    """Fusion de deux résumés (histogrammes et sommes additifs, échantillons fusionnables)"""
+    merged = {}
+    for metric in METRICS:
+        x, y = a[metric], b[metric]
+        priority, sample = merge_sample(x['priority'], x['sample'], y['priority'], y['sample'])
+        merged[metric] = {'hist': x['hist'] + y['hist'], 'count': x['count'] + y['count'],
+                          'sum': x['sum'] + y['sum'], 'min': min(x['min'], y['min']),
+                          'max': max(x['max'], y['max']), 'zeros': x['zeros'] + y['zeros'],
+                          'under': x['under'] + y['under'], 'over': x['over'] + y['over'],
+                          'priority': priority, 'sample': sample}
+    return merged
+
+
+def summarize_values(values, rng):
+    """Résumé d'un groupe de lignes : {métrique: statistiques}"""
+    summary = {}
+    for metric, (column, edges) in METRICS.items():
+        raw = values[column].astype(np.float64)
+        zeros = 0
+        binned = raw
+        if metric in LOG_METRICS:
+            # Les valeurs nulles n'ont pas de log : comptées à part
+            zeros = int(np.count_nonzero(raw <= 0))
+            binned = np.log10(raw[raw > 0])
+        # Pas de np.clip : les valeurs hors bornes fausseraient les classes extrêmes
+        hist, _ = np.histogram(binned, bins=edges)
+        priority = rng.random(len(raw))
+        if len(raw) > QUANTILE_SAMPLE:
+            keep = np.argpartition(priority, QUANTILE_SAMPLE)[:QUANTILE_SAMPLE]
+        else:
+            keep = slice(None)
+        summary[metric] = {'hist': hist, 'count': len(raw), 'sum': float(raw.sum()),
+                           'min': float(raw.min()) if len(raw) else np.inf,
+                           'max': float(raw.max()) if len(raw) else -np.inf, 'zeros': zeros,
+                           'under': int(np.count_nonzero(binned < edges[0])),
+                           'over': int(np.count_nonzero(binned > edges[-1])),
+                           'priority': priority[keep], 'sample': raw[keep]}
+    return summary
+
+
+def summarize_file(task):
+    """Worker : une passe sur un fichier -> (nom, résumé, fichier .npy des paires codées)
+
+    La conversion en stockage colonnes, s'il n'est pas à jour, se fait ici,
+    en parallèle pour tous les fichiers. Les paires sont codées avec les codes
+    propres au fichier (recode_pairs les ramène au vocabulaire commun).
+    """
+    name, path, pairs_file, seed = task
+    store = open_store(path)
+    codes = np.arange(len(store.proteins), dtype=np.uint64)
+    rng = np.random.default_rng(seed)
+    summary = empty_summary()
+    pairs = []
+    columns = ["query", "target"] + [column for column, _ in METRICS.values()]
+    # Seules les colonnes utilisées sont lues depuis le stockage colonnes (<fichier>.aln)
+    for arrays in store.iter_columns(columns):
+        summary = merge_summaries(summary, summarize_values(arrays, rng))
+        pairs.append(np.unique(pack_pairs(codes, arrays["query"], arrays["target"])))
+    pairs = np.unique(np.concatenate(pairs)) if pairs else np.empty(0, dtype=np.uint64)
+    np.save(pairs_file, pairs)
+    return name, summary, pairs_file
+
+
+def recode_pairs(task):
+    """Worker : paires codées du fichier -> codes du vocabulaire commun, triées"""
+    path, pairs_file, vocabulary = task
+    codes = vocabulary_codes(open_store(path), vocabulary)
+    pairs = np.load(pairs_file)
+    # Le recodage est injectif : les paires restent uniques, seul l'ordre change
+    pairs = np.sort(pack_pairs(codes, pairs >> np.uint64(32), pairs & np.uint64(0xffffffff)))
+    np.save(pairs_file, pairs)
+    return pairs_file
+
+
+def quantiles(stats):
+    if len(stats['sample']) == 0:
+        return [np.nan] * len(QUANTILES)
+    return np.quantile(stats['sample'], QUANTILES)
+
+
+def plot_distributions(summaries):
+    """Densités tracées depuis les histogrammes (plus de KDE sur tous les points)"""
+    for metric, (_, edges) in METRICS.items():
+        plt.figure(figsize=(8, 5))
+        for name, summary in summaries.items():
+            hist = summary[metric]['hist']
+            total = hist.sum()
+            if total == 0:
+                continue
+            density = hist / (total * np.diff(edges))
+            plt.stairs(density, edges, label=name, fill=True, alpha=0.4)
+        plt.xlabel(f"log10({metric})" if metric in LOG_METRICS else metric)
+        plt.ylabel("Densité")
+        plt.title(f"Distribution de {metric}")
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(f"distribution_{metric}.png")
+        plt.close()
+
+
+def main():
+    # === 3. Une passe par fichier, fichiers en parallèle ===
+    pairs_dir = tempfile.mkdtemp(prefix="comp_alignments_")
+    tasks = [(name, path, os.path.join(pairs_dir, f"pairs_{k}.npy"), k)
+             for k, (name, path) in enumerate(alignment_files.items())]
+    with Pool(len(tasks)) as pool:
+        results = pool.map(summarize_file, tasks)
+        # Les stockages sont à jour : le vocabulaire commun ne lit que les identifiants
+        stores = {name: open_store(path) for name, path in alignment_files.items()}
+        vocabulary = shared_vocabulary(stores)
+        pool.map(recode_pairs, [(alignment_files[name], pairs_file, vocabulary)
+                                for name, _, pairs_file in results])
+    summaries = {name: summary for name, summary, _ in results}
+    pair_sets = [np.load(pairs_file, mmap_mode='r') for _, _, pairs_file in results]
+
+    # === 4. Statistiques de base ===
+
+    print("\n--- Statistiques de base ---")
+    for name, summary in summaries.items():
+        identity, evalue = summary["identity"], summary["evalue"]
+        print(f"{name}: {identity['count']} alignments, "
+              f"mean identity = {identity['sum'] / max(identity['count'], 1):.2f}, "
+              f"mean e-value = {evalue['sum'] / max(evalue['count'], 1):.2e}")
+        for metric, stats in summary.items():
+            values = ", ".join(f"q{int(q * 100)}={v:.3g}" for q, v in zip(QUANTILES, quantiles(stats)))
+            print(f"    {metric}: min={stats['min']:.3g}, max={stats['max']:.3g}, {values}")
+            if stats['zeros']:
+                print(f"    {metric}: {stats['zeros']} valeurs nulles")
+            if stats['under'] or stats['over']:
+                print(f"    {metric}: hors bornes de l'histogramme, {stats['under']} en dessous, "
+                      f"{stats['over']} au-dessus")
+
+    # === 5. Overlap des paires alignées ===
+
+    names = list(summaries)
+    counts = combination_counts(pair_sets)
+    masks = np.arange(len(counts))
+
+    print("\n--- Overlap entre outils (alignements partagés) ---")
+    for i, j in combinations(range(len(names)), 2):
+        in_i, in_j = (masks >> i) & 1 == 1, (masks >> j) & 1 == 1
+        n_common = int(counts[in_i & in_j].sum())
+        jaccard = n_common / max(int(counts[in_i | in_j].sum()), 1)
+        print(f"{names[i]} vs {names[j]}: {n_common} alignments communs, Jaccard = {jaccard:.3f}")
+
+    # === 6. Venn diagram (2 ou 3 outils max), depuis les comptes par combinaison ===
+
+    from matplotlib_venn import venn2, venn3
+
+    plt.figure(figsize=(6,6))
+    # L'ordre des sous-ensembles de venn2/venn3 (10, 01, 11, 001, ...) est celui des masques
+    if len(names) == 2:
+        venn2(subsets=tuple(int(c) for c in counts[1:4]), set_labels=names)
+    elif len(names) == 3:
+        venn3(subsets=tuple(int(c) for c in counts[1:8]), set_labels=names)
+    plt.title("Overlap des alignements")
+    plt.savefig("venn_alignments.png")
     plt.close()
+
+    del pair_sets
+    for _, _, pairs_file in results:
+        os.remove(pairs_file)
+    os.rmdir(pairs_dir)
+
+    # === 7. Visualisation distributions ===
+
+    plot_distributions(summaries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Matrice de distances carrée en float32 sur disque, accessible par mmap
+
+Format .dmat : un en-tête de 64 octets (magique, version, n, source) suivi
+des n x n distances float32 ligne par ligne ; les noms sont dans
+<fichier>.dmat.names, un par ligne. La source est la signature (taille,
+mtime_ns) du PHYLIP dont la matrice a été importée, nulle pour une matrice
+écrite directement en .dmat. La matrice est remplie par blocs de lignes
+(chaque processus écrit ses lignes directement dans le fichier) et relue sans
+parsing ni copie en float64 ; l'export PHYLIP pour rapidnj se fait en
+streaming, bloc par bloc.
+
+Usage:
+    python distance_matrix.py to-phylip vOTUs.dmat vOTUs.mat
+    python distance_matrix.py from-phylip vOTUs.mat vOTUs.dmat
+"""
+
+import os
+import sys
+import struct
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DISTMAT\0"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_FORMAT = "<8sIQ"
+# Signature du PHYLIP importé (taille, mtime_ns), dans les octets libres de l'en-tête ;
+# (0, 0) pour une matrice native
+SOURCE_FORMAT = "<Qq"
+SOURCE_OFFSET = struct.calcsize(HEADER_FORMAT)
+
+
+def names_path_for(path):
+    return f"{path}.names"
+
+
+def create(path, names, source=(0, 0)):
+    """Crée un fichier .dmat de len(names) x len(names) et renvoie la memmap en écriture"""
+    n = len(names)
+    header = (struct.pack(HEADER_FORMAT, MAGIC, VERSION, n)
+              + struct.pack(SOURCE_FORMAT, *source)).ljust(HEADER_SIZE, b'\0')
+    with open(path, 'wb') as f:
+        f.write(header)
+        # Fichier creux : les blocs ne sont alloués qu'à l'écriture des lignes
+        f.truncate(HEADER_SIZE + n * n * 4)
+    with open(names_path_for(path), 'w') as f:
+        f.writelines(f"{name}\n" for name in names)
+    return open_rows(path, n, mode='r+')
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic, version, n = struct.unpack_from(HEADER_FORMAT, f.read(HEADER_SIZE))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Fichier de distances non reconnu: {path}")
+    return n
+
+
+def read_source(path):
+    """Signature (taille, mtime_ns) du PHYLIP importé, None pour une matrice native"""
+    read_header(path)
+    with open(path, 'rb') as f:
+        f.seek(SOURCE_OFFSET)
+        source = struct.unpack(SOURCE_FORMAT, f.read(struct.calcsize(SOURCE_FORMAT)))
+    return None if source == (0, 0) else source
+
+
+def phylip_signature(phylip):
+    stat = os.stat(phylip)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def open_rows(path, n, mode='r'):
+    return np.memmap(path, dtype=np.float32, mode=mode, offset=HEADER_SIZE, shape=(n, n))
+
+
+def open_matrix(path, mode='r'):
+    """Renvoie (noms, memmap n x n float32)"""
+    n = read_header(path)
+    with open(names_path_for(path), 'r') as f:
+        names = np.array([line.rstrip('\n') for line in f], dtype=object)
+    if len(names) != n:
+        raise ValueError(f"{names_path_for(path)}: {len(names)} noms pour une matrice {n}x{n}")
+    return names, open_rows(path, n, mode)
+
+
+def export_phylip(path, output, block_rows=1024):
+    """Écrit la matrice au format PHYLIP (rapidnj -i pd) en streaming"""
+    names, matrix = open_matrix(path)
+    n = len(names)
+    with open(output, 'w') as out:
+        out.write(f"\t{n}\n")
+        for start in range(0, n, block_rows):
+            end = min(start + block_rows, n)
+            pd.DataFrame(np.asarray(matrix[start:end]), index=names[start:end]).to_csv(
+                out, sep="\t", header=False, float_format="%.6f")
+    logger.info(f"Matrice {n}x{n} exportée: {output}")
+
+
+def import_phylip(phylip, path):
+    """Convertit une matrice PHYLIP texte (sortie de tree_bray ou rapidnj) en .dmat, ligne par ligne
+
+    La signature du PHYLIP est gardée dans l'en-tête ; la matrice est écrite
+    dans un fichier temporaire renommé à la fin, une conversion interrompue ne
+    laisse donc pas de .dmat partiel.
+    """
+    signature = phylip_signature(phylip)
+    tmp_path = f"{path}.tmp"
+    with open(phylip, 'r') as f:
+        n = int(f.readline().split()[0])
+        # Les noms ne sont connus qu'à la lecture : ils sont réécrits à la fin
+        matrix = create(tmp_path, [""] * n, source=signature)
+        names = []
+        for i, line in enumerate(f):
+            if i >= n:
+                break
+            fields = line.split()
+            names.append(fields[0])
+            matrix[i] = np.asarray(fields[1:], dtype=np.float32)
+    matrix.flush()
+    del matrix
+    with open(names_path_for(tmp_path), 'w') as f:
+        f.writelines(f"{name}\n" for name in names)
+    # Noms d'abord : un .dmat resté ancien garde une signature différente et sera réimporté
+    os.replace(names_path_for(tmp_path), names_path_for(path))
+    os.replace(tmp_path, path)
+    logger.info(f"Matrice {n}x{n} importée: {path}")
+    return path
+
+
+def ensure_dmat(path):
+    """Chemin .dmat d'une matrice ; une matrice PHYLIP est convertie une fois (sibling .dmat)
+
+    Un .dmat natif (écrit par generate_bray_matrix.py, dont le PHYLIP n'est
+    qu'un export arrondi) n'est jamais remplacé, mais un PHYLIP plus récent
+    que lui (régénéré par un autre outil, copié) est signalé ; un .dmat
+    importé est remplacé si le PHYLIP a changé depuis (taille ou mtime).
+    """
+    if path.endswith(".dmat"):
+        return path
+    dmat_path = os.path.splitext(path)[0] + ".dmat"
+    if not os.path.exists(dmat_path):
+        import_phylip(path, dmat_path)
+        return dmat_path
+    source = read_source(dmat_path)
+    if source is None:
+        if os.stat(path).st_mtime_ns > os.stat(dmat_path).st_mtime_ns:
+            logger.warning(f"{path} est plus récent que la matrice native {dmat_path}, qui est "
+                           f"utilisée telle quelle ; si le PHYLIP fait foi, le convertir avec "
+                           f"'distance_matrix.py from-phylip {path} {dmat_path}'")
+    elif source != phylip_signature(path):
+        logger.info(f"{path} modifié depuis l'import, nouvelle conversion")
+        import_phylip(path, dmat_path)
+    return dmat_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matrices de distances float32 sur disque (.dmat)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    to_phylip = subparsers.add_parser("to-phylip", help="Exporte un .dmat au format PHYLIP")
+    to_phylip.add_argument("dmat")
+    to_phylip.add_argument("output")
+    to_phylip.add_argument("--block-rows", type=int, default=1024)
+    from_phylip = subparsers.add_parser("from-phylip", help="Convertit une matrice PHYLIP en .dmat")
+    from_phylip.add_argument("phylip")
+    from_phylip.add_argument("dmat")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    if args.command == "to-phylip":
+        export_phylip(args.dmat, args.output, args.block_rows)
+    elif args.command == "from-phylip":
+        if not os.path.exists(args.phylip):
+            logger.error(f"Fichier introuvable: {args.phylip}")
+            sys.exit(1)
+        import_phylip(args.phylip, args.dmat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Lecture indexée des fichiers FASTA, sur le modèle de samtools faidx
+
+Un seul parcours du FASTA écrit l'index <fasta>.idx
+(id, longueur, offset de l'en-tête, offset de la séquence, offset de fin) ; les
+séquences sont ensuite lues à la demande via un mmap, quelle que soit la
+longueur des lignes. Les fonctions de streaming (identifiants, longueurs,
+comptage) acceptent aussi les fichiers .gz. Les copies d'enregistrements et les
+concaténations passent par os.copy_file_range, sans remonter les données en
+Python.
+
+Remplace les chaînes f2s | seqlengths et f2s | joincol | s2f des scripts shell :
+    python fasta_index.py lengths genomes.fa > genomes.lengths
+    python fasta_index.py count genomes.fa
+    python fasta_index.py fetch genomes.fa --ids-file ids.txt > subset.fa
+"""
+
+import os
+import sys
+import gzip
+import mmap
+import argparse
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def index_path_for(fasta_path):
+    return f"{fasta_path}.idx"
+
+
+def is_gzipped(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def open_fasta(path):
+    """Ouvre un FASTA en binaire, décompressé à la volée s'il est gzippé"""
+    if is_gzipped(path):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def record_id(header_line):
+    """Identifiant (premier mot) d'une ligne d'en-tête '>...'"""
+    fields = header_line[1:].split(None, 1)
+    return fields[0].decode() if fields else ""
+
+
+def iter_records(path, with_sequence=True):
+    """Parcourt le FASTA une fois et renvoie (id, longueur, séquence ou None)"""
+    seq_id = None
+    length = 0
+    chunks = []
+    with open_fasta(path) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if seq_id is not None:
+                    yield seq_id, length, (b''.join(chunks).decode() if with_sequence else None)
+                seq_id = record_id(line)
+                length = 0
+                chunks = []
+            elif seq_id is not None:
+                chunk = line.strip()
+                length += len(chunk)
+                if with_sequence:
+                    chunks.append(chunk)
+    if seq_id is not None:
+        yield seq_id, length, (b''.join(chunks).decode() if with_sequence else None)
+
+
+def iter_sequences(path):
+    """(id, séquence) en streaming"""
+    for seq_id, _, sequence in iter_records(path):
+        yield seq_id, sequence
+
+
+def iter_lengths(path):
+    """(id, longueur) en streaming, sans garder les séquences"""
+    for seq_id, length, _ in iter_records(path, with_sequence=False):
+        yield seq_id, length
+
+
+def count_records(path):
+    """Nombre d'enregistrements d'un FASTA (0 si le fichier n'existe pas)"""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open_fasta(path) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                count += 1
+    return count
+
+
+def build_index(fasta_path, index_path=None):
+    """Parcourt le FASTA une fois et écrit l'index <id>\\t<longueur>\\t<en-tête>\\t<séquence>\\t<fin>"""
+    if is_gzipped(fasta_path):
+        raise ValueError(f"Index impossible sur un fichier compressé: {fasta_path}")
+    index_path = index_path or index_path_for(fasta_path)
+    tmp_path = index_path + ".tmp"
+    count = 0
+    offset = 0
+    record = None
+    with open(fasta_path, 'rb') as f, open(tmp_path, 'w') as out:
+        for line in f:
+            line_start = offset
+            offset += len(line)
+            if line.startswith(b'>'):
+                if record is not None:
+                    out.write("\t".join(map(str, record + [line_start])) + "\n")
+                    count += 1
+                record = [record_id(line), 0, line_start, offset]
+            elif record is not None:
+                record[1] += len(line.strip())
+        if record is not None:
+            out.write("\t".join(map(str, record + [offset])) + "\n")
+            count += 1
+    os.replace(tmp_path, index_path)
+    logger.info(f"Index créé: {index_path} ({count} séquences)")
+    return index_path
+
+
+def load_index(fasta_path, index_path=None):
+    """Charge l'index (reconstruit s'il est absent ou plus ancien que le FASTA)
+
+    Renvoie les (id, longueur, en-tête, séquence, fin) dans l'ordre du fichier.
+    """
+    index_path = index_path or index_path_for(fasta_path)
+    # st_ctime change aussi quand le fichier est restauré par lien dur (cache d'étapes)
+    fasta_stat = os.stat(fasta_path)
+    if (not os.path.exists(index_path)
+            or os.path.getmtime(index_path) < max(fasta_stat.st_mtime, fasta_stat.st_ctime)):
+        build_index(fasta_path, index_path)
+
+    entries = []
+    with open(index_path, 'r') as f:
+        for line in f:
+            seq_id, length, header, start, end = line.rstrip('\n').split('\t')
+            entries.append((seq_id, int(length), int(header), int(start), int(end)))
+    return entries
+
+
+def copy_range(src, dst, offset, count):
+    """Ajoute count octets de src (à partir de offset) à la fin de dst"""
+    dst.flush()
+    dst.seek(0, os.SEEK_END)
+    while count > 0:
+        try:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
+        except (AttributeError, OSError):
+            # copy_file_range absent ou refusé par le système de fichiers : copie par blocs
+            src.seek(offset)
+            copied = dst.write(src.read(min(count, 1 << 24)))
+            dst.flush()
+        if copied == 0:
+            break
+        offset += copied
+        count -= copied
+    dst.seek(0, os.SEEK_END)
+
+
+def concat_files(sources, output_path):
+    """Concatène des FASTA (gzippés ou non) dans output_path
+
+    Renvoie les offsets de début de chaque source dans le fichier produit, pour
+    retrouver l'origine des enregistrements via l'index du fichier concaténé.
+    """
+    starts = []
+    with open(output_path, 'wb') as out:
+        for source in sources:
+            starts.append(out.tell())
+            if is_gzipped(source):
+                with gzip.open(source, 'rb') as f:
+                    last = b''
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        out.write(block)
+                        last = block[-1:]
+            else:
+                size = os.path.getsize(source)
+                with open(source, 'rb') as f:
+                    copy_range(f, out, 0, size)
+                    f.seek(max(size - 1, 0))
+                    last = f.read(1)
+            # Un fichier sans retour final collerait son dernier enregistrement au suivant
+            if last and last != b'\n':
+                out.write(b'\n')
+    return starts
+
+
+class FastaIndex:
+    """Accès aléatoire aux séquences d'un FASTA par identifiant, via mmap"""
+
+    def __init__(self, fasta_path, index_path=None):
+        self.fasta_path = str(fasta_path)
+        # entries garde tous les enregistrements dans l'ordre, records le premier de chaque id
+        self.entries = load_index(self.fasta_path, index_path and str(index_path))
+        self.records = {}
+        for seq_id, *record in self.entries:
+            self.records.setdefault(seq_id, tuple(record))
+        self._file = None
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, seq_id):
+        return str(seq_id) in self.records
+
+    def ids(self):
+        return list(self.records)
+
+    def length(self, seq_id):
+        return self.records[str(seq_id)][0]
+
+    def total_length(self):
+        return sum(entry[1] for entry in self.entries)
+
+    def _map(self):
+        # Le mmap est ouvert à la première lecture : chaque worker ouvre le sien
+        if self._mmap is None:
+            self._file = open(self.fasta_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def sequence(self, seq_id):
+        _, _, start, end = self.records[str(seq_id)]
+        return self._map()[start:end].replace(b'\n', b'').replace(b'\r', b'').decode()
+
+    def raw_record(self, seq_id):
+        """Enregistrement tel qu'il est écrit dans le fichier (en-tête compris)"""
+        _, header, _, end = self.records[str(seq_id)]
+        return self._map()[header:end]
+
+    def write_records(self, seq_ids, output_path):
+        """Copie les enregistrements demandés dans output_path, sans les décoder
+
+        Les enregistrements consécutifs dans le fichier source sont copiés en un
+        seul bloc. Renvoie le nombre d'enregistrements écrits.
+        """
+        spans = sorted({self.records[str(s)][1::2] for s in seq_ids if str(s) in self.records})
+        merged = []
+        for header, end in spans:
+            if merged and merged[-1][1] == header:
+                merged[-1][1] = end
+            else:
+                merged.append([header, end])
+        with open(self.fasta_path, 'rb') as src, open(output_path, 'wb') as out:
+            for header, end in merged:
+                copy_range(src, out, header, end - header)
+        return len(spans)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def __getstate__(self):
+        # Un mmap ne se sérialise pas : les workers rouvrent le fichier
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_mmap'] = None
+        return state
+
+
+def split_by_length(fasta_path, shard_dir, n_shards, prefix="shard", suffix=".fna"):
+    """Découpe un FASTA en n_shards fichiers d'enregistrements consécutifs, équilibrés en résidus
+
+    Les shards gardent l'ordre des enregistrements : leur concaténation redonne le
+    fichier d'origine. Renvoie la liste des (chemin du shard, nombre de séquences).
+    """
+    index = FastaIndex(fasta_path)
+    target = index.total_length() / n_shards
+
+    # Chaque shard est une plage d'octets contiguë du fichier d'origine
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(exist_ok=True)
+    ranges = []
+    cumulative = 0
+    for seq_id, length, header, start, end in index.entries:
+        # Nouveau shard quand la part de résidus du shard courant est atteinte
+        if not ranges or (len(ranges) < n_shards and cumulative >= len(ranges) * target):
+            ranges.append([header, end, 0])
+        ranges[-1][1] = end
+        ranges[-1][2] += 1
+        cumulative += length
+
+    shards = []
+    with open(fasta_path, 'rb') as src:
+        for i, (begin, end, count) in enumerate(ranges):
+            path = shard_dir / f"{prefix}_{i:04d}{suffix}"
+            with open(path, 'wb') as out:
+                copy_range(src, out, begin, end - begin)
+            shards.append((path, count))
+    return shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lecture indexée de fichiers FASTA")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    lengths = subparsers.add_parser("lengths", help="Écrit <id>\\t<longueur> pour chaque séquence")
+    lengths.add_argument("fasta")
+    count = subparsers.add_parser("count", help="Nombre de séquences")
+    count.add_argument("fasta")
+    fetch = subparsers.add_parser("fetch", help="Extrait les séquences dont l'id est listé, dans l'ordre du FASTA")
+    fetch.add_argument("fasta")
+    fetch.add_argument("--ids-file", required=True,
+                       help="Fichier d'identifiants (premier champ de chaque ligne)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
+                        stream=sys.stderr)
+
+    if args.command == "lengths":
+        out = sys.stdout
+        for seq_id, length in iter_lengths(args.fasta):
+            out.write(f"{seq_id}\t{length}\n")
+    elif args.command == "count":
+        print(count_records(args.fasta))
+    elif args.command == "fetch":
+        with open(args.ids_file, 'r') as f:
+            wanted = [line.split()[0] for line in f if line.strip()]
+        index = FastaIndex(args.fasta)
+        missing = [seq_id for seq_id in wanted if seq_id not in index]
+        for seq_id in missing:
+            logger.warning(f"Séquence absente de {args.fasta}: {seq_id}")
+        # Les enregistrements sortent dans l'ordre du FASTA, comme f2s | joincol | s2f
+        out = sys.stdout.buffer
+        for seq_id in sorted(set(wanted) - set(missing), key=lambda s: index.records[s][1]):
+            record = index.raw_record(seq_id)
+            out.write(record if record.endswith(b'\n') else record + b'\n')
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Matrice de distances Bray-Curtis entre contigs à partir des hits protéiques
+
+Remplace la chaîne sort | hashsums | tree_bray : les bitscores des hits
+(query, target, bitscore) sont sommés par paire de contigs dans une matrice
+creuse scipy.sparse en une seule passe vectorisée, sans tri textuel, puis la
+distance est calculée comme dans tree_bray :
+
+    d(i, j) = 1 - (S_ij + S_ji) / (S_ii + S_jj)
+
+où S_ij est la somme des bitscores des protéines de i alignées sur celles de j
+et S_ii le score de i contre lui-même. Les distances sont calculées par blocs de
+lignes dans un pool de processus, chacun écrivant ses lignes dans une matrice
+float32 sur disque (<sortie>.dmat, voir distance_matrix.py), puis exportées en
+streaming au format PHYLIP attendu par rapidnj -i pd. Une sortie en .dmat
+s'arrête à la matrice binaire.
+
+Avec --sweep, les alignements ne sont lus qu'une fois au seuil le plus large :
+les hits sont répartis par tranche d'e-value entre seuils consécutifs, les
+sommes de chaque tranche s'ajoutent à celles des seuils plus stricts, et une
+matrice <sortie>_e<seuil>.mat est écrite par seuil.
+
+Usage:
+    python generate_bray_matrix.py filtered_clean.tsv vOTUs_braycurtis.mat
+    python generate_bray_matrix.py --jobs 16 filtered_clean.tsv vOTUs_braycurtis.dmat
+    awk '...' hits.m8 | python generate_bray_matrix.py --contigs - matrix.mat
+    python generate_bray_matrix.py --alignments vOTUs_alignment.tsv -e 0.05 vOTUs.mat
+    python generate_bray_matrix.py --alignments vOTUs_alignment.tsv --sweep 1e-10,1e-5,0.05 vOTUs
+"""
+
+import os
+import sys
+import argparse
+import logging
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import distance_matrix
+from alignment_store import GENE_SUFFIX, open_store
+
+logger = logging.getLogger(__name__)
+
+# Octets par distance d'un bloc en cours de calcul dans un worker : sommes puis
+# quotient en float64 (en place), dénominateur float64, bloc final float32
+BLOCK_BYTES_PER_CELL = 8 + 8 + 4 + 1
+# Part de la mémoire disponible que les workers peuvent occuper ensemble
+MEMORY_FRACTION = 0.8
+
+
+def load_hits_tsv(path, contigs=False, chunk_size=5_000_000):
+    """Lit un TSV query, target, score (ou '-' pour stdin)
+
+    Renvoie (noms, codes query, codes target, scores). Avec contigs=True, le
+    suffixe _N des gènes est retiré des identifiants.
+    """
+    codes = {}
+    queries, targets, scores = [], [], []
+    source = sys.stdin if path == "-" else path
+    reader = pd.read_csv(source, sep="\t", header=None, usecols=[0, 1, 2],
+                         names=["query", "target", "score"],
+                         dtype={"query": str, "target": str}, chunksize=chunk_size)
+    for chunk in reader:
+        # hashsums écrit une première ligne vide : les lignes incomplètes sont ignorées
+        chunk = chunk.dropna()
+        for col, parts in (("query", queries), ("target", targets)):
+            values = chunk[col]
+            if contigs:
+                values = values.str.replace(GENE_SUFFIX, '', regex=True)
+            for value in pd.unique(values):
+                if value not in codes:
+                    codes[value] = len(codes)
+            parts.append(values.map(codes).to_numpy(dtype=np.int64))
+        scores.append(pd.to_numeric(chunk["score"], errors='coerce').fillna(0).to_numpy(dtype=np.float64))
+
+    names = np.array(list(codes), dtype=object)
+    if not scores:
+        return names, np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    return names, np.concatenate(queries), np.concatenate(targets), np.concatenate(scores)
+
+
+def load_hits_store(path, max_evalue, with_evalues=False):
+    """Hits au niveau contig lus depuis le stockage colonnes d'un fichier d'alignements
+
+    Avec with_evalues=True, les e-values sont renvoyées en cinquième élément.
+    """
+    store = open_store(path)
+    columns = ["query", "target", "bits"] + (["evalue"] if with_evalues else [])
+    hits = store.read(columns, max_evalue=max_evalue, contigs=True)
+    loaded = (store.contigs, hits["query"].astype(np.int64), hits["target"].astype(np.int64),
+              hits["bits"].astype(np.float64))
+    return loaded + (hits["evalue"],) if with_evalues else loaded
+
+
+def aggregate(queries, targets, scores, n):
+    """Somme des scores par paire (query, target) dans une matrice creuse n x n"""
+    matrix = sparse.coo_matrix((scores, (queries, targets)), shape=(n, n)).tocsr()
+    matrix.sum_duplicates()
+    return matrix
+
+
+def sorted_contigs(names, queries, targets, sums, present=None):
+    """Restreint aux contigs présents et les ordonne par nom, comme la sortie de sort
+
+    present (masque booléen par contig) est complété sur place s'il est fourni.
+    """
+    if present is None:
+        present = np.zeros(len(names), dtype=bool)
+    present[queries] = True
+    present[targets] = True
+    keep = np.flatnonzero(present)
+    keep = keep[np.argsort(names[keep].astype(str), kind='stable')]
+    return names[keep], sums[keep][:, keep].tocsr()
+
+
+def bray_curtis_block(sums, sums_t, self_scores, rows):
+    """Distances des lignes rows à tous les contigs, en float32"""
+    block = (sums[rows] + sums_t[rows]).toarray()
+    denominator = self_scores[rows][:, None] + self_scores[None, :]
+    # Calcul en place dans le bloc float64 : un seul temporaire de la taille du bloc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(block, denominator, out=block)
+    del denominator
+    np.subtract(1.0, block, out=block)
+    # Contigs sans auto-alignement : aucune similarité mesurable
+    block[~np.isfinite(block)] = 1.0
+    np.clip(block, 0.0, 1.0, out=block)
+    block[np.arange(len(rows)), rows] = 0.0
+    return block.astype(np.float32)
+
+
+def available_memory():
+    """Mémoire disponible en octets (MemAvailable, sinon pages libres), None si inconnue"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_jobs(sums, block_rows):
+    """Nombre de workers : tous les cœurs, dans la limite de la mémoire disponible
+
+    Chaque worker reçoit sa copie des sommes creuses (et de leur transposée)
+    et tient un bloc dense de block_rows x n distances pendant le calcul.
+    """
+    n = sums.shape[0]
+    cores = os.cpu_count() or 1
+    per_worker = (min(block_rows, n) * n * BLOCK_BYTES_PER_CELL
+                  + 2 * (sums.data.nbytes + sums.indices.nbytes + sums.indptr.nbytes))
+    available = available_memory()
+    if available is None:
+        return cores
+    jobs = int(available * MEMORY_FRACTION // per_worker)
+    if jobs < 1:
+        logger.warning(f"Un worker demande ~{per_worker / 2**30:.1f} Gio pour "
+                       f"{available / 2**30:.1f} Gio disponibles : réduire --block-rows")
+    jobs = max(1, min(cores, jobs))
+    logger.info(f"{jobs} workers (~{per_worker / 2**30:.2f} Gio chacun, "
+                f"{available / 2**30:.1f} Gio disponibles, {cores} cœurs)")
+    return jobs
+
+
+# État des workers : matrices creuses reçues une fois à l'initialisation
+_worker = {}
+
+def init_worker(sums, sums_t, self_scores, dmat_path):
+    _worker['sums'] = sums
+    _worker['sums_t'] = sums_t
+    _worker['self_scores'] = self_scores
+    _worker['matrix'] = distance_matrix.open_rows(dmat_path, sums.shape[0], mode='r+')
+
+
+def compute_rows(bounds):
+    start, end = bounds
+    rows = np.arange(start, end)
+    block = bray_curtis_block(_worker['sums'], _worker['sums_t'], _worker['self_scores'], rows)
+    _worker['matrix'][start:end] = block
+    _worker['matrix'].flush()
+    return end - start
+
+
+def compute_matrix(names, sums, dmat_path, jobs=None, block_rows=1024):
+    """Remplit le fichier .dmat par blocs de lignes répartis sur jobs processus
+
+    Sans jobs, le nombre de processus est limité par la mémoire disponible.
+    """
+    n = len(names)
+    if jobs is None:
+        jobs = default_jobs(sums, block_rows)
+    sums_t = sums.T.tocsr()
+    self_scores = sums.diagonal().astype(np.float64)
+    distance_matrix.create(dmat_path, names)
+    blocks = [(start, min(start + block_rows, n)) for start in range(0, n, block_rows)]
+
+    done = 0
+    with Pool(jobs, initializer=init_worker, initargs=(sums, sums_t, self_scores, dmat_path)) as pool:
+        for count in pool.imap_unordered(compute_rows, blocks):
+            done += count
+            if done % (block_rows * 10) < count:
+                logger.info(f"Progression: {done}/{n} lignes")
+    logger.info(f"Matrice {n}x{n} calculée: {dmat_path}")
+    return dmat_path
+
+
+def parse_thresholds(text):
+    """'1e-10,1e-5,0.05' -> [(libellé, valeur)] triés du plus strict au plus large"""
+    thresholds = {}
+    for label in text.split(','):
+        label = label.strip()
+        if label:
+            thresholds[float(label)] = label
+    return [(label, value) for value, label in sorted(thresholds.items())]
+
+
+def sweep_path_for(output, label):
+    return f"{output}_e{label}.mat"
+
+
+def sweep_matrices(names, queries, targets, scores, evalues, thresholds, output,
+                   jobs=None, block_rows=1024, phylip=True):
+    """Une matrice par seuil à partir d'une seule lecture des hits
+
+    Chaque hit est rangé dans la tranche du seuil le plus strict qu'il passe
+    (e-value <= seuil) ; la matrice des sommes d'un seuil est celle du seuil
+    précédent plus sa tranche. Renvoie les chemins écrits (PHYLIP, ou .dmat
+    avec phylip=False), dans l'ordre des seuils.
+    """
+    n = len(names)
+    values = np.array([value for _, value in thresholds])
+    buckets = np.searchsorted(values, evalues, side='left')
+    order = np.argsort(buckets, kind='stable')
+    bounds = np.searchsorted(buckets[order], np.arange(len(values) + 1), side='left')
+
+    outputs = []
+    sums = sparse.csr_matrix((n, n), dtype=np.float64)
+    present = np.zeros(n, dtype=bool)
+    for k, (label, value) in enumerate(thresholds):
+        part = order[bounds[k]:bounds[k + 1]]
+        sums = sums + aggregate(queries[part], targets[part], scores[part], n)
+        logger.info(f"Seuil {label}: {bounds[k + 1]} hits cumulés")
+        if bounds[k + 1] == 0:
+            logger.warning(f"Seuil {label}: aucun hit, matrice non écrite")
+            continue
+        kept_names, kept_sums = sorted_contigs(names, queries[part], targets[part], sums, present)
+        matrix_path = sweep_path_for(output, label)
+        dmat_path = os.path.splitext(matrix_path)[0] + ".dmat"
+        compute_matrix(kept_names, kept_sums, dmat_path, jobs, block_rows)
+        if phylip:
+            distance_matrix.export_phylip(dmat_path, matrix_path, block_rows)
+        outputs.append(matrix_path if phylip else dmat_path)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matrice Bray-Curtis des contigs (remplace hashsums | tree_bray)")
+    parser.add_argument("input", help="TSV query, target, bitscore ('-' pour stdin), "
+                                      "ou fichier d'alignements 12 colonnes avec --alignments")
+    parser.add_argument("output", help="Matrice PHYLIP pour rapidnj -i pd (ou .dmat binaire seul)")
+    parser.add_argument("--contigs", action="store_true",
+                        help="Retirer le suffixe _N des gènes pour agréger par contig")
+    parser.add_argument("--alignments", action="store_true",
+                        help="L'entrée est un fichier d'alignements 12 colonnes (lu via alignment_store)")
+    parser.add_argument("-e", "--evalue", type=float, default=0.05,
+                        help="Seuil d'e-value avec --alignments (défaut: 0.05)")
+    parser.add_argument("--sweep", default=None, metavar="E1,E2,...",
+                        help="Avec --alignments : une matrice <sortie>_e<seuil>.mat par seuil, "
+                             "en une seule lecture des alignements")
+    parser.add_argument("--no-phylip", action="store_true",
+                        help="Avec --sweep : n'écrire que les matrices .dmat")
+    parser.add_argument("--block-rows", type=int, default=1024)
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Processus de calcul des blocs de lignes (défaut: tous les cœurs, "
+                             "dans la limite de la mémoire disponible)")
+    args = parser.parse_args()
+    if args.sweep and not args.alignments:
+        parser.error("--sweep nécessite --alignments (les e-values sont lues dans les alignements)")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    if args.sweep:
+        thresholds = parse_thresholds(args.sweep)
+        # Lecture unique au seuil le plus large
+        names, queries, targets, scores, evalues = load_hits_store(
+            args.input, thresholds[-1][1], with_evalues=True)
+        if len(scores) == 0:
+            logger.error("Aucun hit en entrée")
+            sys.exit(1)
+        logger.info(f"{len(scores)} hits entre {len(names)} contigs, "
+                    f"{len(thresholds)} seuils: {', '.join(label for label, _ in thresholds)}")
+        for path in sweep_matrices(names, queries, targets, scores, evalues, thresholds,
+                                   args.output, args.jobs, args.block_rows,
+                                   phylip=not args.no_phylip):
+            print(path)
+        return
+
+    if args.alignments:
+        names, queries, targets, scores = load_hits_store(args.input, args.evalue)
+    else:
+        names, queries, targets, scores = load_hits_tsv(args.input, args.contigs)
+    if len(scores) == 0:
+        logger.error("Aucun hit en entrée")
+        sys.exit(1)
+    logger.info(f"{len(scores)} hits entre {len(names)} contigs")
+
+    sums = aggregate(queries, targets, scores, len(names))
+    names, sums = sorted_contigs(names, queries, targets, sums)
+    if args.output.endswith(".dmat"):
+        compute_matrix(names, sums, args.output, args.jobs, args.block_rows)
+    else:
+        dmat_path = os.path.splitext(args.output)[0] + ".dmat"
+        compute_matrix(names, sums, dmat_path, args.jobs, args.block_rows)
+        distance_matrix.export_phylip(dmat_path, args.output, args.block_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,211 @@
+#!/usr/bin/env python3
+"""
+Heatmaps groupées des matrices de distances des trois outils d'alignement
+
+Mode rapide (défaut) : la liaison UPGMA est calculée une fois par matrice et
+mise en cache à côté d'elle (<matrice>.dmat.<méthode>.linkage.npz, clé = SHA-256
+du fichier), la matrice est réordonnée selon les feuilles du dendrogramme et
+réduite par moyenne de blocs à la taille de l'image, bloc de lignes par bloc
+de lignes depuis la mmap, avant d'être tracée. Les trois outils sont rendus
+en parallèle, une image PNG chacun.
+
+Le mode clustermap garde l'ancien rendu seaborn (matrice complète, affichage
+interactif), avec la liaison en cache.
+
+Usage:
+    python heatmap.py
+    python heatmap.py --pixels 1500 --output-dir figures
+    python heatmap.py --mode clustermap
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+import logging
+from multiprocessing import Pool
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 from scipy.spatial.distance import squareform
-from scipy.cluster.hierarchy import linkage
+from scipy.cluster.hierarchy import linkage, leaves_list, dendrogram
+import distance_matrix
+
+logger = logging.getLogger(__name__)
 
-# Dictionnaire : nom de l’outil -> chemin du fichier .csv
+# Dictionnaire : nom de l’outil -> chemin de la matrice (.dmat, ou PHYLIP converti une fois en .dmat)
 tools = {
     "FASTA36": "fasta36_vOTUs.mat",
     "MMseqs2_sens7.5": "mm_sensitive_vOTUs.mat",
     "DIAMOND": "diamond_vOTUs.mat"
 }
 
-# Afficher une heatmap pour chaque outil
-for name, filepath in tools.items():
-    
-    # 1. Lire la matrice depuis le fichier CSV
-    df = pd.read_csv(filepath, index_col=0)
-    
+LINKAGE_METHOD = "average"
+# Lignes de la matrice lues ensemble lors de la réduction
+READ_BLOCK_ROWS = 512
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def linkage_cache_path(dmat_path, method):
+    return f"{dmat_path}.{method}.linkage.npz"
+
+
+def cached_linkage(dmat_path, matrix, method=LINKAGE_METHOD):
+    """Liaison hiérarchique de la matrice, relue du cache si le fichier n'a pas changé"""
+    cache = linkage_cache_path(dmat_path, method)
+    key = file_hash(dmat_path)
+    if os.path.exists(cache):
+        with np.load(cache) as data:
+            if str(data['key']) == key:
+                logger.info(f"Liaison relue du cache: {cache}")
+                return data['linkage']
+    logger.info(f"Calcul de la liaison ({method}) sur {matrix.shape[0]} séquences")
+    linkage_matrix = linkage(squareform(np.asarray(matrix), checks=False), method=method)
+    tmp_cache = f"{cache}.tmp.npz"
+    np.savez(tmp_cache, key=key, linkage=linkage_matrix)
+    os.replace(tmp_cache, cache)
+    return linkage_matrix
+
+
+def bin_edges(n, pixels):
+    """Bornes des blocs de lignes/colonnes ; un pixel par séquence si n <= pixels"""
+    return np.linspace(0, n, min(n, pixels) + 1).round().astype(np.int64)
+
+
+def downsample(matrix, order, pixels):
+    """Matrice réordonnée selon order et réduite par moyenne de blocs (au plus pixels x pixels)
+
+    Seules READ_BLOCK_ROWS lignes sont lues à la fois depuis la mmap.
+    """
+    edges = bin_edges(len(order), pixels)
+    sizes = np.diff(edges)
+    image = np.zeros((len(sizes), len(sizes)), dtype=np.float64)
+    for b in range(len(sizes)):
+        for start in range(edges[b], edges[b + 1], READ_BLOCK_ROWS):
+            stop = min(start + READ_BLOCK_ROWS, edges[b + 1])
+            rows = np.sort(order[start:stop])
+            column_sums = np.asarray(matrix[rows], dtype=np.float64).sum(axis=0)[order]
+            image[b] += np.add.reduceat(column_sums, edges[:-1])
+        image[b] /= sizes[b] * sizes
+    return image.astype(np.float32)
+
+
+def render_fast(name, filepath, output_dir, pixels, cmap):
+    """Heatmap réduite d'un outil, écrite en PNG ; renvoie le chemin de l'image"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    dmat_path = distance_matrix.ensure_dmat(filepath)
+    names, matrix = distance_matrix.open_matrix(dmat_path)
+    n = len(names)
+    logger.info(f"{name}: matrice {n}x{n}")
+
+    linkage_matrix = cached_linkage(dmat_path, matrix)
+    order = leaves_list(linkage_matrix)
+    image = downsample(matrix, order, pixels)
+
+    # dendrogram est récursif sur la profondeur de l'arbre
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * n))
+    fig = plt.figure(figsize=(12, 10))
+    grid = fig.add_gridspec(2, 3, width_ratios=[0.15, 1, 0.03], height_ratios=[0.15, 1],
+                            wspace=0.01, hspace=0.01)
+    ax_top = fig.add_subplot(grid[0, 1])
+    ax_left = fig.add_subplot(grid[1, 0])
+    ax_heat = fig.add_subplot(grid[1, 1])
+    ax_bar = fig.add_subplot(grid[1, 2])
+    for ax, orientation in ((ax_top, "top"), (ax_left, "left")):
+        dendrogram(linkage_matrix, ax=ax, orientation=orientation, no_labels=True,
+                   color_threshold=0, link_color_func=lambda _: "black")
+        ax.set_axis_off()
+    ax_left.invert_yaxis()
+    heat = ax_heat.imshow(image, cmap=cmap, aspect="auto", interpolation="nearest",
+                          vmin=0.0, vmax=1.0)
+    ax_heat.set_xticks([])
+    ax_heat.set_yticks([])
+    fig.colorbar(heat, cax=ax_bar)
+    fig.suptitle(f"Heatmap – {name} ({n} séquences)", y=0.95)
+
+    output = os.path.join(output_dir, f"heatmap_{name}.png")
+    fig.savefig(output, dpi=100)
+    plt.close(fig)
+    logger.info(f"{name}: image écrite: {output}")
+    return output
+
+
+def load_distance_matrix(dmat_path):
+    """Matrice float32 en mmap, en DataFrame étiqueté (sans copie)"""
+    names, matrix = distance_matrix.open_matrix(dmat_path)
+    return pd.DataFrame(matrix, index=names, columns=names, copy=False)
+
+
+def render_clustermap(name, filepath, cmap):
+    """Ancien rendu : clustermap seaborn sur la matrice complète, affiché à l'écran"""
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    # 1. Lire la matrice (mmap float32 ; un fichier PHYLIP texte est converti une fois en .dmat)
+    dmat_path = distance_matrix.ensure_dmat(filepath)
+    df = load_distance_matrix(dmat_path)
+
     print(f"{name} shape: {df.shape}")
     print(f"Colonnes: {df.columns[:5]}")
     print(f"Lignes: {df.index[:5]}")
 
-
     # 2. Vérification basique
     assert df.shape[0] == df.shape[1], f"Matrice non carrée pour {name}"
-    
-    # 3. Clustering hiérarchique basé sur les distances
-    linkage_matrix = linkage(squareform(df.values), method="average")
-    
+
+    # 3. Clustering hiérarchique basé sur les distances (en cache)
+    linkage_matrix = cached_linkage(dmat_path, df.values)
+
     # 4. Générer la heatmap avec clustering
     g = sns.clustermap(df,
                        row_linkage=linkage_matrix,
                        col_linkage=linkage_matrix,
-                       cmap="mako",  # ou 'viridis', 'coolwarm', etc.
+                       cmap=cmap,  # ou 'viridis', 'coolwarm', etc.
                        figsize=(12, 10),
                        xticklabels=False,
                        yticklabels=False)
 
     g.fig.suptitle(f"Heatmap – {name}", y=1.02)
     plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heatmaps groupées des matrices de distances")
+    parser.add_argument("--mode", choices=["fast", "clustermap"], default="fast",
+                        help="fast: images PNG réduites, outils en parallèle ; "
+                             "clustermap: ancien rendu seaborn")
+    parser.add_argument("--pixels", type=int, default=2000,
+                        help="Taille maximale de la heatmap en pixels (mode fast)")
+    parser.add_argument("--output-dir", default=".", help="Dossier des images (mode fast)")
+    parser.add_argument("--cmap", default="mako")
+    parser.add_argument("--jobs", type=int, default=len(tools),
+                        help="Outils rendus en parallèle (mode fast)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    if args.mode == "clustermap":
+        for name, filepath in tools.items():
+            render_clustermap(name, filepath, args.cmap)
+        return
+
+    # La palette seaborn est résolue ici, les workers n'importent que matplotlib
+    import seaborn as sns
+    cmap = sns.color_palette(args.cmap, as_cmap=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = [(name, filepath, args.output_dir, args.pixels, cmap) for name, filepath in tools.items()]
+    with Pool(max(1, min(args.jobs, len(tasks)))) as pool:
+        for output in pool.starmap(render_fast, tasks):
+            print(output)
+
+
+if __name__ == "__main__":
+    main()
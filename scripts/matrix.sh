@@ -2,28 +2,32 @@
 
 # Script pour convertir des alignements MMseqs2 en arbre phylogénétique
 # Reproduit la pipeline: filtrage -> nettoyage -> hashsums -> tree_bray -> rapidnj
+# (hashsums et tree_bray sont remplacés par generate_bray_matrix.py ; l'arbre est construit par
+# neighbor_joining.py, avec rapidnj par défaut ou le moteur numpy via -n numpy)
 # Version corrigée avec diagnostics détaillés
 
-export TMPDIR="$PWD/tmp_sort"
-mkdir -p "$TMPDIR"
-
 set -e  # Arrêter en cas d'erreur
 
+# Chemin pour les scripts
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Paramètres par défaut
 INPUT_FILE="full_results.tab"
 EVALUE_THRESHOLD=0.05
 OUTPUT_PREFIX="fasta36_new"
 TEMP_DIR=$(mktemp -d)
 DEBUG=false
+NJ_BACKEND="${NJ_BACKEND:-rapidnj}"
 
 # Fonction d'aide
 usage() {
-    echo "Usage: $0 -i <fichier_mmseqs2> [-e <seuil_evalue>] [-o <prefixe_sortie>] [-d] [-h]"
+    echo "Usage: $0 -i <fichier_mmseqs2> [-e <seuil_evalue>] [-o <prefixe_sortie>] [-n rapidnj|numpy] [-d] [-h]"
     echo ""
     echo "Options:"
     echo "  -i  Fichier d'alignements MMseqs2 (obligatoire)"
     echo "  -e  Seuil d'e-value (défaut: 0.05)"
     echo "  -o  Préfixe pour les fichiers de sortie (défaut: diamond_vOTUs)"
+    echo "  -n  Moteur neighbor-joining: rapidnj ou numpy (défaut: rapidnj)"
     echo "  -d  Mode debug (affiche les fichiers intermédiaires)"
     echo "  -h  Afficher cette aide"
     echo ""
@@ -42,11 +46,12 @@ cleanup() {
 trap cleanup EXIT
 
 # Parsing des arguments
-while getopts "i:e:o:dh" opt; do
+while getopts "i:e:o:n:dh" opt; do
     case $opt in
         i) INPUT_FILE="$OPTARG" ;;
         e) EVALUE_THRESHOLD="$OPTARG" ;;
         o) OUTPUT_PREFIX="$OPTARG" ;;
+        n) NJ_BACKEND="$OPTARG" ;;
         d) DEBUG=true ;;
         h) usage ;;
         *) usage ;;
@@ -83,6 +88,14 @@ find_tool() {
     return 0
 }
 
+RAPIDNJ_CMD="rapidnj"
+if [[ "$NJ_BACKEND" == "rapidnj" ]]; then
+    if ! RAPIDNJ_CMD=$(find_tool rapidnj); then
+        echo "Erreur: rapidnj introuvable (répertoire courant ou PATH) ; utilisez -n numpy"
+        exit 1
+    fi
+fi
+
 
 echo "=== Pipeline MMseqs2 vers arbre phylogénétique ==="
 echo "Fichier d'entrée: $INPUT_FILE"
@@ -131,14 +144,23 @@ fi
 echo "Utilisation: e-value=colonne $EVALUE_COL, score=colonne $BITSCORE_COL"
 
 # Filtrage adaptatif
-awk -v threshold="$EVALUE_THRESHOLD" -v eval_col="$EVALUE_COL" -v score_col="$BITSCORE_COL" '
-    NF >= eval_col && $eval_col <= threshold && $eval_col != "" && $score_col != "" {
-        # Éviter les auto-alignements
-        if ($1 != $2) {
-            print $1 "\t" $2 "\t" $score_col
+IDS_CLEANED=false
+if [[ $NUM_COLS -ge 12 ]]; then
+    # Format 12 colonnes : lecture du stockage colonnes (<fichier>.aln, converti une fois),
+    # sans les auto-alignements, noms de séquences directement au niveau contig
+    python3 "$SCRIPT_DIR/alignment_store.py" pairs "$INPUT_FILE" -e "$EVALUE_THRESHOLD" \
+        --contigs --no-self > "$FILTERED_FILE"
+    IDS_CLEANED=true
+else
+    awk -v threshold="$EVALUE_THRESHOLD" -v eval_col="$EVALUE_COL" -v score_col="$BITSCORE_COL" '
+        NF >= eval_col && $eval_col <= threshold && $eval_col != "" && $score_col != "" {
+            # Éviter les auto-alignements
+            if ($1 != $2) {
+                print $1 "\t" $2 "\t" $score_col
+            }
         }
-    }
-' "$INPUT_FILE" > "$FILTERED_FILE"
+    ' "$INPUT_FILE" > "$FILTERED_FILE"
+fi
 
 if [[ ! -s "$FILTERED_FILE" ]]; then
     echo "Erreur: Aucun alignement ne passe le filtre e-value <= $EVALUE_THRESHOLD"
@@ -168,7 +190,11 @@ echo "Étape 2: Nettoyage des noms de séquences..."
 CLEANED_FILE="$TEMP_DIR/cleaned.tsv"
 
 # Nettoyage plus robuste des suffixes numériques
-sed -E 's/_[0-9]+(\t|\s)/\1/g' "$FILTERED_FILE" > "$CLEANED_FILE"
+if [[ $IDS_CLEANED == "true" ]]; then
+    cp "$FILTERED_FILE" "$CLEANED_FILE"
+else
+    sed -E 's/_[0-9]+(\t|\s)/\1/g' "$FILTERED_FILE" > "$CLEANED_FILE"
+fi
 
 if [[ $DEBUG == "true" ]]; then
     echo "Exemple après nettoyage:"
@@ -176,86 +202,37 @@ if [[ $DEBUG == "true" ]]; then
     echo ""
 fi
 
-# Étape 3: Tri des données
-echo "Étape 3: Tri des données..."
-SORTED_FILE="$TEMP_DIR/sorted.tsv"
-sort -k1,1 -k2,2 "$CLEANED_FILE" > "$SORTED_FILE"
-
-# Étape 4: Calcul des sommes (hashsums)
-echo "Étape 4: Calcul des sommes par paire..."
-HASHSUMS_FILE="$TEMP_DIR/hashsums.tsv"
-
-# Vérifier que hashsums fonctionne
-if ! "$HASHSUMS_CMD" < "$SORTED_FILE" > "$HASHSUMS_FILE" 2>/dev/null; then
-    echo "Erreur: Échec du calcul des hashsums"
-    echo "Vérifiez le format des données d'entrée pour hashsums"
-    
-    if [[ $DEBUG == "true" ]]; then
-        echo "Données envoyées à hashsums:"
-        head -5 "$SORTED_FILE"
-    fi
-    exit 1
-fi
+# Étapes 3-5: Sommes des bitscores par paire de contigs et distances de Bray-Curtis
+# (remplace sort | hashsums | tree_bray : plus de tri textuel ni de répertoire de débordement)
+echo "Étapes 3-5: Calcul de la matrice de distances de Bray-Curtis..."
+# Matrice binaire seule (.dmat), lue directement par neighbor_joining.py
+MATRIX_FILE="${OUTPUT_PREFIX}.dmat"
 
-if [[ ! -s "$HASHSUMS_FILE" ]]; then
-    echo "Erreur: hashsums n'a produit aucun résultat"
-    exit 1
-fi
-
-HASHSUMS_COUNT=$(wc -l < "$HASHSUMS_FILE")
-echo "  $HASHSUMS_COUNT paires uniques"
-
-if [[ $DEBUG == "true" ]]; then
-    echo "Exemple de hashsums:"
-    head -5 "$HASHSUMS_FILE"
-    echo ""
-fi
-
-echo "Contenu de $HASHSUMS_FILE :"
-head -5 "$HASHSUMS_FILE"
-
-# Étape 5: Calcul de la matrice de distances (tree_bray)
-echo "Étape 5: Calcul de la matrice de distances de Bray-Curtis..."
-MATRIX_FILE="${OUTPUT_PREFIX}.mat"
-
-# Vérifier que tree_bray fonctionne
-if ! "$TREE_BRAY_CMD" < "$HASHSUMS_FILE" > "$MATRIX_FILE" 2>/dev/null; then
+if ! python3 "$SCRIPT_DIR/generate_bray_matrix.py" "$CLEANED_FILE" "$MATRIX_FILE"; then
     echo "Erreur: Échec du calcul de la matrice de distances"
-    echo "Vérifiez le format des données d'entrée pour tree_bray"
+    echo "Vérifiez le format des données d'entrée (query, target, score)"
     
     if [[ $DEBUG == "true" ]]; then
-        echo "Données envoyées à tree_bray:"
-        head -5 "$HASHSUMS_FILE"
+        echo "Données envoyées à generate_bray_matrix.py:"
+        head -5 "$CLEANED_FILE"
     fi
     exit 1
 fi
 
 if [[ ! -s "$MATRIX_FILE" ]]; then
-    echo "Erreur: tree_bray n'a produit aucun résultat"
+    echo "Erreur: generate_bray_matrix.py n'a produit aucun résultat"
     exit 1
 fi
 
-# Analyser la matrice produite
+# Analyser la matrice produite (les noms sont dans <matrice>.names, un par ligne)
 echo "Analyse de la matrice générée:"
-MATRIX_LINES=$(wc -l < "$MATRIX_FILE")
-echo "  Nombre de lignes dans la matrice: $MATRIX_LINES"
-
-# Vérifier le format de la matrice
-FIRST_LINE=$(head -n1 "$MATRIX_FILE")
-echo "  Première ligne: $FIRST_LINE"
-
-# Tenter d'extraire le nombre de séquences
-if [[ "$FIRST_LINE" =~ ^[[:space:]]*([0-9]+) ]]; then
-    NUM_SEQUENCES="${BASH_REMATCH[1]}"
-    echo "  Nombre de séquences: $NUM_SEQUENCES"
-else
-    echo "  Attention: Format de matrice non standard"
-    NUM_SEQUENCES="inconnu"
-fi
+NUM_SEQUENCES=$(wc -l < "$MATRIX_FILE.names")
+echo "  Nombre de séquences: $NUM_SEQUENCES"
 
 if [[ $DEBUG == "true" ]]; then
-    echo "Premières lignes de la matrice:"
-    head -5 "$MATRIX_FILE"
+    echo "Premières séquences de la matrice:"
+    head -5 "$MATRIX_FILE.names"
+    echo "(export PHYLIP: python3 $SCRIPT_DIR/distance_matrix.py to-phylip $MATRIX_FILE ${OUTPUT_PREFIX}.mat)"
     echo ""
 fi
 
@@ -263,23 +240,15 @@ fi
 echo "Étape 6: Construction de l'arbre phylogénétique..."
 TREE_FILE="${OUTPUT_PREFIX}.nwk"
 
-# Tester différents formats de matrice pour rapidnj
-echo "Test de rapidnj avec format phylip distance (-i pd)..."
-if "$RAPIDNJ_CMD" -i pd "$MATRIX_FILE" > "$TREE_FILE" 2>/dev/null; then
-    echo "  Succès avec format phylip distance"
-elif "$RAPIDNJ_CMD" -i dm "$MATRIX_FILE" > "$TREE_FILE" 2>/dev/null; then
-    echo "  Succès avec format distance matrix"
-elif "$RAPIDNJ_CMD" "$MATRIX_FILE" > "$TREE_FILE" 2>/dev/null; then
-    echo "  Succès avec format par défaut"
-else
-    echo "Erreur: Échec de la construction de l'arbre avec tous les formats testés"
+# Neighbor-joining sur la matrice binaire (exportée en PHYLIP pour rapidnj)
+if ! python3 "$SCRIPT_DIR/neighbor_joining.py" --nj "$NJ_BACKEND" --rapidnj "$RAPIDNJ_CMD" \
+    "$MATRIX_FILE" "$TREE_FILE"; then
+    echo "Erreur: Échec de la construction de l'arbre avec $NJ_BACKEND"
     echo ""
     echo "Diagnostic de la matrice:"
     echo "Taille du fichier: $(ls -lh "$MATRIX_FILE" | awk '{print $5}')"
-    echo "Premières lignes:"
-    head -3 "$MATRIX_FILE"
-    echo ""
-    echo "Essayez de vérifier manuellement le format de votre matrice"
+    echo "Premières séquences:"
+    head -3 "$MATRIX_FILE.names"
     exit 1
 fi
 
@@ -295,7 +264,7 @@ echo "  Arbre phylogénétique généré: $TREE_FILE"
 echo ""
 echo "=== Pipeline terminée avec succès ==="
 echo "Fichiers générés:"
-echo "  - Matrice de distances: $MATRIX_FILE ($(wc -l < "$MATRIX_FILE") lignes)"
+echo "  - Matrice de distances: $MATRIX_FILE ($NUM_SEQUENCES x $NUM_SEQUENCES)"
 echo "  - Arbre phylogénétique: $TREE_FILE ($(wc -c < "$TREE_FILE") caractères)"
 echo "  - Nombre de séquences: $NUM_SEQUENCES"
 echo ""
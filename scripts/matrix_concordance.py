@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Concordance entre les matrices de distances de plusieurs outils d'alignement
+
+Les matrices (.dmat, ou PHYLIP converti une fois) sont restreintes aux vOTUs
+communs, triés par nom, et lues en vecteurs condensés float32 (paires i < j).
+Pour chaque paire d'outils :
+
+  - corrélation de Mantel (Pearson, ou Spearman sur les rangs) et p-value par
+    permutations des étiquettes d'une des deux matrices ;
+  - corrélation cophénétique des arbres UPGMA de chaque matrice (arbre contre
+    sa matrice, et arbre contre arbre) ;
+  - accord des plus proches voisins : part des vOTUs dont le plus proche
+    voisin selon un outil est aussi le plus proche selon l'autre, et rang
+    médian de ce voisin dans l'autre matrice.
+
+Les permutations sont faites par lots dans un pool de processus. Chaque
+matrice centrée-réduite est écrite une fois en .dmat temporaire que les
+workers lisent par mmap ; un lot lit chaque bloc de lignes de la première
+matrice une seule fois pour toutes ses permutations, et la statistique d'une
+permutation p est sum_ij A_ij B_p(i)p(j) / 2, sans reconstruire de vecteur
+condensé permuté.
+
+Usage:
+    python matrix_concordance.py fasta36_vOTUs.dmat mm_sensitive_vOTUs.dmat diamond_vOTUs.dmat \\
+        --labels FASTA36,MMseqs2,DIAMOND -p 999 --jobs 16 -o concordance.tsv
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import logging
+import tempfile
+from itertools import combinations
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+from scipy.cluster.hierarchy import linkage, cophenet
+
+import distance_matrix
+from heatmap import LINKAGE_METHOD, cached_linkage
+
+logger = logging.getLogger(__name__)
+
+# Lignes lues ensemble par les workers de permutation et le calcul des voisins
+BLOCK_ROWS = 256
+# Permutations par tâche envoyée au pool
+PERMUTATION_BATCH = 8
+# Taille des tranches pour les corrélations sur vecteurs condensés
+CHUNK_SIZE = 10_000_000
+
+
+def condensed_offsets(m):
+    """Position dans le vecteur condensé du début de chaque ligne i (paires (i, j > i))"""
+    i = np.arange(m, dtype=np.int64)
+    return i * (2 * m - i - 1) // 2
+
+
+def load_aligned(paths):
+    """Noms communs (triés) et, par matrice, vecteur condensé float32 sur ces noms"""
+    matrices = []
+    for path in paths:
+        dmat_path = distance_matrix.ensure_dmat(path)
+        names, matrix = distance_matrix.open_matrix(dmat_path)
+        matrices.append((dmat_path, names, matrix))
+
+    common = set(matrices[0][1])
+    for _, names, _ in matrices[1:]:
+        common &= set(names)
+    common = np.array(sorted(common), dtype=object)
+    m = len(common)
+    if m < 3:
+        raise ValueError(f"Seulement {m} vOTUs communs aux matrices")
+
+    offsets = condensed_offsets(m)
+    aligned = []
+    for (dmat_path, names, matrix), path in zip(matrices, paths):
+        position = {name: k for k, name in enumerate(names)}
+        index = np.array([position[name] for name in common], dtype=np.int64)
+        vector = np.empty(m * (m - 1) // 2, dtype=np.float32)
+        for start in range(0, m, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, m)
+            block = np.asarray(matrix[np.sort(index[start:stop])])
+            block = block[np.argsort(np.argsort(index[start:stop]))][:, index]
+            for k, i in enumerate(range(start, stop)):
+                vector[offsets[i]:offsets[i] + m - i - 1] = block[k, i + 1:]
+        logger.info(f"{path}: {len(names)} vOTUs, {m} communs")
+        aligned.append({'path': dmat_path, 'vector': vector,
+                        'identity': m == len(names) and np.array_equal(index, np.arange(m))})
+    return common, aligned
+
+
+def standardized(vector, method):
+    """Vecteur centré, de norme 1 (sur les rangs pour Spearman), en float32"""
+    values = rankdata(vector) if method == "spearman" else vector.astype(np.float64)
+    values -= values.mean()
+    values /= np.sqrt(np.dot(values, values))
+    return values.astype(np.float32)
+
+
+def write_square(vector, names, path):
+    """Réécrit un vecteur condensé en matrice carrée .dmat (diagonale nulle)"""
+    m = len(names)
+    offsets = condensed_offsets(m)
+    square = distance_matrix.create(path, names)
+    for i in range(m):
+        lower = np.arange(i)
+        square[i, :i] = vector[offsets[lower] + i - lower - 1]
+        square[i, i] = 0.0
+        square[i, i + 1:] = vector[offsets[i]:offsets[i] + m - i - 1]
+    square.flush()
+    return path
+
+
+def pearson(x, y):
+    """Corrélation de Pearson de deux vecteurs condensés, par tranches (sans copie complète)"""
+    n = len(x)
+    mean_x = sum(float(x[s:s + CHUNK_SIZE].sum(dtype=np.float64)) for s in range(0, n, CHUNK_SIZE)) / n
+    mean_y = sum(float(y[s:s + CHUNK_SIZE].sum(dtype=np.float64)) for s in range(0, n, CHUNK_SIZE)) / n
+    sxy = sxx = syy = 0.0
+    for s in range(0, n, CHUNK_SIZE):
+        dx = x[s:s + CHUNK_SIZE].astype(np.float64) - mean_x
+        dy = y[s:s + CHUNK_SIZE].astype(np.float64) - mean_y
+        sxy += np.dot(dx, dy)
+        sxx += np.dot(dx, dx)
+        syy += np.dot(dy, dy)
+    return sxy / np.sqrt(sxx * syy)
+
+
+# État des workers : matrices centrées-réduites ouvertes une fois par processus
+_worker = {}
+
+def init_worker(path_a, path_b):
+    _worker['a'] = distance_matrix.open_matrix(path_a)[1]
+    _worker['b'] = distance_matrix.open_matrix(path_b)[1]
+
+
+def permutation_batch(task):
+    """Statistiques de Mantel d'un lot de permutations (graine, taille du lot)"""
+    seed, count = task
+    a, b = _worker['a'], _worker['b']
+    m = a.shape[0]
+    rng = np.random.default_rng(seed)
+    permutations = [rng.permutation(m) for _ in range(count)]
+    stats = np.zeros(count)
+    for start in range(0, m, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, m)
+        a_block = np.asarray(a[start:stop])
+        for k, p in enumerate(permutations):
+            rows = p[start:stop]
+            order = np.argsort(rows)
+            b_block = np.asarray(b[rows[order]])[np.argsort(order)][:, p]
+            stats[k] += np.einsum('ij,ij->', a_block, b_block, dtype=np.float64)
+    return stats / 2
+
+
+def mantel(path_a, path_b, observed, permutations, jobs, seed):
+    """p-value unilatérale (corrélation >= observée) par permutations en parallèle"""
+    if permutations <= 0:
+        return np.nan
+    root = np.random.SeedSequence(seed)
+    sizes = [min(PERMUTATION_BATCH, permutations - s) for s in range(0, permutations, PERMUTATION_BATCH)]
+    tasks = [(child, size) for child, size in zip(root.spawn(len(sizes)), sizes)]
+    exceed = 0
+    done = 0
+    with Pool(jobs, initializer=init_worker, initargs=(path_a, path_b)) as pool:
+        for stats in pool.imap_unordered(permutation_batch, tasks):
+            exceed += int(np.count_nonzero(stats >= observed - 1e-7))
+            done += len(stats)
+            if done % (PERMUTATION_BATCH * 25) < len(stats):
+                logger.info(f"Permutations: {done}/{permutations}")
+    return (exceed + 1) / (permutations + 1)
+
+
+def nearest_neighbour_agreement(path_a, path_b):
+    """Accord des plus proches voisins de a vers b : (part identique, rang médian dans b)"""
+    a = distance_matrix.open_matrix(path_a)[1]
+    b = distance_matrix.open_matrix(path_b)[1]
+    m = a.shape[0]
+    ranks = np.empty(m, dtype=np.int64)
+    for start in range(0, m, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, m)
+        rows = np.arange(stop - start)
+        a_block = np.array(a[start:stop])
+        b_block = np.array(b[start:stop])
+        a_block[rows, rows + start] = np.inf
+        b_block[rows, rows + start] = np.inf
+        nearest = np.argmin(a_block, axis=1)
+        # Rang (1 = plus proche) du voisin de a parmi les distances de b, ex aequo favorables
+        ranks[start:stop] = (b_block < b_block[rows, nearest][:, None]).sum(axis=1) + 1
+    return float(np.mean(ranks == 1)), float(np.median(ranks))
+
+
+def tree_cophenetic(entry, vector):
+    """Distances cophénétiques de l'arbre UPGMA et corrélation arbre / matrice"""
+    if entry['identity']:
+        names, matrix = distance_matrix.open_matrix(entry['path'])
+        linkage_matrix = cached_linkage(entry['path'], matrix)
+    else:
+        linkage_matrix = linkage(vector, method=LINKAGE_METHOD)
+    distances = cophenet(linkage_matrix).astype(np.float32)
+    return distances, pearson(distances, vector)
+
+
+def compare(paths, labels, permutations=999, jobs=1, method="pearson", seed=0, work_dir=None):
+    """Tableau des statistiques de concordance pour chaque paire de matrices"""
+    names, aligned = load_aligned(paths)
+    work_dir = tempfile.mkdtemp(prefix="concordance_", dir=work_dir)
+    try:
+        for k, entry in enumerate(aligned):
+            # Vecteur centré-réduit gardé pour les corrélations observées (calculé une fois)
+            entry['std'] = standardized(entry['vector'], method)
+            entry['std_path'] = write_square(entry['std'], names,
+                                             os.path.join(work_dir, f"std_{k}.dmat"))
+            entry['cophenetic'], entry['cophenetic_r'] = tree_cophenetic(entry, entry['vector'])
+            logger.info(f"{labels[k]}: corrélation cophénétique arbre/matrice "
+                        f"{entry['cophenetic_r']:.4f}")
+
+        rows = []
+        for (i, a), (j, b) in combinations(enumerate(aligned), 2):
+            logger.info(f"Comparaison {labels[i]} / {labels[j]}")
+            observed = sum(float(np.dot(a['std'][s:s + CHUNK_SIZE].astype(np.float64),
+                                        b['std'][s:s + CHUNK_SIZE]))
+                           for s in range(0, len(a['std']), CHUNK_SIZE))
+            p_value = mantel(a['std_path'], b['std_path'], observed, permutations, jobs, seed)
+            agreement_ab, rank_ab = nearest_neighbour_agreement(a['std_path'], b['std_path'])
+            agreement_ba, rank_ba = nearest_neighbour_agreement(b['std_path'], a['std_path'])
+            rows.append({
+                'tool_a': labels[i], 'tool_b': labels[j], 'n_common': len(names),
+                'mantel_r': observed, 'mantel_p': p_value, 'permutations': permutations,
+                'cophenetic_a': a['cophenetic_r'], 'cophenetic_b': b['cophenetic_r'],
+                'cophenetic_ab': pearson(a['cophenetic'], b['cophenetic']),
+                'nn_agreement_ab': agreement_ab, 'nn_agreement_ba': agreement_ba,
+                'nn_median_rank_ab': rank_ab, 'nn_median_rank_ba': rank_ba,
+            })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concordance des matrices de distances (Mantel, "
+                                                 "cophénétique, plus proches voisins)")
+    parser.add_argument("matrices", nargs='+', help="Matrices .dmat (ou PHYLIP), au moins deux")
+    parser.add_argument("--labels", default=None, help="Noms des outils, séparés par des virgules")
+    parser.add_argument("-p", "--permutations", type=int, default=999)
+    parser.add_argument("--method", choices=["pearson", "spearman"], default="pearson")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None,
+                        help="Dossier des matrices temporaires (défaut: TMPDIR)")
+    parser.add_argument("-o", "--output", default=None, help="TSV de sortie (défaut: stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    if len(args.matrices) < 2:
+        parser.error("au moins deux matrices sont nécessaires")
+    labels = (args.labels.split(',') if args.labels
+              else [os.path.splitext(os.path.basename(path))[0] for path in args.matrices])
+    if len(labels) != len(args.matrices):
+        parser.error("--labels doit donner un nom par matrice")
+    for path in args.matrices:
+        if not os.path.exists(path):
+            logger.error(f"Fichier introuvable: {path}")
+            sys.exit(1)
+
+    table = compare(args.matrices, labels, args.permutations, args.jobs, args.method,
+                    args.seed, args.work_dir)
+    table.to_csv(args.output or sys.stdout, sep="\t", index=False, float_format="%.6g")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Recherche MMseqs2 découpée en chunks de requêtes, reprenable après interruption
+
+Le FASTA des requêtes est découpé en chunks consécutifs équilibrés en résidus ;
+chaque chunk est cherché contre la base cible complète (les e-values sont donc
+celles d'une recherche unique) puis converti en tabulaire. Un chunk terminé est
+marqué par chunk_<n>.done : après un arrêt (préemption, timeout), une relance
+ne traite que les chunks manquants, et les fichiers temporaires d'un chunk
+interrompu sont gardés pour que MMseqs2 reprenne ses propres étapes. Les
+chunks tournent en parallèle dans la limite d'un budget de cœurs, et les
+tabulaires sont concaténés dans l'ordre des requêtes à la fin.
+
+Usage:
+    python mmseqs_chunked.py proteins.faa -o all_vs_all.m8 --chunks 16 --jobs 4 --threads 32 \\
+        -e 0.05 --max-seqs 100000 -c 0.5 --start-sens 7.5
+Les options inconnues sont transmises telles quelles à mmseqs search.
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import shutil
+import argparse
+import logging
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from fasta_index import split_by_length
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT_FORMAT = "query,target,pident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,evalue,bits"
+PLAN_NAME = "plan.json"
+
+
+def run(cmd, description, log):
+    log.info(f"Exécution: {description}")
+    log.info(f"Commande: {' '.join(cmd)}")
+    try:
+        return subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        log.error(f"Erreur lors de l'exécution de: {description}")
+        log.error(f"Code d'erreur: {e.returncode}")
+        log.error(f"Stderr: {e.stderr}")
+        raise
+
+
+def file_signature(path):
+    """Taille et SHA-256 du contenu : un FASTA réécrit à l'identique garde ses chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return [os.path.getsize(path), digest.hexdigest()]
+
+
+def remove_db(prefix):
+    """Supprime les fichiers d'une base MMseqs2 (<prefix>, <prefix>.index, <prefix>_h...)"""
+    for path in glob.glob(f"{prefix}") + glob.glob(f"{prefix}.*") + glob.glob(f"{prefix}_*"):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def prepare_plan(query_faa, target_faa, work_dir, n_chunks, params):
+    """Découpe les requêtes, ou reprend le découpage existant s'il correspond aux entrées
+
+    Renvoie la liste des noms de chunks.
+    """
+    plan = {
+        'query': file_signature(query_faa),
+        'target': file_signature(target_faa),
+        'chunks': n_chunks,
+        'params': params,
+    }
+    plan_file = work_dir / PLAN_NAME
+    if plan_file.exists():
+        with open(plan_file, 'r') as f:
+            previous = json.load(f)
+        if {k: v for k, v in previous.items() if k != 'names'} == plan:
+            return previous['names']
+        # Entrées ou paramètres différents : les chunks existants ne sont plus valables
+        logger.info(f"Plan de recherche modifié, {work_dir} est réinitialisé")
+        shutil.rmtree(work_dir)
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    shards = split_by_length(query_faa, work_dir, n_chunks, prefix="chunk", suffix=".faa")
+    plan['names'] = [path.stem for path, _ in shards]
+    tmp_file = plan_file.with_suffix(".tmp")
+    with open(tmp_file, 'w') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmp_file, plan_file)
+    return plan['names']
+
+
+def search_chunk(name, work_dir, target_db, evalue, max_seqs, threads, search_args,
+                 format_output, log):
+    """Recherche d'un chunk contre la base cible complète, terminée par son marqueur .done"""
+    chunk_db = work_dir / f"{name}_db"
+    result_db = work_dir / f"{name}_res"
+    tmp_dir = work_dir / f"{name}_tmp"
+    partial = work_dir / f"{name}.tsv.part"
+
+    # Reprise d'un chunk interrompu : les bases sont refaites, le tmp de MMseqs2 est gardé
+    remove_db(chunk_db)
+    remove_db(result_db)
+    run(["mmseqs", "createdb", str(work_dir / f"{name}.faa"), str(chunk_db)],
+        f"Création base MMseqs2 {name}", log)
+    run(["mmseqs", "search", str(chunk_db), str(target_db), str(result_db), str(tmp_dir),
+         "--threads", str(threads),
+         "-e", str(evalue),
+         "--max-seqs", str(max_seqs)] + list(search_args),
+        f"Recherche MMseqs2 {name}", log)
+    run(["mmseqs", "convertalis", str(chunk_db), str(target_db), str(result_db), str(partial),
+         "--format-output", format_output, "--threads", str(threads)],
+        f"Conversion tabulaire {name}", log)
+
+    # Le tabulaire est sur disque avant que le marqueur ne le déclare complet
+    with open(partial, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(partial, work_dir / f"{name}.tsv")
+    (work_dir / f"{name}.done").touch()
+
+    # Seul le travail d'un chunk terminé est supprimé
+    remove_db(chunk_db)
+    remove_db(result_db)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return name
+
+
+def run_chunked_search(query_faa, target_faa, work_dir, output_tsv, log=logger,
+                       evalue="1e-5", max_seqs=10000, n_chunks=1, jobs=1, threads=None,
+                       search_args=(), format_output=ALIGNMENT_FORMAT):
+    """Recherche query_faa contre target_faa par chunks, puis fusionne dans output_tsv
+
+    Renvoie le nombre de lignes du tabulaire fusionné. work_dir est conservé
+    tant que la fusion n'a pas abouti.
+    """
+    work_dir = Path(work_dir)
+    threads = threads or os.cpu_count()
+    jobs = max(1, min(jobs, n_chunks))
+    threads_per_job = max(1, threads // jobs)
+    params = {'evalue': str(evalue), 'max_seqs': max_seqs, 'search_args': list(search_args),
+              'format_output': format_output}
+
+    names = prepare_plan(query_faa, target_faa, work_dir, n_chunks, params)
+
+    target_db = work_dir / "target_db"
+    target_done = work_dir / "target_db.done"
+    if not target_done.exists():
+        remove_db(target_db)
+        run(["mmseqs", "createdb", str(target_faa), str(target_db)],
+            "Création base MMseqs2 cible", log)
+        target_done.touch()
+
+    pending = [name for name in names if not (work_dir / f"{name}.done").exists()]
+    log.info(f"Chunks de recherche: {len(names) - len(pending)}/{len(names)} déjà terminés, "
+             f"{len(pending)} à lancer ({jobs} en parallèle, {threads_per_job} threads chacun)")
+
+    # Les threads ne font qu'attendre les processus MMseqs2 ; un échec n'interrompt
+    # pas les autres chunks, qui restent acquis pour la relance
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(search_chunk, name, work_dir, target_db, evalue, max_seqs,
+                                   threads_per_job, search_args, format_output, log): name
+                   for name in pending}
+        for future, name in futures.items():
+            try:
+                future.result()
+                log.info(f"Chunk terminé: {name}")
+            except Exception as e:
+                log.error(f"Échec du chunk {name}: {e}")
+                failures.append(name)
+    if failures:
+        raise RuntimeError(f"{len(failures)} chunk(s) en échec, relancer pour les reprendre: "
+                           f"{', '.join(failures)}")
+
+    # Fusion dans l'ordre des chunks, donc des requêtes
+    count = 0
+    tmp_output = f"{output_tsv}.tmp"
+    with open(tmp_output, 'wb') as out:
+        for name in names:
+            with open(work_dir / f"{name}.tsv", 'rb') as f:
+                for line in f:
+                    out.write(line)
+                    count += 1
+    os.replace(tmp_output, output_tsv)
+    shutil.rmtree(work_dir)
+    log.info(f"Recherche fusionnée: {output_tsv} ({count} lignes)")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recherche MMseqs2 par chunks reprenables (options inconnues transmises à mmseqs search)")
+    parser.add_argument("query", help="FASTA protéique des requêtes")
+    parser.add_argument("--target", default=None, help="FASTA protéique cible (défaut: les requêtes)")
+    parser.add_argument("-o", "--output", required=True, help="Tabulaire fusionné")
+    parser.add_argument("--work-dir", default=None, help="Dossier des chunks (défaut: <output>.chunks)")
+    parser.add_argument("--chunks", type=int, default=16)
+    parser.add_argument("--jobs", type=int, default=1, help="Chunks lancés en parallèle")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(),
+                        help="Budget total de cœurs, partagé entre les chunks")
+    parser.add_argument("-e", "--evalue", default="1e-5")
+    parser.add_argument("--max-seqs", type=int, default=10000)
+    parser.add_argument("--format-output", default=ALIGNMENT_FORMAT)
+    args, search_args = parser.parse_known_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    try:
+        run_chunked_search(args.query, args.target or args.query,
+                           args.work_dir or f"{args.output}.chunks", args.output,
+                           evalue=args.evalue, max_seqs=args.max_seqs, n_chunks=args.chunks,
+                           jobs=args.jobs, threads=args.threads, search_args=search_args,
+                           format_output=args.format_output)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Arbre neighbor-joining (Saitou & Nei) calculé directement sur une matrice .dmat
+
+Alternative à l'export PHYLIP texte suivi de rapidnj : la matrice float32 est lue
+par mmap (distance_matrix.py) et l'arbre est écrit en Newick non raciné, avec
+la trifurcation finale de rapidnj. Comme dans rapidnj, la recherche du
+minimum de Q est élaguée : avec u_i = R_i / (r - 2),
+
+    Q_ij / (r - 2) = d_ij - u_i - u_j >= min_j d_ij - u_i - max u
+
+donc seules les lignes dont cette borne est inférieure au meilleur Q déjà
+trouvé sont évaluées, par paquets vectorisés, dans l'ordre croissant des
+bornes. Les minima de ligne sont tenus à jour après chaque fusion au lieu
+d'être recalculés, et la matrice de travail est compactée quand la moitié
+de ses lignes est inactive.
+
+Une matrice PHYLIP texte est acceptée aussi (convertie une fois en .dmat).
+
+rapidnj reste le moteur par défaut (--nj rapidnj, la matrice .dmat lui est
+exportée en PHYLIP) tant que l'égalité des topologies n'a pas été vérifiée
+sur les matrices de test : --compare construit l'arbre avec les deux moteurs
+et donne leur distance de Robinson-Foulds (0 = même topologie non racinée).
+
+Usage:
+    python neighbor_joining.py vOTUs.dmat vOTUs.nwk
+    python neighbor_joining.py --nj numpy vOTUs_braycurtis.mat vOTUs.nwk
+    python neighbor_joining.py --compare vOTUs.dmat vOTUs.nwk
+"""
+
+import os
+import sys
+import argparse
+import logging
+import subprocess
+import numpy as np
+
+import distance_matrix
+
+logger = logging.getLogger(__name__)
+
+# Lignes évaluées ensemble lors de la recherche du minimum de Q
+SEARCH_BATCH = 64
+# Taille en dessous de laquelle la matrice de travail n'est plus compactée
+MIN_COMPACT_SIZE = 256
+# Lignes traitées ensemble lors de la symétrisation
+SYMMETRIZE_BLOCK = 1024
+# Caractères imposant de citer un nom en Newick
+NEWICK_SPECIAL = set(" \t()[]':;,")
+# Moteurs de construction de l'arbre ; rapidnj par défaut
+NJ_BACKENDS = ("rapidnj", "numpy")
+DEFAULT_BACKEND = "rapidnj"
+
+
+def newick_name(name):
+    if any(c in NEWICK_SPECIAL for c in name):
+        return "'" + name.replace("'", "''") + "'"
+    return name
+
+
+def format_length(length):
+    return f"{length:.6g}"
+
+
+def search_minimum(D, active, R, row_min, r):
+    """Paire (i, j) d'indices de travail minimisant Q, avec élagage par ligne"""
+    u = np.full(len(D), -np.inf)
+    u[active] = R[active] / (r - 2)
+    u_max = u[active].max()
+
+    rows = active[np.argsort(row_min[active] - u[active] - u_max, kind='stable')]
+    bounds = row_min[rows] - u[rows] - u_max
+    best, best_pair = np.inf, None
+    for start in range(0, len(rows), SEARCH_BATCH):
+        if bounds[start] >= best:
+            break
+        batch = rows[start:start + SEARCH_BATCH]
+        # Colonnes inactives et diagonale à +inf : exclues sans masque
+        q = D[batch] - u[batch, None] - u[None, :]
+        flat = int(np.argmin(q))
+        k, j = divmod(flat, q.shape[1])
+        if q[k, j] < best:
+            best, best_pair = q[k, j], (int(batch[k]), j)
+    i, j = best_pair
+    return (i, j) if i < j else (j, i)
+
+
+def symmetrize(D, block_rows=SYMMETRIZE_BLOCK):
+    """Symétrise D en place (moyenne avec la transposée), bloc de lignes par bloc
+
+    Seul le triangle supérieur de chaque bloc est comparé à sa transposée ;
+    les blocs déjà symétriques ne sont pas réécrits.
+    """
+    for start in range(0, len(D), block_rows):
+        stop = min(start + block_rows, len(D))
+        upper = D[start:stop, start:]
+        lower = D[start:, start:stop].T
+        if not np.array_equal(upper, lower):
+            average = (upper + lower) / 2
+            D[start:stop, start:] = average
+            D[start:, start:stop] = average.T
+
+
+def neighbor_joining(names, matrix):
+    """Arbre NJ de la matrice carrée matrix (n x n) ; renvoie la chaîne Newick"""
+    n = len(names)
+    if n == 0:
+        raise ValueError("Matrice vide")
+    if n == 1:
+        return f"({newick_name(names[0])});"
+    if n == 2:
+        half = format_length(float(matrix[0, 1]) / 2)
+        return f"({newick_name(names[0])}:{half},{newick_name(names[1])}:{half});"
+
+    # Matrice de travail : une seule copie float32 de la memmap ; sommes de lignes en float64
+    D = np.array(matrix, dtype=np.float32)
+    symmetrize(D)
+    np.fill_diagonal(D, 0.0)
+    R = D.sum(axis=1, dtype=np.float64)
+    np.fill_diagonal(D, np.inf)
+    row_min = D.min(axis=1)
+
+    # node[k] : nœud de l'arbre porté par la ligne de travail k
+    node = np.arange(n)
+    children = {}
+    next_node = n
+    alive = np.ones(n, dtype=bool)
+    r = n
+
+    while r > 3:
+        active = np.flatnonzero(alive)
+        i, j = search_minimum(D, active, R, row_min, r)
+        d_ij = D[i, j]
+        length_i = d_ij / 2 + (R[i] - R[j]) / (2 * (r - 2))
+        length_j = d_ij - length_i
+        children[next_node] = [(node[i], length_i), (node[j], length_j)]
+
+        # Nouveau nœud à la place de i, j désactivé
+        d_new = (D[i] + D[j] - d_ij) / 2
+        d_new[~alive] = np.inf
+        alive[j] = False
+        d_new[j] = np.inf
+        d_new[i] = np.inf
+        finite = alive.copy()
+        finite[i] = False
+        R[finite] += d_new[finite] - D[i, finite] - D[j, finite]
+        R[i] = d_new[finite].sum()
+        stale = finite & ((row_min == D[:, i]) | (row_min == D[:, j]))
+        D[i, :] = d_new
+        D[:, i] = d_new
+        D[j, :] = np.inf
+        D[:, j] = np.inf
+        row_min[finite] = np.minimum(row_min[finite], d_new[finite])
+        if stale.any():
+            row_min[stale] = D[stale].min(axis=1)
+        row_min[i] = d_new.min()
+        row_min[j] = np.inf
+        node[i] = next_node
+        next_node += 1
+        r -= 1
+
+        # Compactage : les lignes inactives ne sont plus parcourues
+        if len(D) > MIN_COMPACT_SIZE and r < len(D) // 2:
+            keep = np.flatnonzero(alive)
+            D = D[np.ix_(keep, keep)]
+            R, row_min, node = R[keep], row_min[keep], node[keep]
+            alive = np.ones(len(keep), dtype=bool)
+
+        if (n - r) % 1000 == 0:
+            logger.info(f"Fusions: {n - r}/{n - 3}")
+
+    # Trifurcation finale, comme rapidnj
+    a, b, c = np.flatnonzero(alive)
+    root = [(node[a], (D[a, b] + D[a, c] - D[b, c]) / 2),
+            (node[b], (D[a, b] + D[b, c] - D[a, c]) / 2),
+            (node[c], (D[a, c] + D[b, c] - D[a, b]) / 2)]
+    return to_newick(root, children, names)
+
+
+def to_newick(root, children, names):
+    """Écriture itérative (pas de récursion sur les arbres en peigne)"""
+    parts = ["("]
+    # Pile de [enfants restants, premier enfant à écrire, longueur de la branche du nœud]
+    stack = [[iter(root), True, None]]
+    while stack:
+        frame = stack[-1]
+        child = next(frame[0], None)
+        if child is None:
+            stack.pop()
+            parts.append(")")
+            if stack:
+                parts.append(f":{format_length(frame[2])}")
+            continue
+        if not frame[1]:
+            parts.append(",")
+        frame[1] = False
+        child_node, length = child
+        if child_node in children:
+            parts.append("(")
+            stack.append([iter(children[child_node]), True, length])
+        else:
+            parts.append(f"{newick_name(names[child_node])}:{format_length(length)}")
+    parts.append(";")
+    return "".join(parts)
+
+
+def read_label(tree, i):
+    """Nom (éventuellement cité) et longueur de branche à partir de tree[i] -> (nom, position suivante)"""
+    if tree[i] == "'":
+        parts = []
+        i += 1
+        while True:
+            end = tree.index("'", i)
+            parts.append(tree[i:end])
+            if tree.startswith("''", end):
+                parts.append("'")
+                i = end + 2
+            else:
+                i = end + 1
+                break
+        name = "".join(parts)
+    else:
+        start = i
+        while i < len(tree) and tree[i] not in ":,();":
+            i += 1
+        name = tree[start:i].strip()
+    if i < len(tree) and tree[i] == ":":
+        while i < len(tree) and tree[i] not in ",();":
+            i += 1
+    return name, i
+
+
+def newick_clades(tree, index):
+    """Feuilles de chaque nœud interne d'un arbre Newick, en masques d'entiers
+
+    index (nom -> bit) est complété avec les feuilles rencontrées.
+    """
+    clades = []
+    stack = [0]
+    i = 0
+    while i < len(tree):
+        c = tree[i]
+        if c == "(":
+            stack.append(0)
+            i += 1
+        elif c == ")":
+            mask = stack.pop()
+            clades.append(mask)
+            stack[-1] |= mask
+            # Étiquette et longueur du nœud interne ignorées
+            _, i = read_label(tree, i + 1)
+        elif c in ",;" or c.isspace():
+            i += 1
+        else:
+            name, i = read_label(tree, i)
+            stack[-1] |= 1 << index.setdefault(name, len(index))
+    return clades
+
+
+def robinson_foulds(tree_a, tree_b):
+    """Distance de Robinson-Foulds entre deux arbres non racinés sur les mêmes feuilles"""
+    index = {}
+    clades_a = newick_clades(tree_a, index)
+    n = len(index)
+    clades_b = newick_clades(tree_b, index)
+    if len(index) != n:
+        raise ValueError("Les deux arbres n'ont pas les mêmes feuilles")
+    full = (1 << n) - 1
+
+    def splits(clades):
+        # Côté de la bipartition ne contenant pas la feuille 0 ; bipartitions triviales exclues
+        result = set()
+        for mask in clades:
+            if mask & 1:
+                mask ^= full
+            if 1 < mask.bit_count() < n - 1:
+                result.add(mask)
+        return result
+
+    return len(splits(clades_a) ^ splits(clades_b))
+
+
+def write_tree(tree, output):
+    tmp_output = f"{output}.tmp"
+    with open(tmp_output, 'w') as f:
+        f.write(tree + "\n")
+    os.replace(tmp_output, output)
+
+
+def build_tree_numpy(matrix_path, output):
+    """Construit l'arbre NJ d'une matrice (.dmat ou PHYLIP) et l'écrit en Newick"""
+    names, matrix = distance_matrix.open_matrix(distance_matrix.ensure_dmat(matrix_path))
+    logger.info(f"Neighbor-joining sur {len(names)} séquences: {matrix_path}")
+    write_tree(neighbor_joining(list(names), matrix), output)
+    logger.info(f"Arbre écrit: {output}")
+    return output
+
+
+def build_tree_rapidnj(matrix_path, output, rapidnj="rapidnj"):
+    """Arbre rapidnj -i pd ; une matrice .dmat est d'abord exportée en PHYLIP temporaire"""
+    phylip = matrix_path
+    if matrix_path.endswith(".dmat"):
+        phylip = f"{output}.phylip.tmp"
+        distance_matrix.export_phylip(matrix_path, phylip)
+    tmp_output = f"{output}.tmp"
+    try:
+        logger.info(f"rapidnj sur {matrix_path}")
+        with open(tmp_output, 'w') as out:
+            subprocess.run([rapidnj, "-i", "pd", phylip], stdout=out, check=True)
+        os.replace(tmp_output, output)
+    finally:
+        if phylip != matrix_path and os.path.exists(phylip):
+            os.remove(phylip)
+    logger.info(f"Arbre écrit: {output}")
+    return output
+
+
+def build_tree(matrix_path, output, backend=DEFAULT_BACKEND, rapidnj="rapidnj", compare=False):
+    """Construit l'arbre avec le moteur choisi ; compare=True construit aussi l'autre
+
+    L'arbre de l'autre moteur est écrit dans <sortie>.<moteur>.nwk et la
+    distance de Robinson-Foulds entre les deux est journalisée et renvoyée.
+    """
+    builders = {
+        "rapidnj": lambda path: build_tree_rapidnj(matrix_path, path, rapidnj),
+        "numpy": lambda path: build_tree_numpy(matrix_path, path),
+    }
+    builders[backend](output)
+    if not compare:
+        return None
+    other = next(name for name in NJ_BACKENDS if name != backend)
+    other_output = f"{os.path.splitext(output)[0]}.{other}.nwk"
+    builders[other](other_output)
+    with open(output) as f, open(other_output) as g:
+        distance = robinson_foulds(f.read().strip(), g.read().strip())
+    message = f"Distance de Robinson-Foulds {backend} / {other}: {distance} ({output}, {other_output})"
+    if distance:
+        logger.warning(message)
+    else:
+        logger.info(message)
+    return distance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arbre neighbor-joining depuis une matrice .dmat")
+    parser.add_argument("matrix", help="Matrice de distances .dmat (ou PHYLIP texte)")
+    parser.add_argument("output", help="Arbre Newick")
+    parser.add_argument("--nj", choices=NJ_BACKENDS, default=DEFAULT_BACKEND,
+                        help=f"Moteur de construction de l'arbre (défaut: {DEFAULT_BACKEND})")
+    parser.add_argument("--rapidnj", default="rapidnj", help="Exécutable rapidnj")
+    parser.add_argument("--compare", action="store_true",
+                        help="Construire aussi l'arbre avec l'autre moteur et donner la distance RF")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    if not os.path.exists(args.matrix):
+        logger.error(f"Fichier introuvable: {args.matrix}")
+        sys.exit(1)
+    build_tree(args.matrix, args.output, args.nj, args.rapidnj, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,19 @@ Usage: python votu_pipeline.py <input_tsv> [reference_fasta]
 import sys
 import os
 import subprocess
+import re
+import json
+import shutil
+import hashlib
 import argparse
 from pathlib import Path
 import logging
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from fasta_index import FastaIndex, concat_files, count_records, split_by_length
+from mmseqs_chunked import (ALIGNMENT_FORMAT, PLAN_NAME, file_signature, remove_db,
+                            run_chunked_search)
 
 def setup_logging(output_dir):
     """Configuration du logging"""
@@ -42,13 +51,92 @@ def run_command(cmd, description, logger):
         logger.error(f"Stderr: {e.stderr}")
         raise
 
-def count_sequences(fasta_file):
-    """Compte le nombre de séquences dans un fichier FASTA"""
-    if not os.path.exists(fasta_file):
-        return 0
-    
-    with open(fasta_file, 'r') as f:
-        return sum(1 for line in f if line.startswith('>'))
+# --- Cache des étapes ---
+# Chaque étape est identifiée par le hash du contenu de ses entrées et de ses
+# paramètres ; ses sorties sont conservées dans <output>/stage_cache/<étape>/<clé>/.
+# Une étape dont la clé n'a pas changé est restaurée sans être relancée, et une
+# entrée modifiée change la clé de l'étape et donc celle de toutes les suivantes.
+HASH_MEMO = "file_hashes.json"
+
+def file_digest(path, memo):
+    """SHA-256 du contenu d'un fichier, mémorisé par (taille, mtime) pour éviter de le relire"""
+    stat = os.stat(path)
+    memo_key = str(Path(path).resolve())
+    cached = memo.get(memo_key)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    memo[memo_key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                      'sha256': digest.hexdigest()}
+    return memo[memo_key]['sha256']
+
+class StageCache:
+    def __init__(self, cache_dir, logger, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.logger = logger
+        self.enabled = enabled
+        self.cache_dir.mkdir(exist_ok=True)
+        memo_file = self.cache_dir / HASH_MEMO
+        self.memo = json.loads(memo_file.read_text()) if memo_file.exists() else {}
+
+    def save_memo(self):
+        tmp = self.cache_dir / (HASH_MEMO + ".tmp")
+        tmp.write_text(json.dumps(self.memo))
+        os.replace(tmp, self.cache_dir / HASH_MEMO)
+
+    def key(self, stage, inputs, params):
+        description = {
+            'stage': stage,
+            'inputs': [file_digest(path, self.memo) for path in inputs],
+            'params': params,
+        }
+        self.save_memo()
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+    def run(self, stage, inputs, params, outputs, func):
+        """Renvoie le résultat de func(), restauré depuis le cache si l'étape est inchangée
+
+        outputs liste les fichiers produits par func ; le résultat doit être sérialisable en JSON.
+        """
+        if not self.enabled:
+            return func()
+
+        key = self.key(stage, inputs, params)
+        stage_dir = self.cache_dir / stage / key
+        meta_file = stage_dir / "stage.json"
+
+        if meta_file.exists():
+            self.logger.info(f"=== Étape {stage} inchangée (clé {key}), sorties restaurées depuis le cache ===")
+            for output in outputs:
+                place_file(stage_dir / Path(output).name, output)
+            return json.loads(meta_file.read_text())['result']
+
+        # Les sorties précédentes peuvent être des liens vers le cache : on les
+        # supprime pour que l'étape écrive de nouveaux fichiers
+        for output in outputs:
+            if os.path.lexists(output):
+                os.remove(output)
+        result = func()
+
+        stage_dir.mkdir(parents=True, exist_ok=True)
+        for output in outputs:
+            place_file(output, stage_dir / Path(output).name)
+        meta_file.write_text(json.dumps({'stage': stage, 'params': params, 'result': result}))
+        self.logger.info(f"Étape {stage} mise en cache (clé {key})")
+        return result
+
+def place_file(src, dst):
+    """Copie src vers dst par lien physique si possible (sans doubler l'espace disque)"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
 def extract_viral_sequences(input_tsv, output_fasta, logger):
     """Extrait les séquences virales du fichier TSV"""
@@ -83,17 +171,14 @@ def combine_sequences(viral_fasta, reference_fasta, output_fasta, logger):
     """Combine les séquences virales avec les séquences de référence"""
     logger.info("=== Combinaison avec les séquences de référence ===")
     
-    # Copier les séquences virales
-    with open(viral_fasta, 'r') as infile, open(output_fasta, 'w') as outfile:
-        outfile.write(infile.read())
+    # Concaténation sans passer par la mémoire (référence éventuellement gzippée)
+    starts = concat_files([viral_fasta, reference_fasta], output_fasta)
     
-    # Ajouter les séquences de référence
-    with open(reference_fasta, 'r') as infile, open(output_fasta, 'a') as outfile:
-        outfile.write(infile.read())
-    
-    viral_count = count_sequences(viral_fasta)
-    ref_count = count_sequences(reference_fasta)
-    total_count = count_sequences(output_fasta)
+    # Un seul parcours du fichier combiné : l'index sert aussi au découpage Prodigal
+    index = FastaIndex(output_fasta)
+    total_count = len(index)
+    viral_count = sum(1 for entry in index.entries if entry[2] < starts[1])
+    ref_count = total_count - viral_count
     
     logger.info(f"Séquences virales: {viral_count}")
     logger.info(f"Séquences de référence: {ref_count}")
@@ -101,77 +186,269 @@ def combine_sequences(viral_fasta, reference_fasta, output_fasta, logger):
     
     return total_count
 
-def run_prodigal(input_fasta, output_dir, logger):
-    """Exécute Prodigal pour la prédiction de gènes"""
-    logger.info("=== Gene calling avec Prodigal (mode meta) ===")
+def renumber_prodigal_line(line, seq_offset):
+    """Décale les numéros de séquence Prodigal (seqnum=K, ID=K_N) d'un shard"""
+    line = re.sub(r'seqnum=(\d+)', lambda m: f"seqnum={int(m.group(1)) + seq_offset}", line)
+    return re.sub(r'ID=(\d+)_', lambda m: f"ID={int(m.group(1)) + seq_offset}_", line)
+
+def merge_prodigal_outputs(shard_outputs, shard_counts, output_file, kind):
+    """Concatène les sorties des shards dans l'ordre, comme une exécution unique de Prodigal"""
+    gff_header_once = False
+    if kind == "gff" and shard_outputs:
+        # Selon la version, Prodigal écrit l'en-tête ##gff-version une fois ou par séquence
+        with open(shard_outputs[0], 'r') as f:
+            n_headers = sum(1 for line in f if line.startswith('##gff-version'))
+        gff_header_once = n_headers == 1 and shard_counts[0] > 1
+
+    seq_offset = 0
+    with open(output_file, 'w') as out:
+        for i, (path, count) in enumerate(zip(shard_outputs, shard_counts)):
+            with open(path, 'r') as f:
+                for line in f:
+                    if kind == "gff":
+                        if gff_header_once and i > 0 and line.startswith('##gff-version'):
+                            continue
+                        if line.startswith('#') or '\tID=' in line or ';ID=' in line:
+                            line = renumber_prodigal_line(line, seq_offset)
+                    elif line.startswith('>'):
+                        line = renumber_prodigal_line(line, seq_offset)
+                    out.write(line)
+            seq_offset += count
+
+def run_prodigal(input_fasta, output_dir, logger, jobs=1, mode="meta"):
+    """Exécute Prodigal pour la prédiction de gènes
+
+    En mode meta chaque contig est traité indépendamment : avec jobs > 1, le FASTA
+    est découpé en shards équilibrés en pb, traités en parallèle, puis les sorties
+    sont fusionnées dans l'ordre avec la numérotation d'une exécution unique.
+    En mode single, Prodigal s'entraîne sur tout le fichier : pas de découpage.
+    """
+    logger.info(f"=== Gene calling avec Prodigal (mode {mode}) ===")
     
     output_prefix = output_dir / "vOTUs"
     gff_file = f"{output_prefix}.gff"
     faa_file = f"{output_prefix}.faa"
     fna_file = f"{output_prefix}.fna"
+
+    def prodigal_cmd(fasta, gff, faa, fna):
+        return [
+            "prodigal",
+            "-i", str(fasta),
+            "-o", str(gff),
+            "-a", str(faa),
+            "-d", str(fna),
+            "-p", mode,
+            "-f", "gff"
+        ]
+
+    if jobs <= 1 or mode != "meta":
+        run_command(prodigal_cmd(input_fasta, gff_file, faa_file, fna_file),
+                    "Prédiction de gènes avec Prodigal", logger)
+    else:
+        shard_dir = output_dir / "prodigal_shards"
+        shards = split_by_length(input_fasta, shard_dir, jobs)
+        logger.info(f"Prodigal sur {len(shards)} shards ({jobs} en parallèle)")
+
+        def run_shard(shard):
+            path = shard[0]
+            stem = path.with_suffix("")
+            outputs = (f"{stem}.gff", f"{stem}.faa", f"{stem}.genes.fna")
+            run_command(prodigal_cmd(path, *outputs), f"Prodigal sur {path.name}", logger)
+            return outputs
+
+        # Les threads ne font qu'attendre les processus Prodigal
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            shard_outputs = list(executor.map(run_shard, shards))
+
+        counts = [count for _, count in shards]
+        for k, (output_file, kind) in enumerate([(gff_file, "gff"), (faa_file, "faa"), (fna_file, "fna")]):
+            merge_prodigal_outputs([outputs[k] for outputs in shard_outputs], counts, output_file, kind)
+        shutil.rmtree(shard_dir)
     
-    cmd = [
-        "prodigal",
-        "-i", str(input_fasta),
-        "-o", gff_file,
-        "-a", faa_file,
-        "-d", fna_file,
-        "-p", "meta",
-        "-f", "gff"
-    ]
-    
-    run_command(cmd, "Prédiction de gènes avec Prodigal", logger)
-    
-    gene_count = count_sequences(faa_file)
+    gene_count = count_records(faa_file)
     logger.info(f"Gènes prédits: {gene_count}")
     
     return faa_file, gene_count
 
-def run_mmseqs_alignment(faa_file, output_dir, logger):
-    """Exécute l'alignement all-vs-all avec MMseqs2"""
-    logger.info("=== Alignement all-vs-all avec MMseqs2 ===")
-    
-    db_path = output_dir / "mmseqs_db"
-    result_path = output_dir / "mmseqs_result"
-    tmp_dir = output_dir / "tmp"
-    alignment_output = output_dir / "vOTUs_alignment.tsv"
-    
-    # Créer la base de données
-    logger.info("Création de la base de données MMseqs2...")
-    run_command([
-        "mmseqs", "createdb", str(faa_file), str(db_path)
-    ], "Création base de données MMseqs2", logger)
-    
-    # Recherche all-vs-all
-    logger.info("Recherche all-vs-all...")
+def mmseqs_search(query_db, target_db, result_path, tmp_dir, evalue, max_seqs, logger, description,
+                  threads=None):
     run_command([
-        "mmseqs", "search", str(db_path), str(db_path), str(result_path), str(tmp_dir),
-        "--threads", str(os.cpu_count()),
-        "-e", "1e-5",
-        "--max-seqs", "10000"
-    ], "Recherche all-vs-all MMseqs2", logger)
-    
-    # Conversion en format tabulaire
-    logger.info("Conversion en format tabulaire...")
+        "mmseqs", "search", str(query_db), str(target_db), str(result_path), str(tmp_dir),
+        "--threads", str(threads or os.cpu_count()),
+        "-e", str(evalue),
+        "--max-seqs", str(max_seqs)
+    ], description, logger)
+
+def mmseqs_convert(query_db, target_db, result_path, output, logger):
     run_command([
-        "mmseqs", "convertalis", str(db_path), str(db_path), str(result_path), str(alignment_output),
-        "--format-output", "query,target,pident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,evalue,bits"
+        "mmseqs", "convertalis", str(query_db), str(target_db), str(result_path), str(output),
+        "--format-output", ALIGNMENT_FORMAT
     ], "Conversion format tabulaire", logger)
-    
-    # Nettoyage
-    if tmp_dir.exists():
-        run_command(f"rm -rf {tmp_dir}", "Nettoyage fichiers temporaires", logger)
-    
-    # Compter les alignements
+
+def count_alignments(alignment_output, logger):
     if alignment_output.exists():
         with open(alignment_output, 'r') as f:
             alignment_count = sum(1 for _ in f)
         logger.info(f"Alignements trouvés: {alignment_count}")
     else:
         raise FileNotFoundError("Fichier d'alignement non généré")
+    return alignment_count
+
+def run_mmseqs_alignment(faa_file, output_dir, logger, evalue="1e-5", max_seqs=10000,
+                         chunks=1, jobs=1, threads=None):
+    """Exécute l'alignement all-vs-all avec MMseqs2
+
+    Les requêtes sont cherchées par chunks reprenables (voir mmseqs_chunked.py) :
+    après une interruption, seuls les chunks manquants sont relancés.
+    """
+    logger.info("=== Alignement all-vs-all avec MMseqs2 ===")
+    
+    alignment_output = output_dir / "vOTUs_alignment.tsv"
+    
+    # Recherche all-vs-all, puis conversion et fusion des chunks en format tabulaire
+    logger.info(f"Recherche all-vs-all en {chunks} chunk(s)...")
+    run_chunked_search(faa_file, faa_file, output_dir / "mmseqs_chunks", alignment_output, logger,
+                       evalue=evalue, max_seqs=max_seqs, n_chunks=chunks, jobs=jobs,
+                       threads=threads)
+    
+    # Compter les alignements
+    alignment_count = count_alignments(alignment_output, logger)
     
     return str(alignment_output), alignment_count
 
+def sequence_digests(index):
+    """{id: hash de la séquence} d'un FASTA protéique indexé"""
+    return {seq_id: hashlib.sha1(index.sequence(seq_id).encode()).hexdigest()
+            for seq_id in index.records}
+
+def run_mmseqs_incremental(faa_file, previous_faa, previous_alignment, output_dir, logger,
+                           evalue="1e-5", max_seqs=10000, chunks=1, jobs=1, threads=None):
+    """Met à jour un all-vs-all existant en n'alignant que les protéines nouvelles ou modifiées
+
+    Trois blocs composent le résultat : les alignements précédents entre protéines
+    inchangées, nouvelles contre toutes, et inchangées contre nouvelles. Ce dernier
+    bloc est cherché contre la seule base des nouvelles protéines : ses e-values,
+    proportionnelles à la taille de la base cible, sont remises à l'échelle de la
+    base complète avant filtrage, comme dans une recherche all-vs-all. Seul
+    --max-seqs peut différer : il s'applique ici par bloc et non sur toute la base.
+
+    Les deux recherches sont marquées par un fichier .done : après un échec,
+    une relance sur les mêmes entrées ne refait que celle qui manque. Les blocs
+    sont disjoints par construction (requête nouvelle, ou requête inchangée et
+    cible nouvelle, ou les deux inchangées) : ils sont concaténés sans
+    déduplication.
+    """
+    logger.info("=== Alignement all-vs-all incrémental avec MMseqs2 ===")
+
+    alignment_output = output_dir / "vOTUs_alignment.tsv"
+    work_dir = output_dir / "mmseqs_incremental"
+    tmp_dir = work_dir / "tmp"
+
+    # Les recherches déjà terminées ne sont reprises que pour les mêmes entrées
+    plan = {
+        'proteins': file_signature(faa_file),
+        'previous': file_signature(previous_faa),
+        'params': {'evalue': str(evalue), 'max_seqs': max_seqs},
+    }
+    plan_file = work_dir / PLAN_NAME
+    if plan_file.exists():
+        with open(plan_file, 'r') as f:
+            if json.load(f) != plan:
+                logger.info(f"Entrées modifiées, {work_dir} est réinitialisé")
+                shutil.rmtree(work_dir)
+    work_dir.mkdir(exist_ok=True)
+    with open(plan_file, 'w') as f:
+        json.dump(plan, f, indent=1)
+
+    current_index = FastaIndex(faa_file)
+    previous_index = FastaIndex(previous_faa)
+    previous = sequence_digests(previous_index)
+    current = sequence_digests(current_index)
+    all_residues = current_index.total_length()
+    previous_index.close()
+    current_index.close()
+    added = {pid for pid, digest in current.items() if previous.get(pid) != digest}
+    kept = set(current) - added
+    dropped = set(previous) - kept
+    logger.info(f"Protéines inchangées: {len(kept)}, nouvelles ou modifiées: {len(added)}, "
+                f"retirées ou modifiées: {len(dropped)}")
+
+    new_vs_all = work_dir / "new_vs_all.tsv"
+    old_vs_new = work_dir / "old_vs_new.tsv"
+    new_vs_all_done = work_dir / "new_vs_all.done"
+    old_vs_new_done = work_dir / "old_vs_new.done"
+    new_residues = 0
+    if added:
+        new_db = work_dir / "new_db"
+        kept_db = work_dir / "kept_db"
+        new_faa = work_dir / "new.faa"
+        kept_faa = work_dir / "kept.faa"
+        current_index.write_records(added, new_faa)
+        current_index.write_records(kept, kept_faa)
+        new_residues = sum(current_index.length(pid) for pid in added)
+
+        # La recherche des nouvelles protéines contre toutes, la plus longue, est reprenable
+        if new_vs_all_done.exists():
+            logger.info(f"Recherche nouvelles contre toutes déjà terminée: {new_vs_all}")
+        else:
+            run_chunked_search(new_faa, faa_file, work_dir / "new_vs_all_chunks", new_vs_all,
+                               logger, evalue=evalue, max_seqs=max_seqs, n_chunks=chunks,
+                               jobs=jobs, threads=threads)
+            new_vs_all_done.touch()
+
+        if kept and old_vs_new_done.exists():
+            logger.info(f"Recherche inchangées contre nouvelles déjà terminée: {old_vs_new}")
+        elif kept:
+            # Reprise : les bases sont refaites, le tmp de MMseqs2 est gardé
+            result_db = work_dir / "old_vs_new_res"
+            for db in (new_db, kept_db, result_db):
+                remove_db(db)
+            for fasta, db in ((new_faa, new_db), (kept_faa, kept_db)):
+                run_command(["mmseqs", "createdb", str(fasta), str(db)],
+                            f"Création base de données MMseqs2 {db.name}", logger)
+            mmseqs_search(kept_db, new_db, result_db, tmp_dir, evalue, max_seqs, logger,
+                          "Recherche protéines inchangées contre nouvelles", threads)
+            partial = work_dir / "old_vs_new.tsv.part"
+            mmseqs_convert(kept_db, new_db, result_db, partial, logger)
+            os.replace(partial, old_vs_new)
+            old_vs_new_done.touch()
+
+    # Fusion en flux des trois blocs, disjoints par construction (vérifié ligne à ligne)
+    evalue_scale = all_residues / max(new_residues, 1) if added else 1.0
+    merged = 0
+    tmp_output = work_dir / "merged.tsv"
+    with open(tmp_output, 'w') as out:
+        sources = [(previous_alignment, 'previous'), (new_vs_all, 'new'), (old_vs_new, 'rescale')]
+        for path, kind in sources:
+            if not Path(path).exists():
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) < 12:
+                        continue
+                    query, target = fields[0], fields[1]
+                    if kind == 'previous' and (query in dropped or target in dropped):
+                        continue
+                    if kind == 'new' and query not in added:
+                        raise ValueError(f"{path}: requête inchangée {query} dans le bloc des nouvelles")
+                    if kind == 'rescale' and (query not in kept or target not in added):
+                        raise ValueError(f"{path}: paire {query} -> {target} hors du bloc "
+                                         "inchangées contre nouvelles")
+                    if kind == 'rescale':
+                        scaled = float(fields[10]) * evalue_scale
+                        if scaled > float(evalue):
+                            continue
+                        fields[10] = f"{scaled:.3E}"
+                        line = "\t".join(fields) + "\n"
+                    out.write(line)
+                    merged += 1
+    os.replace(tmp_output, alignment_output)
+    shutil.rmtree(work_dir)
+
+    logger.info(f"Alignements trouvés: {merged}")
+    return str(alignment_output), merged
+
 def main():
     parser = argparse.ArgumentParser(description="Pipeline de traitement des vOTUs")
     parser.add_argument("input_tsv", help="Fichier TSV contenant les OTUs")
@@ -181,6 +458,30 @@ def main():
     parser.add_argument("--output", "-o", 
                        default="votu_analysis",
                        help="Répertoire de sortie")
+    parser.add_argument("--prodigal-jobs", type=int,
+                       default=os.cpu_count(),
+                       help="Nombre de shards Prodigal exécutés en parallèle (1 = exécution unique)")
+    parser.add_argument("--prodigal-mode", choices=["meta", "single"],
+                       default="meta",
+                       help="Mode de Prodigal (défaut: meta)")
+    parser.add_argument("--evalue", "-e",
+                       default="1e-5",
+                       help="Seuil d'e-value de la recherche MMseqs2 (défaut: 1e-5)")
+    parser.add_argument("--max-seqs", type=int,
+                       default=10000,
+                       help="Nombre max de cibles par requête MMseqs2 (défaut: 10000)")
+    parser.add_argument("--search-chunks", type=int, default=1,
+                       help="Nombre de chunks de requêtes pour MMseqs2, chacun reprenable (défaut: 1)")
+    parser.add_argument("--search-jobs", type=int, default=1,
+                       help="Chunks MMseqs2 lancés en parallèle (défaut: 1)")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(),
+                       help="Budget de cœurs pour MMseqs2, partagé entre les chunks (défaut: tous)")
+    parser.add_argument("--previous-run",
+                       default=None,
+                       help="Répertoire d'une exécution précédente (vOTUs.faa + vOTUs_alignment.tsv) : "
+                            "seules les nouvelles protéines sont alignées")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Relancer toutes les étapes sans utiliser le cache")
     
     args = parser.parse_args()
     
@@ -192,12 +493,25 @@ def main():
     if not os.path.exists(args.reference):
         print(f"ERREUR: Fichier de référence introuvable: {args.reference}")
         sys.exit(1)
+
+    if args.previous_run:
+        previous_faa = Path(args.previous_run) / "vOTUs.faa"
+        previous_alignment = Path(args.previous_run) / "vOTUs_alignment.tsv"
+        for path in (previous_faa, previous_alignment):
+            if not path.exists():
+                print(f"ERREUR: Fichier de l'exécution précédente introuvable: {path}")
+                sys.exit(1)
+        # Les fichiers précédents seraient écrasés par les étapes de cette exécution
+        if Path(args.previous_run).resolve() == Path(args.output).resolve():
+            print("ERREUR: --previous-run doit être différent du répertoire de sortie")
+            sys.exit(1)
     
     # Configuration
     output_dir = Path(args.output)
     output_dir.mkdir(exist_ok=True)
     
     logger = setup_logging(output_dir)
+    cache = StageCache(output_dir / "stage_cache", logger, enabled=not args.no_cache)
     
     try:
         logger.info("=== Début du pipeline vOTU ===")
@@ -207,7 +521,9 @@ def main():
         
         # Étape 1: Extraction des vOTUs
         viral_fasta = output_dir / "viral_sequences.fna"
-        viral_count = extract_viral_sequences(args.input_tsv, viral_fasta, logger)
+        viral_count = cache.run(
+            "extraction", [args.input_tsv], {}, [viral_fasta],
+            lambda: extract_viral_sequences(args.input_tsv, viral_fasta, logger))
         
         if viral_count == 0:
             logger.error("Aucune séquence virale trouvée")
@@ -215,13 +531,33 @@ def main():
         
         # Étape 2: Combinaison avec références
         combined_fasta = output_dir / "combined_sequences.fna"
-        total_seqs = combine_sequences(viral_fasta, args.reference, combined_fasta, logger)
+        total_seqs = cache.run(
+            "combination", [viral_fasta, args.reference], {}, [combined_fasta],
+            lambda: combine_sequences(viral_fasta, args.reference, combined_fasta, logger))
         
         # Étape 3: Gene calling
-        faa_file, gene_count = run_prodigal(combined_fasta, output_dir, logger)
+        prodigal_outputs = [output_dir / f"vOTUs.{ext}" for ext in ("gff", "faa", "fna")]
+        faa_file, gene_count = cache.run(
+            "prodigal", [combined_fasta], {'mode': args.prodigal_mode}, prodigal_outputs,
+            lambda: run_prodigal(combined_fasta, output_dir, logger,
+                                 args.prodigal_jobs, args.prodigal_mode))
         
         # Étape 4: Alignement
-        alignment_file, alignment_count = run_mmseqs_alignment(faa_file, output_dir, logger)
+        mmseqs_params = {'evalue': args.evalue, 'max_seqs': args.max_seqs}
+        if args.previous_run:
+            alignment_file, alignment_count = cache.run(
+                "mmseqs_incremental", [faa_file, previous_faa, previous_alignment], mmseqs_params,
+                [output_dir / "vOTUs_alignment.tsv"],
+                lambda: run_mmseqs_incremental(faa_file, previous_faa, previous_alignment,
+                                               output_dir, logger, args.evalue, args.max_seqs,
+                                               args.search_chunks, args.search_jobs, args.threads))
+        else:
+            alignment_file, alignment_count = cache.run(
+                "mmseqs", [faa_file], mmseqs_params,
+                [output_dir / "vOTUs_alignment.tsv"],
+                lambda: run_mmseqs_alignment(faa_file, output_dir, logger,
+                                             args.evalue, args.max_seqs,
+                                             args.search_chunks, args.search_jobs, args.threads))
         
         # Résumé
         logger.info("=== Pipeline terminé avec succès ===")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Conteneur indexé des sorties par séquence de script_genomad_checkv.py
+
+Les fichiers des dossiers <seq_id>_genomad/ et <seq_id>_checkv/ d'une séquence
+terminée sont compressés (zlib) et ajoutés à la suite dans des shards
+packs/shard_<n>.pack de pack_shard_size séquences. Un index central
+packs/index.tsv (sequence_id, chemin, shard, offset, taille) permet de relire
+chaque fichier directement, sans extraction ; les dossiers d'origine sont
+ensuite supprimés pour limiter le nombre d'inodes.
+"""
+
+import os
+import zlib
+import shutil
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.tsv"
+PACKED_TOOLS = ("genomad", "checkv")
+
+
+def shard_path(pack_dir, shard):
+    return os.path.join(pack_dir, f"shard_{shard:05d}.pack")
+
+
+def read_pack_index(pack_dir):
+    """Renvoie {sequence_id: [(chemin relatif, shard, offset, taille), ...]}"""
+    index = defaultdict(list)
+    index_file = os.path.join(pack_dir, INDEX_NAME)
+    if not os.path.exists(index_file):
+        return index
+    with open(index_file, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            # Une dernière ligne tronquée par un arrêt brutal est ignorée
+            if len(fields) != 5:
+                continue
+            seq_id, rel_path, shard, offset, size = fields
+            index[seq_id].append((rel_path, int(shard), int(offset), int(size)))
+    return index
+
+
+class PackReader:
+    """Lecture des fichiers empaquetés, une poignée ouverte par shard"""
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        self.index = read_pack_index(pack_dir)
+        self.handles = {}
+
+    def read_member(self, member):
+        rel_path, shard, offset, size = member
+        if shard not in self.handles:
+            self.handles[shard] = open(shard_path(self.pack_dir, shard), 'rb')
+        handle = self.handles[shard]
+        handle.seek(offset)
+        return zlib.decompress(handle.read(size))
+
+    def read_file(self, seq_id, name):
+        """Contenu du premier fichier de la séquence dont le nom se termine par name"""
+        for member in self.index.get(str(seq_id), []):
+            if member[0].endswith(name):
+                return self.read_member(member)
+        return None
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+
+class PackWriter:
+    """Ajoute les sorties des séquences terminées au shard courant"""
+
+    def __init__(self, pack_dir, shard_size=1000):
+        self.pack_dir = pack_dir
+        self.shard_size = shard_size
+        os.makedirs(pack_dir, exist_ok=True)
+        # Un nouveau shard à chaque lancement : on n'écrit jamais derrière une fin tronquée
+        existing = [int(name[len("shard_"):-len(".pack")]) for name in os.listdir(pack_dir)
+                    if name.startswith("shard_") and name.endswith(".pack")]
+        self.shard = max(existing, default=0)
+        self.in_shard = 0
+        self.shard_handle = None
+        self.index_handle = open(os.path.join(pack_dir, INDEX_NAME), 'a')
+
+    def _next_shard(self):
+        if self.shard_handle is not None:
+            self.shard_handle.close()
+        self.shard += 1
+        self.in_shard = 0
+        self.shard_handle = open(shard_path(self.pack_dir, self.shard), 'ab')
+
+    def add_sequence(self, seq_id, output_dir):
+        """Empaquette <seq_id>_genomad/ et <seq_id>_checkv/ puis supprime ces dossiers"""
+        tool_dirs = [os.path.join(output_dir, f"{seq_id}_{tool}") for tool in PACKED_TOOLS]
+        tool_dirs = [d for d in tool_dirs if os.path.isdir(d)]
+        if not tool_dirs:
+            return 0
+
+        if self.shard_handle is None or self.in_shard >= self.shard_size:
+            self._next_shard()
+
+        entries = []
+        for tool_dir in tool_dirs:
+            for root, dirs, files in os.walk(tool_dir):
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    with open(path, 'rb') as f:
+                        blob = zlib.compress(f.read())
+                    offset = self.shard_handle.tell()
+                    self.shard_handle.write(blob)
+                    entries.append((os.path.relpath(path, output_dir), offset, len(blob)))
+
+        # Les données sont sur disque avant que l'index n'y fasse référence
+        self.shard_handle.flush()
+        os.fsync(self.shard_handle.fileno())
+        for rel_path, offset, size in entries:
+            self.index_handle.write(f"{seq_id}\t{rel_path}\t{self.shard}\t{offset}\t{size}\n")
+        self.index_handle.flush()
+        os.fsync(self.index_handle.fileno())
+
+        for tool_dir in tool_dirs:
+            shutil.rmtree(tool_dir, ignore_errors=True)
+        self.in_shard += 1
+        return len(entries)
+
+    def close(self):
+        if self.shard_handle is not None:
+            self.shard_handle.close()
+        self.index_handle.close()
@@ -4,6 +4,7 @@
 # Utilisation: ./viral_analysis.sh input.tsv blat_output/OTUs.fna
 # Utilisation singularity : singularity exec --bind $(pwd):/mnt virome_shah.sif /mnt/pipeline3.sh benchmark.tsv /mnt/blat_output/OTUs.fna
 # Le script vérifie à chaque étape si le traitement a déjà été effectué
+# Moteur neighbor-joining : NJ_BACKEND=rapidnj (défaut) ou NJ_BACKEND=numpy
 
 # Vérification des arguments
 if [ $# -ne 2 ]; then
@@ -12,11 +13,12 @@ if [ $# -ne 2 ]; then
 fi
 
 
-# Répertoire de travail courant (où se trouvent les scripts hashsums et tree_bray)
-CURRENT_DIR=$(pwd)
+# Répertoire des scripts Python (generate_bray_matrix.py, alignment_store.py, neighbor_joining.py)
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 INPUT_FILE="$1"
 EXTRA_FASTA="$2"
 WORKDIR="viral_analysis_results"
+NJ_BACKEND="${NJ_BACKEND:-rapidnj}"
 VIRAL_SEQS="$WORKDIR/viral_sequences.fasta"
 PRODIGAL_OUT="$WORKDIR/prodigal_proteins.faa"
 FASTA36_OUT="$WORKDIR/fasta36_alignments"
@@ -28,21 +30,18 @@ ALIGNMENT_FILE="$FASTA36_OUT/fasta36_all_vs_all.tab"
 
 # Vérifier si les scripts requis sont disponibles
 check_scripts() {
-    # Vérifier les scripts locaux
-    if [ ! -x "$CURRENT_DIR/hashsums" ]; then
-        echo "ERREUR: Le script 'hashsums' n'est pas trouvé ou n'est pas exécutable dans $CURRENT_DIR"
-        echo "Assurez-vous que le script existe et est exécutable (chmod +x hashsums)"
+    # Vérifier le script de matrice de distances
+    if [ ! -f "$SCRIPT_DIR/generate_bray_matrix.py" ]; then
+        echo "ERREUR: Le script 'generate_bray_matrix.py' n'est pas trouvé dans $SCRIPT_DIR"
         exit 1
     fi
     
-    if [ ! -x "$CURRENT_DIR/tree_bray" ]; then
-        echo "ERREUR: Le script 'tree_bray' n'est pas trouvé ou n'est pas exécutable dans $CURRENT_DIR"
-        echo "Assurez-vous que le script existe et est exécutable (chmod +x tree_bray)"
-        exit 1
+    # Vérifier les outils système (rapidnj seulement s'il construit l'arbre)
+    local tools="prodigal fasta36"
+    if [ "$NJ_BACKEND" = "rapidnj" ]; then
+        tools="$tools rapidnj"
     fi
-    
-    # Vérifier les outils système
-    for cmd in prodigal fasta36 rapidnj; do
+    for cmd in $tools; do
         if ! command -v $cmd >/dev/null 2>&1; then
             echo "ERREUR: La commande '$cmd' n'est pas trouvée dans le PATH"
             echo "Veuillez installer ce programme ou vous assurer qu'il est disponible dans le conteneur Singularity"
@@ -322,8 +321,9 @@ fi
 
 # Étape 4: Traitement des alignements et création de la matrice de distance
 # Fichiers de sortie spécifiques à FASTA36
-MATRIX_FILE="$WORKDIR/vOTUs.fasta36.mat"
-if ! is_completed "fasta36_matrix_completed"; then
+MATRIX_FILE="$WORKDIR/vOTUs.fasta36.dmat"
+# (refaite si seule l'ancienne matrice PHYLIP .mat existe)
+if ! is_completed "fasta36_matrix_completed" || [ ! -f "$MATRIX_FILE" ]; then
     echo "=== Traitement des alignements pour créer la matrice de distance ==="
     
     # Création d'un lien symbolique pour simplifier le nom du fichier d'alignement
@@ -333,12 +333,11 @@ if ! is_completed "fasta36_matrix_completed"; then
     fi
 
     
-    # Filtrage des alignements et création de la matrice
+    # Filtrage des alignements (e-value <= 0.05), sommes des bitscores par paire de contigs
+    # et distances de Bray-Curtis (remplace awk | sed | sort | hashsums | tree_bray) ;
+    # matrice binaire seule, l'export PHYLIP se fait au besoin avec distance_matrix.py to-phylip
     (cd "$WORKDIR" && \
-    awk 'NF >= 12 && $11 <= 0.05 { print $1 "\t" $2 "\t" $12 }' vOTUs.fasta36 | \
-    rev | sed 's/\t[[:digit:]]\+_/\t/' | rev | \
-    sed 's/_[[:digit:]]\+\t/\t/' | sort | \
-    "$CURRENT_DIR/hashsums" | "$CURRENT_DIR/tree_bray" > vOTUs.fasta36.mat)
+    python3 "$SCRIPT_DIR/generate_bray_matrix.py" --alignments -e 0.05 vOTUs.fasta36 vOTUs.fasta36.dmat)
     
     # Vérification de la création de la matrice
     if [ ! -s "$MATRIX_FILE" ]; then
@@ -352,13 +351,12 @@ else
     echo "=== Matrice de distance déjà créée, étape ignorée ==="
 fi
 
-# Étape 5: Génération de l'arbre phylogénétique avec rapidnj
+# Étape 5: Génération de l'arbre phylogénétique (neighbor-joining, rapidnj par défaut)
 TREE_FILE="$WORKDIR/vOTUs.fasta36.nwk"
 if ! is_completed "fasta36_tree_completed"; then
-    echo "=== Génération de l'arbre phylogénétique avec rapidnj ==="
+    echo "=== Génération de l'arbre phylogénétique avec $NJ_BACKEND ==="
     
-    # Exécution de rapidnj
-    (cd "$WORKDIR" && rapidnj -i pd vOTUs.fasta36.mat > vOTUs.fasta36.nwk)
+    python3 "$SCRIPT_DIR/neighbor_joining.py" --nj "$NJ_BACKEND" "$MATRIX_FILE" "$TREE_FILE"
     
     # Vérification de la création de l'arbre
     if [ ! -s "$TREE_FILE" ]; then
@@ -390,8 +388,8 @@ if [ -s "$ALIGNMENT_FILE" ]; then
     echo "Alignements identifiés: $ALIGNMENT_COUNT (dont $NON_SELF_COUNT hors auto-alignements)"
     
     # Vérification de l'existence de la matrice et de l'arbre
-    if [ -f "$WORKDIR/vOTUs.fasta36.mat" ]; then
-        echo "Matrice de distance générée: $(wc -l < "$WORKDIR/vOTUs.fasta36.mat") lignes"
+    if [ -f "$MATRIX_FILE" ]; then
+        echo "Matrice de distance générée: $(wc -l < "$MATRIX_FILE.names") séquences"
     fi
     
     if [ -f "$WORKDIR/vOTUs.fasta36.nwk" ]; then
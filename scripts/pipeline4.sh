@@ -2,26 +2,37 @@
 
 # Script pour convertir des alignements MMseqs2 en arbre phylogénétique
 # Reproduit la pipeline: filtrage -> nettoyage -> hashsums -> tree_bray -> rapidnj
+# (hashsums et tree_bray sont remplacés par generate_bray_matrix.py ; l'arbre est construit par
+# neighbor_joining.py, avec rapidnj par défaut ou le moteur numpy via -n numpy)
 
 # Utilisation 
 # singularity exec --bind $(pwd):/mnt --pwd /mnt virome_shah.sif ./pipeline4.sh -i votu_analysis/vOTUs_alignment.tsv -e 0.05 -o vOTUs_p4
+# Balayage de seuils (une seule lecture des alignements, une matrice et un arbre par seuil) :
+# ./pipeline4.sh -i votu_analysis/vOTUs_alignment.tsv -s 1e-10,1e-5,0.05 -o vOTUs_p4
 
 set -e  # Arrêter en cas d'erreur
 
+# Chemin pour les scripts
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Paramètres par défaut
 INPUT_FILE=""
 EVALUE_THRESHOLD=0.05
+SWEEP_THRESHOLDS=""
 OUTPUT_PREFIX="vOTUs"
+NJ_BACKEND="${NJ_BACKEND:-rapidnj}"
 TEMP_DIR=$(mktemp -d)
 
 # Fonction d'aide
 usage() {
-    echo "Usage: $0 -i <fichier_mmseqs2> [-e <seuil_evalue>] [-o <prefixe_sortie>] [-h]"
+    echo "Usage: $0 -i <fichier_mmseqs2> [-e <seuil_evalue> | -s <seuil1,seuil2,...>] [-o <prefixe_sortie>] [-n rapidnj|numpy] [-h]"
     echo ""
     echo "Options:"
     echo "  -i  Fichier d'alignements MMseqs2 (obligatoire)"
     echo "  -e  Seuil d'e-value (défaut: 0.05)"
+    echo "  -s  Liste de seuils d'e-value : une matrice et un arbre par seuil (<prefixe>_e<seuil>)"
     echo "  -o  Préfixe pour les fichiers de sortie (défaut: vOTUs)"
+    echo "  -n  Moteur neighbor-joining: rapidnj ou numpy (défaut: rapidnj)"
     echo "  -h  Afficher cette aide"
     echo ""
     echo "Exemple: $0 -i alignments.tsv -e 0.01 -o mes_sequences"
@@ -35,11 +46,13 @@ cleanup() {
 trap cleanup EXIT
 
 # Parsing des arguments
-while getopts "i:e:o:h" opt; do
+while getopts "i:e:s:o:n:h" opt; do
     case $opt in
         i) INPUT_FILE="$OPTARG" ;;
         e) EVALUE_THRESHOLD="$OPTARG" ;;
+        s) SWEEP_THRESHOLDS="$OPTARG" ;;
         o) OUTPUT_PREFIX="$OPTARG" ;;
+        n) NJ_BACKEND="$OPTARG" ;;
         h) usage ;;
         *) usage ;;
     esac
@@ -56,30 +69,50 @@ if [[ ! -f "$INPUT_FILE" ]]; then
     exit 1
 fi
 
-# Vérifier la disponibilité des outils
+# Vérifier la disponibilité de rapidnj (moteur par défaut)
 # Dans Singularity, chercher d'abord dans le répertoire courant
-for tool in hashsums tree_bray rapidnj; do
-    if ! command -v "$tool" &> /dev/null && [[ ! -x "./$tool" ]]; then
-        echo "Erreur: $tool n'est pas installé, pas dans le PATH, ou pas exécutable dans le répertoire courant"
-        echo "Assurez-vous que $tool est disponible dans l'image Singularity ou dans le répertoire monté"
+RAPIDNJ_CMD="rapidnj"
+if [[ "$NJ_BACKEND" == "rapidnj" ]]; then
+    if ! command -v rapidnj &> /dev/null && [[ ! -x "./rapidnj" ]]; then
+        echo "Erreur: rapidnj n'est pas installé, pas dans le PATH, ou pas exécutable dans le répertoire courant"
+        echo "Assurez-vous que rapidnj est disponible dans l'image Singularity, ou utilisez -n numpy"
         exit 1
     fi
-done
+    # Si l'outil est dans le répertoire courant, utiliser le chemin relatif
+    if [[ -x "./rapidnj" ]]; then
+        RAPIDNJ_CMD="./rapidnj"
+    fi
+fi
 
-# Définir les commandes avec chemin approprié
-HASHSUMS_CMD="hashsums"
-TREE_BRAY_CMD="tree_bray"
-RAPIDNJ_CMD="rapidnj"
+# Mode balayage: les étapes 1 à 5 sont faites une seule fois pour tous les seuils
+if [[ -n "$SWEEP_THRESHOLDS" ]]; then
+    echo "=== Balayage de seuils MMseqs2 vers arbres phylogénétiques ==="
+    echo "Fichier d'entrée: $INPUT_FILE"
+    echo "Seuils e-value: $SWEEP_THRESHOLDS"
+    echo ""
+    echo "Étapes 1-5: Matrices de Bray-Curtis pour tous les seuils (lecture unique)..."
+    MATRIX_FILES=$(python3 "$SCRIPT_DIR/generate_bray_matrix.py" --alignments "$INPUT_FILE" \
+        --sweep "$SWEEP_THRESHOLDS" --no-phylip "$OUTPUT_PREFIX")
+    if [[ -z "$MATRIX_FILES" ]]; then
+        echo "Erreur: Aucune matrice générée"
+        exit 1
+    fi
 
-# Si les outils sont dans le répertoire courant, utiliser le chemin relatif
-if [[ -x "./hashsums" ]]; then
-    HASHSUMS_CMD="./hashsums"
-fi
-if [[ -x "./tree_bray" ]]; then
-    TREE_BRAY_CMD="./tree_bray"
-fi
-if [[ -x "./rapidnj" ]]; then
-    RAPIDNJ_CMD="./rapidnj"
+    echo "Étape 6: Construction des arbres phylogénétiques..."
+    for MATRIX_FILE in $MATRIX_FILES; do
+        TREE_FILE="${MATRIX_FILE%.dmat}.nwk"
+        if python3 "$SCRIPT_DIR/neighbor_joining.py" --nj "$NJ_BACKEND" --rapidnj "$RAPIDNJ_CMD" \
+            "$MATRIX_FILE" "$TREE_FILE"; then
+            echo "  $MATRIX_FILE -> $TREE_FILE"
+        else
+            echo "Erreur: Échec de la construction de l'arbre avec $NJ_BACKEND ($MATRIX_FILE)"
+            exit 1
+        fi
+    done
+
+    echo ""
+    echo "=== Balayage terminé avec succès ==="
+    exit 0
 fi
 
 echo "=== Pipeline MMseqs2 vers arbre phylogénétique ==="
@@ -93,14 +126,11 @@ echo ""
 echo "Étape 1: Filtrage des alignements (e-value <= $EVALUE_THRESHOLD)..."
 FILTERED_FILE="$TEMP_DIR/filtered.tsv"
 
-# Adapter selon le format MMseqs2 standard (12 colonnes)
+# Format MMseqs2 standard (12 colonnes), converti une fois en stockage colonnes (<fichier>.aln)
 # Colonnes: query target identity alnlen mismatches gaps qstart qend tstart tend evalue bitscore
-# On filtre sur l'e-value (colonne 11) et on extrait query, target, bitscore (colonnes 1, 2, 12)
-awk -v threshold="$EVALUE_THRESHOLD" '
-    NF >= 12 && $11 <= threshold {
-        print $1 "\t" $2 "\t" $12
-    }
-' "$INPUT_FILE" > "$FILTERED_FILE"
+# On filtre sur l'e-value (colonne 11) et on extrait query, target, bitscore (colonnes 1, 2, 12),
+# les noms de séquences étant directement donnés au niveau contig (suffixe _N retiré)
+python3 "$SCRIPT_DIR/alignment_store.py" pairs "$INPUT_FILE" -e "$EVALUE_THRESHOLD" --contigs > "$FILTERED_FILE"
 
 if [[ ! -s "$FILTERED_FILE" ]]; then
     echo "Erreur: Aucun alignement ne passe le filtre e-value <= $EVALUE_THRESHOLD"
@@ -110,52 +140,35 @@ fi
 echo "  $(wc -l < "$FILTERED_FILE") alignements retenus"
 
 # Étape 2: Nettoyage des noms de séquences
-echo "Étape 2: Nettoyage des noms de séquences..."
-CLEANED_FILE="$TEMP_DIR/cleaned.tsv"
-
-# Équivalent de: rev | sed 's/\t[[:digit:]]\+_/\t/' | rev | sed 's/_[[:digit:]]\+\t/\t/'
-# Cela enlève les suffixes numériques des noms de séquences
-sed 's/_[0-9]\+\t/\t/g' "$FILTERED_FILE" | sed 's/\t_[0-9]\+/\t/g' > "$CLEANED_FILE"
-
-# Étape 3: Tri des données
-echo "Étape 3: Tri des données..."
-SORTED_FILE="$TEMP_DIR/sorted.tsv"
-sort "$CLEANED_FILE" > "$SORTED_FILE"
-
-# Étape 4: Calcul des sommes (hashsums)
-echo "Étape 4: Calcul des sommes par paire..."
-HASHSUMS_FILE="$TEMP_DIR/hashsums.tsv"
-$HASHSUMS_CMD < "$SORTED_FILE" > "$HASHSUMS_FILE"
-
-if [[ ! -s "$HASHSUMS_FILE" ]]; then
-    echo "Erreur: Échec du calcul des hashsums"
-    exit 1
-fi
-
-echo "  $(wc -l < "$HASHSUMS_FILE") paires uniques"
+# Déjà fait à l'étape 1 : le stockage associe chaque protéine à son contig
+# (équivalent de sed 's/_[0-9]\+\t/\t/g')
+echo "Étape 2: Nettoyage des noms de séquences (dictionnaire des contigs)..."
+CLEANED_FILE="$FILTERED_FILE"
 
-# Étape 5: Calcul de la matrice de distances (tree_bray)
-echo "Étape 5: Calcul de la matrice de distances de Bray-Curtis..."
-MATRIX_FILE="${OUTPUT_PREFIX}.mat"
-$TREE_BRAY_CMD < "$HASHSUMS_FILE" > "$MATRIX_FILE"
+# Étapes 3-5: Sommes des bitscores par paire de contigs et distances de Bray-Curtis
+# (remplace sort | hashsums | tree_bray, sans tri textuel)
+echo "Étapes 3-5: Calcul de la matrice de distances de Bray-Curtis..."
+MATRIX_FILE="${OUTPUT_PREFIX}.dmat"
+python3 "$SCRIPT_DIR/generate_bray_matrix.py" "$CLEANED_FILE" "$MATRIX_FILE"
 
 if [[ ! -s "$MATRIX_FILE" ]]; then
     echo "Erreur: Échec du calcul de la matrice de distances"
     exit 1
 fi
 
-# Extraire le nombre de séquences de la matrice
-NUM_SEQUENCES=$(head -n1 "$MATRIX_FILE" | cut -f2)
+# Nombre de séquences de la matrice (noms dans <matrice>.names)
+NUM_SEQUENCES=$(wc -l < "$MATRIX_FILE.names")
 echo "  Matrice ${NUM_SEQUENCES}x${NUM_SEQUENCES} générée: $MATRIX_FILE"
 
 # Étape 6: Construction de l'arbre phylogénétique
 echo "Étape 6: Construction de l'arbre phylogénétique..."
 TREE_FILE="${OUTPUT_PREFIX}.nwk"
 
-if $RAPIDNJ_CMD -i pd "$MATRIX_FILE" > "$TREE_FILE"; then
+if python3 "$SCRIPT_DIR/neighbor_joining.py" --nj "$NJ_BACKEND" --rapidnj "$RAPIDNJ_CMD" \
+    "$MATRIX_FILE" "$TREE_FILE"; then
     echo "  Arbre phylogénétique généré: $TREE_FILE"
 else
-    echo "Erreur: Échec de la construction de l'arbre avec rapidnj"
+    echo "Erreur: Échec de la construction de l'arbre avec $NJ_BACKEND"
     exit 1
 fi
 
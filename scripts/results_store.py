@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Base SQLite regroupant les résultats geNomad et CheckV par séquence
+
+Les fichiers *_virus_summary.tsv, *_plasmid_summary.tsv et quality_summary.tsv
+de chaque dossier <seq_id>_genomad / <seq_id>_checkv sont chargés dans trois
+tables typées (genomad_virus, genomad_plasmid, checkv_quality) indexées sur
+sequence_id. Les ajouts sont incrémentaux : un fichier déjà chargé et non
+modifié n'est pas relu.
+
+Usage: python results_store.py [--output-dir output_analysis] [--db results.sqlite]
+       python results_store.py --min-completeness 90
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Types des colonnes connues ; les autres colonnes sont stockées en TEXT
+COLUMN_TYPES = {
+    # geNomad
+    'length': 'INTEGER',
+    'n_genes': 'INTEGER',
+    'genetic_code': 'INTEGER',
+    'virus_score': 'REAL',
+    'plasmid_score': 'REAL',
+    'fdr': 'REAL',
+    'n_hallmarks': 'INTEGER',
+    'marker_enrichment': 'REAL',
+    # CheckV
+    'contig_length': 'INTEGER',
+    'proviral_length': 'INTEGER',
+    'gene_count': 'INTEGER',
+    'viral_genes': 'INTEGER',
+    'host_genes': 'INTEGER',
+    'completeness': 'REAL',
+    'contamination': 'REAL',
+    'kmer_freq': 'REAL',
+}
+
+# table -> suffixe du fichier source
+TABLE_SOURCES = {
+    'genomad_virus': '_virus_summary.tsv',
+    'genomad_plasmid': '_plasmid_summary.tsv',
+    'checkv_quality': 'quality_summary.tsv',
+}
+
+
+def connect(db_path, wal=False):
+    """Ouvre la base ; journal classique (DELETE) par défaut
+
+    Le mode WAL repose sur un index en mémoire partagée, non supporté (ou non
+    sûr entre nœuds) sur NFS : il n'est activé que sur demande, pour un disque local.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ingested ("
+        "source TEXT PRIMARY KEY, sequence_id TEXT, tbl TEXT, mtime_ns INTEGER)"
+    )
+    return conn
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def ensure_table(conn, table, header):
+    """Crée la table (ou ajoute les colonnes manquantes) à partir de l'en-tête du fichier"""
+    existing = table_columns(conn, table)
+    if not existing:
+        columns = ", ".join(f'"{col}" {COLUMN_TYPES.get(col, "TEXT")}' for col in header)
+        conn.execute(f"CREATE TABLE {table} (sequence_id TEXT NOT NULL, {columns})")
+        conn.execute(f"CREATE INDEX idx_{table}_sequence_id ON {table} (sequence_id)")
+        return
+    for col in header:
+        if col not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN "{col}" {COLUMN_TYPES.get(col, "TEXT")}')
+
+
+def convert(value, col_type):
+    if value in ('', 'NA', 'nan'):
+        return None
+    try:
+        if col_type == 'INTEGER':
+            return int(value)
+        if col_type == 'REAL':
+            return float(value)
+    except ValueError:
+        return None
+    return value
+
+
+def ingest_file(conn, table, path, seq_id):
+    """Remplace les lignes de seq_id dans table par le contenu du fichier path"""
+    mtime_ns = os.stat(path).st_mtime_ns
+    row = conn.execute("SELECT mtime_ns FROM ingested WHERE source = ?", (path,)).fetchone()
+    if row is not None and row[0] == mtime_ns:
+        return 0
+
+    with open(path, 'r') as f:
+        header = f.readline().rstrip('\n').split('\t')
+        if header == ['']:
+            return 0
+        ensure_table(conn, table, header)
+        types = [COLUMN_TYPES.get(col, 'TEXT') for col in header]
+        rows = []
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != len(header):
+                continue
+            # Les provirus geNomad sont nommés "<seq_id>|provirus_<début>_<fin>"
+            row_seq_id = fields[0].split('|', 1)[0]
+            rows.append([row_seq_id] + [convert(v, t) for v, t in zip(fields, types)])
+
+    columns = ", ".join(["sequence_id"] + [f'"{col}"' for col in header])
+    placeholders = ", ".join("?" * (len(header) + 1))
+    with conn:
+        conn.execute(f"DELETE FROM {table} WHERE sequence_id = ?", (str(seq_id),))
+        conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO ingested (source, sequence_id, tbl, mtime_ns) VALUES (?, ?, ?, ?)",
+            (path, str(seq_id), table, mtime_ns)
+        )
+    return len(rows)
+
+
+def find_result_files(tool_dir):
+    """Renvoie les (table, chemin) des fichiers de résultats d'un dossier _genomad/_checkv"""
+    found = []
+    for root, dirs, files in os.walk(tool_dir):
+        for name in files:
+            for table, suffix in TABLE_SOURCES.items():
+                if name.endswith(suffix):
+                    found.append((table, os.path.join(root, name)))
+                    break
+    return found
+
+
+def ingest_sequence(conn, seq_id, output_dir):
+    """Charge les résultats d'une séquence terminée (appelé au fil de l'eau par le runner)"""
+    count = 0
+    for tool in ("genomad", "checkv"):
+        tool_dir = os.path.join(output_dir, f"{seq_id}_{tool}")
+        if not os.path.isdir(tool_dir):
+            continue
+        for table, path in find_result_files(tool_dir):
+            count += ingest_file(conn, table, path, seq_id)
+    return count
+
+
+def collect(conn, output_dir):
+    """Charge tous les dossiers <seq_id>_genomad / <seq_id>_checkv de output_dir"""
+    seq_ids = set()
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            for tool in ("genomad", "checkv"):
+                if entry.name.endswith(f"_{tool}") and entry.is_dir():
+                    seq_ids.add(entry.name[:-len(tool) - 1])
+
+    total = 0
+    for i, seq_id in enumerate(sorted(seq_ids)):
+        if i % 1000 == 0:
+            logger.info(f"Progression: {i}/{len(seq_ids)}")
+        total += ingest_sequence(conn, seq_id, output_dir)
+    logger.info(f"{total} lignes chargées pour {len(seq_ids)} séquences")
+    return total
+
+
+def select_viral_hits(conn, min_completeness=0.0):
+    """Séquences détectées virales par geNomad avec une complétude CheckV >= min_completeness"""
+    if not table_columns(conn, 'genomad_virus') or not table_columns(conn, 'checkv_quality'):
+        return []
+    return conn.execute(
+        "SELECT v.sequence_id, v.seq_name, v.virus_score, q.checkv_quality, q.completeness "
+        "FROM genomad_virus v JOIN checkv_quality q ON q.sequence_id = v.sequence_id "
+        "WHERE q.completeness >= ? ORDER BY q.completeness DESC",
+        (min_completeness,)
+    ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Base SQLite des résultats geNomad/CheckV")
+    parser.add_argument("--output-dir", default="output_analysis",
+                        help="Répertoire contenant les dossiers <seq_id>_genomad/_checkv")
+    parser.add_argument("--db", default=None,
+                        help="Base SQLite (défaut: <output-dir>/results.sqlite)")
+    parser.add_argument("--min-completeness", type=float, default=None,
+                        help="Afficher les hits viraux avec une complétude CheckV >= cette valeur")
+    parser.add_argument("--wal", action="store_true",
+                        help="Journal WAL (base sur disque local uniquement, pas sur NFS)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    if not os.path.isdir(args.output_dir):
+        print(f"ERREUR: Répertoire introuvable: {args.output_dir}")
+        sys.exit(1)
+
+    conn = connect(args.db or os.path.join(args.output_dir, "results.sqlite"), wal=args.wal)
+    collect(conn, args.output_dir)
+
+    if args.min_completeness is not None:
+        for row in select_viral_hits(conn, args.min_completeness):
+            print("\t".join("" if v is None else str(v) for v in row))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
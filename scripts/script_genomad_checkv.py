@@ -1,90 +1,206 @@
 import os
+import glob
+import gzip
+import queue
+import threading
+import shutil
 import subprocess
-import pandas as pd
 import logging
+import time
+import logging.handlers
+import multiprocessing
+from collections import deque
 from multiprocessing import Pool
 from datetime import datetime
+from benchmark_index import BenchmarkIndex
+import results_store
+from output_pack import PackWriter
 
 # --- Configuration du logging ---
+# Le processus principal et les workers envoient leurs messages dans une file
+# (QueueHandler) ; un seul QueueListener écrit dans le fichier et la console.
+# Les sorties de geNomad/CheckV vont dans un fichier compressé par lancement.
 log_dir = "logs"
 os.makedirs(log_dir, exist_ok=True)
 log_file = os.path.join(log_dir, f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+tool_log_dir = os.path.join(log_dir, "tools")
+tool_log_tail_lines = 50   # Lignes de stdout/stderr gardées en mémoire pour les messages d'erreur
 logger = logging.getLogger()
 
+def setup_logging():
+    """Démarre le QueueListener du processus principal ; renvoie (file, listener)"""
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = multiprocessing.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    init_worker_logging(log_queue)
+    return log_queue, listener
+
+def init_worker_logging(log_queue):
+    """Initialiseur des workers : tous les messages passent par la file du processus principal"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.DEBUG)
+
 # --- Chemins ---
 tsv_path = "benchmark.tsv"
 output_dir = "output_analysis"
 genomad_db = "/srv/scratch/yazidima/Maha/genomad_new_db/genomad_db"
 checkv_db = "/srv/scratch/givreex/checkv-db-v1.5"
 status_file = os.path.join(output_dir, "processing_status.tsv")  # Fichier pour suivre le statut des échantillons
+journal_file = os.path.join(output_dir, "processing_status.journal")
+compact_every = 1000       # Compactage du journal dans status_file toutes les N séquences
+results_db = os.path.join(output_dir, "results.sqlite")  # Résultats geNomad/CheckV consolidés (voir results_store.py)
+metrics_file = os.path.join(output_dir, "tool_metrics.tsv")  # Temps et mémoire de chaque lancement d'outil
+progress_interval_s = 60   # Fréquence des messages de progression (débit, files, ETA)
+
+# --- Empaquetage des sorties ---
+# Les dossiers des séquences terminées sont regroupés dans des shards indexés
+# (voir output_pack.py) et les fichiers intermédiaires des lots sont supprimés.
+pack_outputs = False
+pack_shard_size = 1000     # Nombre de séquences par shard
+pack_dir = os.path.join(output_dir, "packs")
+
+# --- Mode batch ---
+# Chaque lancement de geNomad/CheckV recharge les bases de données : on regroupe
+# plusieurs séquences dans un même FASTA pour n'avoir qu'un lancement par lot.
+batch_size = 50            # Nombre max de séquences par lot (1 = une séquence par lancement)
+batch_max_bp = 5_000_000   # Taille max d'un lot en paires de bases (0 = pas de limite)
+
+# --- Budget de ressources ---
+# geNomad et CheckV tournent dans deux pools séparés, dimensionnés par plan_workers
+total_cores = os.cpu_count() or 1
+total_memory_gb = 128
+genomad_share = 0.6        # Part du budget (cœurs et mémoire) réservée à geNomad
+genomad_threads = 4
+genomad_memory_gb = 16
+checkv_threads = 2
+checkv_memory_gb = 4
 
 # --- Préparation des répertoires ---
 os.makedirs(output_dir, exist_ok=True)
 fasta_dir = os.path.join(output_dir, "fasta")
 os.makedirs(fasta_dir, exist_ok=True)
+batch_dir = os.path.join(output_dir, "batches")
 
 # --- Lecture et initialisation du fichier de statut ---
+# Les statuts sont ajoutés au fil de l'eau dans un journal (append-only), puis
+# régulièrement compactés dans processing_status.tsv : un arrêt brutal ne perd
+# au plus que les dernières lignes non synchronisées du journal.
+STATUS_COLUMNS = ["sequence_id", "geNomad_status", "checkV_status"]
+FINISHED_GENOMAD = ('completed', 'completed_no_hits')
+
+def read_status_lines(path, status_dict):
+    """Ajoute à status_dict les statuts d'un fichier TSV (statut ou journal), en O(N)"""
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            # Ignore l'en-tête et une éventuelle dernière ligne tronquée par un crash
+            if len(fields) != 3 or fields[0] == "sequence_id":
+                continue
+            status_dict[fields[0]] = {
+                'geNomad_status': fields[1],
+                'checkV_status': fields[2]
+            }
+
 def initialize_status_file():
     if not os.path.exists(status_file):
         with open(status_file, 'w') as f:
-            f.write("sequence_id\tgeNomad_status\tcheckV_status\n")
-        return {}
-    else:
-        try:
-            status_df = pd.read_csv(status_file, sep='\t')
-            # Créer un dictionnaire pour un accès rapide au statut
-            status_dict = {}
-            for _, row in status_df.iterrows():
-                status_dict[row['sequence_id']] = {
-                    'geNomad_status': row['geNomad_status'],
-                    'checkV_status': row['checkV_status']
-                }
-            return status_dict
-        except Exception as e:
-            logger.error(f"Erreur lors de la lecture du fichier de statut: {e}")
-            return {}
+            f.write("\t".join(STATUS_COLUMNS) + "\n")
+    status_dict = {}
+    try:
+        read_status_lines(status_file, status_dict)
+        if os.path.exists(journal_file):
+            # Le journal est plus récent que le TSV : il est rejoué par-dessus
+            read_status_lines(journal_file, status_dict)
+    except Exception as e:
+        logger.error(f"Erreur lors de la lecture du fichier de statut: {e}")
+    return status_dict
+
+def is_finished(status):
+    return (status is not None
+            and status['geNomad_status'] in FINISHED_GENOMAD
+            and status['checkV_status'] == 'completed')
 
 # --- Mise à jour du fichier de statut ---
-def update_status(seq_id, genomad_status=None, checkv_status=None):
+class StatusJournal:
+    """Journal append-only des statuts, synchronisé sur disque tous les fsync_every ajouts"""
+
+    def __init__(self, path, fsync_every=50):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+        self.handle = open(path, 'a')
+
+    def append(self, seq_id, genomad_status, checkv_status):
+        self.handle.write(f"{seq_id}\t{genomad_status}\t{checkv_status}\n")
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.pending = 0
+
+    def truncate(self):
+        self.handle.truncate(0)
+        self.handle.seek(0)
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.handle.close()
+
+def compact_status(status_dict, journal):
+    """Réécrit processing_status.tsv depuis status_dict puis vide le journal"""
+    tmp_path = status_file + ".tmp"
     try:
-        if os.path.exists(status_file):
-            status_df = pd.read_csv(status_file, sep='\t')
-        else:
-            status_df = pd.DataFrame(columns=["sequence_id", "geNomad_status", "checkV_status"])
-        
-        # Vérifier si la séquence existe déjà dans le fichier de statut
-        if seq_id in status_df['sequence_id'].values:
-            idx = status_df.index[status_df['sequence_id'] == seq_id].tolist()[0]
-            if genomad_status is not None:
-                status_df.at[idx, 'geNomad_status'] = genomad_status
-            if checkv_status is not None:
-                status_df.at[idx, 'checkV_status'] = checkv_status
-        else:
-            new_row = {'sequence_id': seq_id, 
-                      'geNomad_status': genomad_status if genomad_status is not None else 'pending',
-                      'checkV_status': checkv_status if checkv_status is not None else 'pending'}
-            status_df = pd.concat([status_df, pd.DataFrame([new_row])], ignore_index=True)
-        
-        # Sauvegarder le fichier de statut
-        status_df.to_csv(status_file, sep='\t', index=False)
+        journal.sync()
+        with open(tmp_path, 'w') as f:
+            f.write("\t".join(STATUS_COLUMNS) + "\n")
+            for seq_id, status in status_dict.items():
+                f.write(f"{seq_id}\t{status['geNomad_status']}\t{status['checkV_status']}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, status_file)
+        # Rejouer le journal sur le nouveau TSV est idempotent : le vider en dernier
+        # reste sûr si le script est tué entre les deux étapes.
+        journal.truncate()
     except Exception as e:
-        logger.error(f"Erreur lors de la mise à jour du fichier de statut pour {seq_id}: {e}")
+        logger.error(f"Erreur lors du compactage du fichier de statut: {e}")
+
+def update_status(status_dict, journal, result):
+    status = {
+        'geNomad_status': result['genomad_status'],
+        'checkV_status': result['checkv_status']
+    }
+    status_dict[str(result['sequence_id'])] = status
+    journal.append(result['sequence_id'], status['geNomad_status'], status['checkV_status'])
 
 # --- Lecture du TSV ---
+# Les workers ne reçoivent que des identifiants : les séquences sont lues via
+# l'index par offsets de benchmark.tsv (mmap), ouvert une fois par processus.
+benchmark = None
+
+def get_benchmark():
+    global benchmark
+    if benchmark is None:
+        benchmark = BenchmarkIndex(tsv_path)
+    return benchmark
+
 def load_sequences():
+    """Renvoie la liste des (sequence_id, longueur) sans charger les séquences"""
     try:
-        logger.info(f"Lecture du fichier {tsv_path}")
-        df = pd.read_csv(tsv_path, sep='\t', header=None, low_memory=False)
-        seq_col = df.columns[-1]
-        sequences = df[[0, seq_col]].values.tolist()
+        logger.info(f"Lecture de l'index de {tsv_path}")
+        index = get_benchmark()
+        sequences = [(seq_id, length) for seq_id, (_, length) in index.offsets.items()]
         logger.info(f"Nombre de séquences chargées: {len(sequences)}")
         return sequences
     except Exception as e:
@@ -120,131 +236,413 @@ def check_checkv_results(checkv_output):
     if not os.path.exists(quality_file):
         return False
     
-    # Vérifier si les fichiers ne sont pas vides
+    # CheckV écrit toujours une ligne par contig : un fichier réduit à l'en-tête
+    # (découpage d'un lot sans ligne pour cette séquence) n'est pas un résultat
     try:
-        if os.path.exists(quality_file) and os.path.getsize(quality_file) > 0:
-            return True
-        return False
+        with open(quality_file, "r") as f:
+            f.readline()
+            return bool(f.readline().strip())
     except Exception as e:
         logger.error(f"Erreur lors de la vérification des résultats CheckV: {e}")
         return False
 
-def process_sequence(entry):
-    seq_id, sequence = entry
+# --- Mode batch : regroupement des séquences ---
+def make_batches(sequences):
+    """Regroupe les séquences en lots d'au plus batch_size séquences et batch_max_bp paires de bases"""
+    batches = []
+    current = []
+    current_bp = 0
+    for seq_id, seq_len in sequences:
+        if current and (len(current) >= batch_size or
+                        (batch_max_bp and current_bp + seq_len > batch_max_bp)):
+            batches.append(current)
+            current = []
+            current_bp = 0
+        current.append((seq_id, seq_len))
+        current_bp += seq_len
+    if current:
+        batches.append(current)
+    return batches
+
+def write_fasta(fasta_path, seq_ids):
+    index = get_benchmark()
+    with open(fasta_path, "w") as f:
+        for seq_id in seq_ids:
+            f.write(f">{seq_id}\n{index.sequence(seq_id)}\n")
+
+def split_table_by_sequence(table_path, seq_ids, output_path_for, keep_empty=True):
+    """Découpe un tableau de sortie multi-séquences en un fichier par séquence.
 
-    fasta_path = os.path.join(fasta_dir, f"{seq_id}.fasta")
-    genomad_output = os.path.join(output_dir, f"{seq_id}_genomad")
-    checkv_output = os.path.join(output_dir, f"{seq_id}_checkv")
+    La première colonne contient l'identifiant (seq_name pour geNomad, contig_id
+    pour CheckV) ; les provirus geNomad sont nommés "<seq_id>|provirus_<début>_<fin>".
+    Avec keep_empty, chaque séquence du lot reçoit un fichier, réduit à l'en-tête
+    si elle n'a aucune ligne (geNomad : aucun hit) ; sinon aucun fichier n'est
+    écrit pour elle (CheckV : ligne manquante, la séquence reste incomplète).
+    """
+    rows = {str(seq_id): [] for seq_id in seq_ids}
+    with open(table_path, "r") as f:
+        header = f.readline()
+        for line in f:
+            key = line.split("\t", 1)[0].split("|", 1)[0]
+            if key in rows:
+                rows[key].append(line)
 
-    # Créer FASTA si nécessaire
-    if not os.path.exists(fasta_path):
-        with open(fasta_path, "w") as f:
-            f.write(f">{seq_id}\n{sequence}\n")
+    for seq_id in seq_ids:
+        if not keep_empty and not rows[str(seq_id)]:
+            continue
+        out_path = output_path_for(seq_id)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "w") as f:
+            f.write(header)
+            f.writelines(rows[str(seq_id)])
 
-    genomad_status = "error"
-    checkv_status = "error"
+def find_genomad_summary(genomad_output, kind):
+    """Retrouve <prefixe>_summary/<prefixe>_{kind}_summary.tsv dans une sortie geNomad"""
+    matches = glob.glob(os.path.join(genomad_output, "*_summary", f"*_{kind}_summary.tsv"))
+    return matches[0] if matches else None
 
-    # ---- geNomad ----
-    genomad_result_status = check_genomad_results(genomad_output, seq_id)
+# --- Métriques des lancements ---
+METRICS_COLUMNS = ["timestamp", "tool", "batch", "n_sequences", "input_bp", "returncode",
+                   "wall_s", "cpu_user_s", "cpu_sys_s", "max_rss_kb"]
 
-    if genomad_result_status == "results_found":
-        logger.info(f"[✔] Résultats geNomad valides avec détections pour {seq_id}")
-        genomad_status = 'completed'
+def init_metrics_file():
+    """Écrit l'en-tête de metrics_file s'il est absent ou vide, avant le démarrage des pools
 
-    elif genomad_result_status == "no_results":
-        logger.info(f"[✓] geNomad terminé sans détection pour {seq_id}")
-        genomad_status = 'completed_no_hits'
+    Les workers ne font ensuite qu'ajouter des lignes : deux workers terminant en
+    même temps ne peuvent pas écrire chacun un en-tête.
+    """
+    try:
+        if not os.path.exists(metrics_file) or os.path.getsize(metrics_file) == 0:
+            with open(metrics_file, "w") as f:
+                f.write("\t".join(METRICS_COLUMNS) + "\n")
+    except Exception as e:
+        logger.error(f"Erreur lors de la création de {metrics_file}: {e}")
 
-    elif genomad_result_status == "not_found":
-        logger.info(f"[⚙] Lancement de geNomad pour {seq_id}")
-        os.makedirs(genomad_output, exist_ok=True)
+def record_metrics(tool_name, label, n_sequences, input_bp, returncode, wall_s, rusage):
+    """Ajoute une ligne à metrics_file (écriture O_APPEND unique, sûre entre processus)"""
+    fields = [datetime.now().isoformat(timespec='seconds'), tool_name, label, n_sequences,
+              input_bp, returncode, f"{wall_s:.2f}", f"{rusage.ru_utime:.2f}",
+              f"{rusage.ru_stime:.2f}", rusage.ru_maxrss]
+    line = "\t".join(map(str, fields)) + "\n"
+    try:
+        fd = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
         try:
-            result = subprocess.run(
-                ["genomad", "end-to-end", fasta_path, genomad_output, genomad_db],
-                check=False,
-                capture_output=True,
-                text=True
-            )
-
-            if result.returncode != 0:
-                logger.error(f"[✗] Erreur geNomad pour {seq_id}")
-                logger.error(f"↳ Code: {result.returncode}")
-                logger.error(f"↳ stdout: {result.stdout}")
-                logger.error(f"↳ stderr: {result.stderr}")
-                genomad_status = 'failed'
-            else:
-                logger.debug(f"[geNomad stdout pour {seq_id}]:\n{result.stdout}")
-                logger.debug(f"[geNomad stderr pour {seq_id}]:\n{result.stderr}")
-
-                new_result = check_genomad_results(genomad_output, seq_id)
-                if new_result == "results_found":
-                    genomad_status = 'completed'
-                elif new_result == "no_results":
-                    genomad_status = 'completed_no_hits'
-                else:
-                    genomad_status = 'incomplete'
-        except Exception as e:
-            logger.error(f"[✗] Exception geNomad pour {seq_id}: {e}")
-            genomad_status = 'error'
-    else:
-        genomad_status = 'error'
-
-    # ---- CheckV ----
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+    except Exception as e:
+        logger.error(f"Erreur lors de l'écriture des métriques pour {label}: {e}")
+
+def stream_output(pipe, stream_name, log_handle, lock, tail):
+    """Recopie une sortie du processus dans le journal compressé, en gardant les dernières lignes"""
+    for line in pipe:
+        with lock:
+            log_handle.write(f"[{stream_name}] {line}")
+        tail.append(line.rstrip('\n'))
+    pipe.close()
+
+def run_tool(cmd, tool_name, label, n_sequences=0, input_bp=0):
+    """Lance geNomad ou CheckV ; renvoie True si le code retour est 0.
+
+    stdout/stderr sont écrits au fil de l'eau dans logs/tools/<label>_<outil>.log.gz ;
+    seules les tool_log_tail_lines dernières lignes restent en mémoire pour le
+    message d'erreur. Le processus est attendu avec os.wait4 pour relever son
+    rusage (temps CPU, pic de RSS), enregistré dans metrics_file.
+    """
+    os.makedirs(tool_log_dir, exist_ok=True)
+    tool_log = os.path.join(tool_log_dir, f"{label}_{tool_name}.log.gz")
+    tails = {'stdout': deque(maxlen=tool_log_tail_lines),
+             'stderr': deque(maxlen=tool_log_tail_lines)}
+    lock = threading.Lock()
+
+    start = time.monotonic()
+    with gzip.open(tool_log, 'wt') as log_handle:
+        # errors="replace" : un octet non UTF-8 ne doit pas tuer le thread lecteur (pipe plein, blocage)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                errors="replace")
+        # Les sorties sont vidées dans des threads pour que wait4 ne bloque pas le processus
+        readers = [
+            threading.Thread(target=stream_output,
+                             args=(pipe, name, log_handle, lock, tails[name]), daemon=True)
+            for name, pipe in (('stdout', proc.stdout), ('stderr', proc.stderr))
+        ]
+        for reader in readers:
+            reader.start()
+        _, wait_status, rusage = os.wait4(proc.pid, 0)
+        for reader in readers:
+            reader.join()
+    proc.returncode = os.waitstatus_to_exitcode(wait_status)
+    record_metrics(tool_name, label, n_sequences, input_bp, proc.returncode,
+                   time.monotonic() - start, rusage)
+
+    if proc.returncode != 0:
+        logger.error(f"[✗] Erreur {tool_name} pour {label}")
+        logger.error(f"↳ Code: {proc.returncode}")
+        logger.error("↳ stdout (fin): " + "\n".join(tails['stdout']))
+        logger.error("↳ stderr (fin): " + "\n".join(tails['stderr']))
+        logger.error(f"↳ Sortie complète: {tool_log}")
+        return False
+    logger.debug(f"[{tool_name}] sortie de {label} enregistrée dans {tool_log}")
+    return True
+
+def genomad_status_from_result(result_status):
+    if result_status == "results_found":
+        return 'completed'
+    if result_status == "no_results":
+        return 'completed_no_hits'
+    return 'incomplete'
+
+def remove_batch_scratch(fasta_path, batch_output):
+    """Supprime le FASTA et la sortie brute d'un lot une fois les résultats redécoupés"""
+    shutil.rmtree(batch_output, ignore_errors=True)
+    if os.path.exists(fasta_path):
+        os.remove(fasta_path)
+
+def batch_bp(batch, ids):
+    lengths = dict(batch)
+    return sum(lengths[seq_id] for seq_id in ids)
+
+def batch_name_of(batch):
+    return f"batch_{batch[0][0]}"
+
+def run_genomad_stage(batch):
+    """Étage geNomad : un lancement pour les séquences du lot sans résultats.
+
+    Les résumés sont redécoupés par sequence_id dans <seq_id>_genomad/, de sorte
+    que check_genomad_results s'applique comme en mode séquence par séquence.
+    Renvoie (batch, {seq_id: statut geNomad}).
+    """
+    batch_name = batch_name_of(batch)
+    statuses = {}
+    ids = []
+    for seq_id, _ in batch:
+        genomad_result_status = check_genomad_results(
+            os.path.join(output_dir, f"{seq_id}_genomad"), seq_id)
+        if genomad_result_status in ("results_found", "no_results"):
+            statuses[seq_id] = genomad_status_from_result(genomad_result_status)
+        elif genomad_result_status == "not_found":
+            ids.append(seq_id)
+        else:
+            statuses[seq_id] = 'error'
+
+    if not ids:
+        return batch, statuses
+
+    fasta_path = os.path.join(fasta_dir, f"{batch_name}_genomad.fasta")
+    batch_output = os.path.join(batch_dir, f"{batch_name}_genomad")
+    os.makedirs(batch_dir, exist_ok=True)
+
+    logger.info(f"[⚙] Lancement de geNomad pour {batch_name} ({len(ids)} séquences)")
+    try:
+        # Un identifiant absent de l'index ou une erreur d'écriture n'échoue que ce lot
+        write_fasta(fasta_path, ids)
+        # Une sortie partielle d'un lot précédent peut contenir d'autres séquences
+        shutil.rmtree(batch_output, ignore_errors=True)
+        cmd = ["genomad", "end-to-end", "--threads", str(genomad_threads),
+               fasta_path, batch_output, genomad_db]
+        if not run_tool(cmd, "geNomad", batch_name, len(ids), batch_bp(batch, ids)):
+            for seq_id in ids:
+                statuses[seq_id] = 'failed'
+        else:
+            for kind in ("plasmid", "virus"):
+                summary = find_genomad_summary(batch_output, kind)
+                if summary is not None:
+                    split_table_by_sequence(
+                        summary, ids,
+                        lambda seq_id: os.path.join(output_dir, f"{seq_id}_genomad",
+                                                    f"{seq_id}_{kind}_summary.tsv"))
+            for seq_id in ids:
+                new_result = check_genomad_results(
+                    os.path.join(output_dir, f"{seq_id}_genomad"), seq_id)
+                statuses[seq_id] = genomad_status_from_result(new_result)
+            if pack_outputs:
+                remove_batch_scratch(fasta_path, batch_output)
+    except Exception as e:
+        logger.error(f"[✗] Exception geNomad pour {batch_name}: {e}")
+        for seq_id in ids:
+            statuses[seq_id] = 'error'
+
+    return batch, statuses
+
+def run_checkv_stage(batch):
+    """Étage CheckV : un lancement pour les séquences du lot sans quality_summary.tsv.
+
+    Renvoie {seq_id: statut CheckV}.
+    """
+    batch_name = batch_name_of(batch)
+    statuses = {}
+    ids = []
+    for seq_id, _ in batch:
+        if check_checkv_results(os.path.join(output_dir, f"{seq_id}_checkv")):
+            statuses[seq_id] = 'completed'
+        else:
+            ids.append(seq_id)
+
+    if not ids:
+        return statuses
+
+    fasta_path = os.path.join(fasta_dir, f"{batch_name}_checkv.fasta")
+    batch_output = os.path.join(batch_dir, f"{batch_name}_checkv")
+    os.makedirs(batch_dir, exist_ok=True)
+
+    logger.info(f"[⚙] Lancement CheckV pour {batch_name} ({len(ids)} séquences)")
     try:
-        if check_checkv_results(checkv_output):
-            logger.info(f"[✔] Résultats CheckV valides pour {seq_id}")
-            checkv_status = 'completed'
+        write_fasta(fasta_path, ids)
+        shutil.rmtree(batch_output, ignore_errors=True)
+        cmd = ["checkv", "end_to_end", fasta_path, batch_output,
+               "-d", checkv_db, "-t", str(checkv_threads)]
+        if not run_tool(cmd, "CheckV", batch_name, len(ids), batch_bp(batch, ids)):
+            for seq_id in ids:
+                statuses[seq_id] = 'failed'
         else:
-            logger.info(f"[⚙] Lancement CheckV pour {seq_id}")
-            os.makedirs(checkv_output, exist_ok=True)
-            result = subprocess.run(
-                ["checkv", "end_to_end", fasta_path, checkv_output, "-d", checkv_db],
-                check=False,
-                capture_output=True,
-                text=True
-            )
-
-            if result.returncode != 0:
-                logger.error(f"[✗] Erreur CheckV pour {seq_id}")
-                logger.error(f"↳ Code: {result.returncode}")
-                logger.error(f"↳ stdout: {result.stdout}")
-                logger.error(f"↳ stderr: {result.stderr}")
-                checkv_status = 'failed'
-            else:
-                if check_checkv_results(checkv_output):
-                    logger.info(f"[✓] CheckV terminé avec succès pour {seq_id}")
-                    checkv_status = 'completed'
+            quality_file = os.path.join(batch_output, "quality_summary.tsv")
+            if os.path.exists(quality_file):
+                split_table_by_sequence(
+                    quality_file, ids,
+                    lambda seq_id: os.path.join(output_dir, f"{seq_id}_checkv",
+                                                "quality_summary.tsv"),
+                    keep_empty=False)
+            for seq_id in ids:
+                if check_checkv_results(os.path.join(output_dir, f"{seq_id}_checkv")):
+                    statuses[seq_id] = 'completed'
                 else:
-                    checkv_status = 'incomplete'
+                    statuses[seq_id] = 'incomplete'
+            if pack_outputs:
+                remove_batch_scratch(fasta_path, batch_output)
     except Exception as e:
-        logger.error(f"[✗] Exception CheckV pour {seq_id}: {e}")
-        checkv_status = 'error'
+        logger.error(f"[✗] Exception CheckV pour {batch_name}: {e}")
+        for seq_id in ids:
+            statuses[seq_id] = 'error'
 
-    return {
-        'sequence_id': seq_id,
-        'genomad_status': genomad_status,
-        'checkv_status': checkv_status
-    }
+    return statuses
+
+# --- Ordonnanceur à deux étages ---
+def plan_workers():
+    """Dimensionne les pools geNomad et CheckV dans le budget total de cœurs et de mémoire.
+
+    geNomad reçoit genomad_share du budget, CheckV le reste ; chaque pool a au moins un worker.
+    """
+    def fit(cores, memory_gb, threads, job_memory_gb):
+        return max(1, min(int(cores) // threads, int(memory_gb // job_memory_gb)))
+
+    genomad_workers = fit(total_cores * genomad_share, total_memory_gb * genomad_share,
+                          genomad_threads, genomad_memory_gb)
+    checkv_workers = fit(total_cores - genomad_workers * genomad_threads,
+                         total_memory_gb - genomad_workers * genomad_memory_gb,
+                         checkv_threads, checkv_memory_gb)
+    return genomad_workers, checkv_workers
+
+def run_pipeline(batches, log_queue):
+    """Enchaîne geNomad puis CheckV sur des pools séparés et produit un statut par séquence.
+
+    Chaque lot terminé par geNomad est mis en file pour le pool CheckV : CheckV sur
+    le lot i tourne pendant que geNomad traite le lot i+1.
+    """
+    genomad_workers, checkv_workers = plan_workers()
+    logger.info(f"Pools: {genomad_workers} geNomad x {genomad_threads} threads, "
+                f"{checkv_workers} CheckV x {checkv_threads} threads "
+                f"(budget {total_cores} cœurs, {total_memory_gb} Go)")
+
+    finished = queue.Queue()
+
+    def merge(genomad_statuses, checkv_statuses):
+        return [
+            {'sequence_id': seq_id,
+             'genomad_status': genomad_status,
+             'checkv_status': checkv_statuses.get(seq_id, 'error')}
+            for seq_id, genomad_status in genomad_statuses.items()
+        ]
+
+    total_sequences = sum(len(batch) for batch in batches)
+    start = time.monotonic()
+    last_report = start
+    done_sequences = 0
+    submitted = 0
+    received = 0
+
+    def report_progress(force=False):
+        nonlocal last_report
+        now = time.monotonic()
+        if not force and now - last_report < progress_interval_s:
+            return
+        last_report = now
+        elapsed_h = (now - start) / 3600
+        rate = done_sequences / elapsed_h if elapsed_h > 0 else 0.0
+        remaining = total_sequences - done_sequences
+        eta = f"{remaining / rate:.1f} h" if rate > 0 else "inconnu"
+        logger.info(f"Progression: {done_sequences}/{total_sequences} séquences, "
+                    f"{rate:.0f} séquences/h, lots en attente geNomad: {len(batches) - submitted}, "
+                    f"file CheckV: {submitted - received}, ETA: {eta}")
+
+    init_metrics_file()
+    pool_args = {'initializer': init_worker_logging, 'initargs': (log_queue,)}
+    with Pool(genomad_workers, **pool_args) as genomad_pool, \
+            Pool(checkv_workers, **pool_args) as checkv_pool:
+        for batch, genomad_statuses in genomad_pool.imap_unordered(run_genomad_stage, batches):
+            checkv_pool.apply_async(
+                run_checkv_stage, (batch,),
+                callback=lambda st, g=genomad_statuses: finished.put(merge(g, st)),
+                error_callback=lambda e, g=genomad_statuses: finished.put(merge(g, {})))
+            submitted += 1
+            # Restituer au fil de l'eau les lots déjà passés par CheckV
+            while not finished.empty():
+                results = finished.get()
+                received += 1
+                done_sequences += len(results)
+                yield from results
+            report_progress()
+
+        while received < submitted:
+            results = finished.get()
+            received += 1
+            done_sequences += len(results)
+            yield from results
+            report_progress()
+    report_progress(force=True)
 
 # --- MAIN ---
 if __name__ == "__main__":
+    log_queue, log_listener = setup_logging()
+
     sequences = load_sequences()
     if not sequences:
         logger.error("Aucune séquence à traiter. Arrêt du script.")
+        log_listener.stop()
         exit(1)
 
-    initialize_status_file()
+    status_dict = initialize_status_file()
+    todo = [entry for entry in sequences if not is_finished(status_dict.get(str(entry[0])))]
+    logger.info(f"Séquences déjà terminées: {len(sequences) - len(todo)}, restantes: {len(todo)}")
 
-    results = []
-    with Pool(10) as pool:
-        results = pool.map(process_sequence, sequences)
+    journal = StatusJournal(journal_file)
+    store = results_store.connect(results_db)
+    packer = PackWriter(pack_dir, pack_shard_size) if pack_outputs else None
+    done = 0
+    try:
+        batches = make_batches(todo)
+        logger.info(f"{len(batches)} lots de {batch_size} séquences max")
 
-    # Mise à jour centralisée des statuts
-    for result in results:
-        update_status(
-            result['sequence_id'],
-            genomad_status=result['genomad_status'],
-            checkv_status=result['checkv_status']
-        )
+        # Chaque statut est journalisé dès que la séquence est terminée
+        for result in run_pipeline(batches, log_queue):
+            update_status(status_dict, journal, result)
+            try:
+                results_store.ingest_sequence(store, result['sequence_id'], output_dir)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'ajout de {result['sequence_id']} à {results_db}: {e}")
+            if packer is not None and is_finished(status_dict[str(result['sequence_id'])]):
+                try:
+                    packer.add_sequence(result['sequence_id'], output_dir)
+                except Exception as e:
+                    logger.error(f"Erreur lors de l'empaquetage de {result['sequence_id']}: {e}")
+            done += 1
+            if done % compact_every == 0:
+                compact_status(status_dict, journal)
+    finally:
+        compact_status(status_dict, journal)
+        journal.close()
+        store.close()
+        if packer is not None:
+            packer.close()
 
     logger.info("Traitement terminé!")
+    log_listener.stop()
@@ -1,10 +1,14 @@
 #!/bin/bash
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # === PARAMÈTRES ===
 ALIGNMENTS="votu_analysis/vOTUs_alignment.tsv"
 CLEANED="filtered_clean.tsv"
-MATRIX="vOTUs_braycurtis.mat"
+MATRIX="vOTUs_braycurtis.dmat"
 TREE="vOTUs.nwk"
+# Moteur neighbor-joining : rapidnj (défaut) ou numpy
+NJ_BACKEND="${NJ_BACKEND:-rapidnj}"
 BITSCORE_THRESHOLD=50
 
 # === ÉTAPE 1 : filtrage bitscore et extraction colonnes ===
@@ -20,10 +24,10 @@ cat filtered.tsv \
 
 # === ÉTAPE 3 : génération de la matrice Bray-Curtis ===
 echo "[INFO] Calcul de la matrice Bray-Curtis"
-python3 generate_bray_matrix.py "$CLEANED" "$MATRIX"
+python3 "$SCRIPT_DIR/generate_bray_matrix.py" "$CLEANED" "$MATRIX"
 
-# === ÉTAPE 4 : génération de l’arbre avec RapidNJ ===
-echo "[INFO] Construction de l’arbre phylogénétique avec RapidNJ"
-rapidnj -i pd "$MATRIX" -o t > "$TREE"
+# === ÉTAPE 4 : génération de l’arbre (RapidNJ par défaut, ou neighbor-joining numpy) ===
+echo "[INFO] Construction de l’arbre phylogénétique avec $NJ_BACKEND"
+python3 "$SCRIPT_DIR/neighbor_joining.py" --nj "$NJ_BACKEND" "$MATRIX" "$TREE"
 
 echo "[INFO] Arbre généré : $TREE"